@@ -1,13 +1,49 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from cache import HunkCache
+from collections import deque
+from contextlib import contextmanager, nullcontext, suppress
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from formats import Hunk
-from typing import List, Dict, Tuple
+from formats import ChangeType, Hunk, PatchFormat
+from functools import partial
+from itertools import chain, count
+from lines import LineIndex, LineRange
+from logs import LogFormat
+from shlex import quote
+from timing import Phase
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import asyncio
+import copy
+import csv
+import csymbols
+import daemon
+import dataclasses
+import fnmatch
 import formats
+import gc
+import gitstore
+import hashlib
+import io
 import json
+import locale
+import logs
+import mmap
+import native
 import os
+import report
+import shutil
+import signal
+import sqlite3
 import subprocess
 import sys
 import tempfile
+import timing
+
+# The files from this size on are mapped into memory rather than read, see lines.LineIndex
+MAPPED_FILE_SIZE = 64 << 20
+# The diffs and rejects from this size on are split at the boundaries of their hunks and parsed by a pool
+# of worker processes, see parse_patch_file
+PARALLEL_PARSE_SIZE = 16 << 20
 
 class System:
     @staticmethod
@@ -15,61 +51,809 @@ class System:
         return subprocess.run(command, shell=True, capture_output=True)
 
     @staticmethod
-    def diff(before: str, after: str, patch: str) -> subprocess.CompletedProcess:
-        return System.run(f'diff {before} {after} > {patch}')
+    def diff(before: str, after: str, patch: str, context: int = 0) -> subprocess.CompletedProcess:
+        options = f'-U {context} ' if context else ''
+        return System.run(f'diff {options}{quote(before)} {quote(after)} > {quote(patch)}')
 
     @staticmethod
     def patch(target: str, patch: str, reject: str) -> subprocess.CompletedProcess:
-        return System.run(f'patch -f -r {reject} {target} {patch}')
+        return System.run(f'patch -f -r {quote(reject)} {quote(target)} {quote(patch)}')
+
+    @staticmethod
+    def spawn(args: List[str], **kwargs) -> subprocess.Popen:
+        return subprocess.Popen(args, **kwargs)
+
+    @staticmethod
+    async def spawn_async(args: List[str], **kwargs) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(*args, **kwargs)
     
     @staticmethod
-    def read_lines(path: str) -> List[str]:
-        with open(path) as f:
+    def read_lines(path: str) -> Sequence[str]:
+        if os.path.getsize(path) >= MAPPED_FILE_SIZE:
+            return LineIndex(path)
+        with open(path, newline='\n', errors='surrogateescape') as f:
             return f.readlines()
 
-def get_patch_hunks(patch_file: str) -> Dict[id, Hunk]:
-    return {hunk.id: hunk for hunk in formats.parse_diff(System.read_lines(patch_file))}
+    @staticmethod
+    def iter_lines(path: str) -> Iterator[str]:
+        with open(path, newline='\n', errors='surrogateescape') as f:
+            yield from f
+
+    @staticmethod
+    def write_lines(path: str, lines: Iterable[str]):
+        with open(path, 'w', newline='\n', errors='surrogateescape') as f:
+            f.writelines(lines)
+
+    @staticmethod
+    def replace_lines(path: str, lines: Iterable[str]):
+        """Writes the lines into a new file replacing <path>, which keeps the lines mapped from it valid."""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'.{os.path.basename(path)}.')
+        try:
+            with open(fd, 'w', newline='\n', errors='surrogateescape') as f:
+                f.writelines(lines)
+            shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+class Engine(Enum):
+    NATIVE = 'native'
+    EXTERNAL = 'external'
+    PIPE = 'pipe'
+
+# The diff and patch utilities still merge faster than the native engine, see benchmarks/suite.py
+DEFAULT_ENGINE = Engine.EXTERNAL
+
+def get_digest(path: str) -> str:
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_hunks(before: str, after: str, context: int = 0) -> List[Hunk]:
+    with Phase('read') as phase:
+        before_lines, after_lines = System.read_lines(before), System.read_lines(after)
+        phase.count(lines=len(before_lines) + len(after_lines))
+    with Phase('diff') as phase:
+        hunks = native.diff(before_lines, after_lines, context)
+        phase.count(hunks=len(hunks))
+    return hunks
+
+def format_patch(hunks: Iterable[Hunk], context: int = 0) -> Iterator[str]:
+    """Formats the hunks in the unified format if they have been computed with <context> lines, in the
+    normal format otherwise."""
+    return formats.format_unified(hunks) if context else formats.format_diff(hunks)
+
+def iter_patch(lines: Iterable[str], context: int = 0) -> Iterator[Hunk]:
+    return formats.iter_unified(lines) if context else formats.iter_diff(lines)
+
+@contextmanager
+def pausing_gc():
+    """Suspends the cyclic garbage collector, whose passes triggered by allocating hundreds of thousands of
+    hunks take longer than parsing them although the hunks hold no cycles."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def parse_patch_segment(path: str, patch_format: PatchFormat, segment: Tuple[int, int]) -> List[Tuple]:
+    """Returns the hunks of the <segment> of <path> as tuples, see Hunk.to_tuple."""
+    begin, end = segment
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        text = f.read(end - begin).decode(locale.getpreferredencoding(False), errors='surrogateescape')
+    with pausing_gc():
+        # Split on line feeds only, the way System.iter_lines does
+        lines = io.StringIO(text, newline='\n')
+        return [hunk.to_tuple() for hunk in formats.parse_segment(lines, patch_format, first=begin == 0)]
+
+def parse_patch_file(path: str, patch_format: PatchFormat, jobs: Optional[int] = None) -> List[Hunk]:
+    """Parses the diff or reject file <path> split into a segment per worker process at the boundaries of its
+    hunks, which are found by scanning the mapped file. The hunks are returned in their order."""
+    jobs = jobs or os.cpu_count() or 1
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        segments = formats.find_segments(buffer, patch_format, jobs)
+    hunks = []
+    # The results are unpickled by a thread of the pool, which the pause covers as well
+    with pausing_gc():
+        for segment in run_parallel(partial(parse_patch_segment, path, patch_format), segments, jobs):
+            hunks.extend(map(Hunk.from_tuple, segment))
+    return hunks
+
+def is_parsed_in_parallel(path: str) -> bool:
+    return (os.cpu_count() or 1) > 1 and os.path.isfile(path) and os.path.getsize(path) >= PARALLEL_PARSE_SIZE
+
+def get_patch_hunks(patch_file: str, context: int = 0) -> Dict[id, Hunk]:
+    with Phase('parse_diff') as phase:
+        if is_parsed_in_parallel(patch_file):
+            patch_hunks = parse_patch_file(patch_file, PatchFormat.UNIFIED if context else PatchFormat.NORMAL)
+        else:
+            patch_hunks = iter_patch(System.iter_lines(patch_file), context)
+        hunks = {hunk.id: hunk for hunk in patch_hunks}
+        phase.count(hunks=len(hunks))
+    return hunks
+
+def update_rejected_hunks(hunks: Dict[int, Hunk], reject_file: str, context: int = 0, ignore_whitespace: bool = False):
+    # The patch utility writes the rejects of unified diffs in the unified format
+    with Phase('parse_reject') as phase:
+        if is_parsed_in_parallel(reject_file):
+            rejected = parse_patch_file(reject_file, PatchFormat.UNIFIED if context else PatchFormat.REJECT)
+        else:
+            lines = System.iter_lines(reject_file)
+            rejected = list(formats.iter_unified(lines)) if context else formats.parse_reject(lines)
+        phase.count(hunks=len(rejected))
+    with Phase('conflicts') as phase:
+        index = formats.HunkIndex(hunks.values())
+        for reject in rejected:
+            # The rejects found in no hunk of the difference are kept as they are
+            hunk = index.find(reject) or hunks.setdefault(reject.id, reject)
+            hunk.conflicts = get_conflicts(hunk, ignore_whitespace)
+        phase.count(hunks=len(rejected))
+
+# The hunks whose source and destination differ by more inserted and removed lines are mostly rewritten,
+# their lines are paired by position rather than aligned
+MAX_CONFLICT_COST = 256
+
+def get_conflicts(hunk: Hunk, ignore_whitespace: bool = False) -> Dict[int, Tuple[str, str]]:
+    """Returns the lines of the source of <hunk> which differ from the destination, each of them along with
+    the destination line it is replaced by, if any. The lines are aligned the way the native engine diffs
+    the files, so the lines inserted or removed by the hunk don't shift the others, unless the hunk
+    rewrites too many of them to be aligned in reasonable time. With <ignore_whitespace> the lines
+    differing in their whitespace only are the same."""
+    # Bodies of the hunks coming from the diff keep their line terminators, the ones from rejects don't
+    source = [line.rstrip('\n') for line in hunk.source.body or []]
+    destination = [line.rstrip('\n') for line in hunk.destination.body or []]
+    if ignore_whitespace:
+        a, b = native.intern_lines(map(native.normalize_whitespace, source), map(native.normalize_whitespace, destination))
+    else:
+        a, b = native.intern_lines(source, destination)
+    try:
+        edits = native.get_edits(a, b, MAX_CONFLICT_COST)
+    except native.CostExceeded:
+        # Every line of the source is paired with the destination line at the same position, if any
+        edits = [(i, i + 1, i, min(i + 1, len(b))) for i in range(len(a)) if i >= len(b) or a[i] != b[i]]
+    conflicts = {}
+    for a_begin, a_end, b_begin, b_end in edits:
+        # The lines inserted beyond the removed ones have no source line to be reported with
+        for i, j in zip(range(a_begin, a_end), count(b_begin)):
+            conflicts[hunk.source.begin + i] = (source[i], destination[j] if j < b_end else None)
+    return conflicts
+
+def write_patched(target: str, lines: Sequence[str], placements: List[native.Placement]):
+    with Phase('write') as phase:
+        # The lines mapped from the target are streamed into its replacement
+        write = System.replace_lines if isinstance(lines, LineRange) else System.write_lines
+        write(target, native.iter_patched(lines, placements))
+        phase.count(lines=len(lines) + sum(len(h.destination.body or []) - (end - begin) for begin, end, h in placements))
+
+def relocate_hunks(lines: Sequence[str], placements: List[native.Placement], rejected: List[Hunk],
+                   before: Optional[str] = None, before_lines: Optional[Sequence[str]] = None) -> Tuple[List[native.Placement], List[Hunk]]:
+    """Retries the <rejected> hunks in the symbols of the target which have moved, if the <before_lines>
+    of the difference are known or the path of its <before> file, read only when a hunk is rejected."""
+    if not rejected or before is None and before_lines is None:
+        return placements, rejected
+    with Phase('relocate') as phase:
+        if before_lines is None:
+            before_lines = System.read_lines(before)
+        relocated, still_rejected = csymbols.relocate(before_lines, lines, placements, rejected)
+        phase.count(lines=len(before_lines), hunks=len(rejected), relocated=len(rejected) - len(still_rejected))
+    return relocated, still_rejected
+
+def apply_hunks(target: str, hunks: Dict[int, Hunk], ignore_whitespace: bool = False, before: Optional[str] = None,
+                before_lines: Optional[Sequence[str]] = None) -> Dict[int, Hunk]:
+    with Phase('read') as phase:
+        lines = System.read_lines(target)
+        phase.count(lines=len(lines))
+    with Phase('apply') as phase:
+        placements, rejected = native.place(lines, hunks.values())
+        phase.count(hunks=len(hunks), rejected=len(rejected))
+    placements, rejected = relocate_hunks(lines, placements, rejected, before, before_lines)
+    write_patched(target, lines, placements)
+    with Phase('conflicts') as phase:
+        for hunk in rejected:
+            hunk.conflicts = get_conflicts(hunk, ignore_whitespace)
+        phase.count(hunks=len(rejected))
+    return hunks
+
+def check_hunks(target: str, hunks: Dict[int, Hunk], ignore_whitespace: bool = False, before: Optional[str] = None,
+                before_lines: Optional[Sequence[str]] = None) -> Dict[int, Hunk]:
+    """Finds the hunks apply_hunks would reject from <target> without modifying it or running the patch
+    utility. The conflicts are recorded on copies of the rejected hunks, so the hunks may be shared by
+    several targets."""
+    with Phase('read') as phase:
+        lines = System.read_lines(target)
+        phase.count(lines=len(lines))
+    with Phase('check') as phase:
+        placements, rejected = native.place(lines, hunks.values())
+        phase.count(hunks=len(hunks), rejected=len(rejected))
+    _, rejected = relocate_hunks(lines, placements, rejected, before, before_lines)
+    with Phase('conflicts') as phase:
+        result = dict(hunks)
+        for hunk in rejected:
+            result[hunk.id] = dataclasses.replace(hunk, conflicts=get_conflicts(hunk, ignore_whitespace))
+        phase.count(hunks=len(rejected))
+    return result
+
+def retry_hunks(target: str, hunks: Dict[int, Hunk], ignore_whitespace: bool = False) -> Dict[int, Hunk]:
+    """Checks the hunks of a previous merge into <target> against the target changed since. The hunks
+    found applied, by the previous merge or by hand, are no longer rejected, the others are placed again
+    and the ones applied previously which don't apply anymore are rejected. The hunks applied previously
+    which only remove lines can't be told applied without their context and are left as they are."""
+    with Phase('read') as phase:
+        lines = System.read_lines(target)
+        phase.count(lines=len(lines))
+    with Phase('retry') as phase:
+        applied = native.find_applied(lines, hunks.values())
+        # The hunks applied by hand or previously must not be applied once more
+        ids = {hunk.id for hunk in applied}
+        ids.update(hunk.id for hunk in hunks.values()
+                   if hunk.conflicts is None and hunk.type == ChangeType.DELETED and hunk.leading is None)
+        placements, rejected = native.place(lines, [hunk for hunk in hunks.values() if hunk.id not in ids])
+        phase.count(hunks=len(hunks), applied=len(applied), placed=len(placements), rejected=len(rejected))
+    if placements:
+        write_patched(target, lines, placements)
+    for hunk in chain(applied, (hunk for _, _, hunk in placements)):
+        hunk.conflicts = None
+    with Phase('conflicts'):
+        for hunk in rejected:
+            if hunk.conflicts is None:
+                hunk.conflicts = get_conflicts(hunk, ignore_whitespace)
+    return hunks
+
+def merge_incremental(before: str, after: str, target: str, previous: Optional[logs.Log], engine: Engine = DEFAULT_ENGINE,
+                      cache: Optional[HunkCache] = None, context: int = 0, ignore_whitespace: bool = False) -> Tuple[Dict[int, Hunk], Dict]:
+    """Merges the difference between <before> and <after> into <target> reusing the <previous> log of the
+    merge into it, if any. When the digests of <before> and <after> and the context recorded there are the
+    same, the hunks of the log are carried forward without computing the difference again and, if the
+    target has changed since, they are checked against it again, see retry_hunks. Returns the hunks along with the fields
+    to record in the log for the next merge."""
+    with Phase('digest'):
+        digests = {'before': get_digest(before), 'after': get_digest(after)}
+    hunks = None
+    if previous is not None:
+        previous_hunks = {hunk.id: hunk for hunk in previous.hunks}
+        recorded = previous.fields.get('digests', {})
+        if previous.fields.get('context') == context and all(recorded.get(key) == digests[key] for key in digests):
+            with Phase('digest'):
+                changed = get_digest(target) != recorded.get('target')
+            hunks = retry_hunks(target, previous_hunks, ignore_whitespace) if changed else previous_hunks
+    if hunks is None:
+        hunks = merge(before, after, target, engine, cache, context, ignore_whitespace=ignore_whitespace)
+    with Phase('digest'):
+        digests['target'] = get_digest(target)
+    return hunks, {'digests': digests, 'context': context}
+
+def read_previous_log(path: str, target: str) -> Optional[logs.Log]:
+    """Returns the log of the merge into <target> written into <path>, None if there is none."""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        for log in logs.iter_logs(f):
+            if log.fields.get('target') == target:
+                # The file is closed once the log is returned
+                return logs.Log(log.fields, iter(list(log.hunks)))
+    return None
+
+def diff_external(before: str, after: str, patch_file: str, context: int = 0) -> Dict[int, Hunk]:
+    with Phase('diff'):
+        diff = System.diff(before, after, patch_file, context)
+    if diff.returncode > 1:
+        raise RuntimeError(f'Failed to compute difference between {before} and {after}')
+    return get_patch_hunks(patch_file, context)
+
+def patch_external(target: str, hunks: Dict[int, Hunk], patch_file: str, reject_file: str, context: int = 0,
+                   ignore_whitespace: bool = False) -> Dict[int, Hunk]:
+    with Phase('patch'):
+        patch = System.patch(target, patch_file, reject_file)
+    if patch.returncode == 2:
+        raise RuntimeError(f'Error occurred while patching the target: {patch.stderr}') 
+
+    if patch.returncode == 1:
+        update_rejected_hunks(hunks, reject_file, context, ignore_whitespace)
+    return hunks
+
+def decode_line(line: bytes) -> str:
+    return line.decode(errors='surrogateescape')
+
+def text_stream(stream) -> io.TextIOWrapper:
+    return io.TextIOWrapper(stream, newline='\n', errors='surrogateescape', write_through=True)
+
+def tee(lines: Iterable[str], sink) -> Iterator[str]:
+    for line in lines:
+        sink.write(line)
+        yield line
+
+def diff_pipe(before: str, after: str, sink=None, context: int = 0) -> Dict[int, Hunk]:
+    """Runs the diff utility without a shell parsing its output as it arrives. The output is also
+    copied into <sink> if provided."""
+    options = ['-U', str(context)] if context else []
+    with Phase('diff') as phase, System.spawn(['diff', *options, before, after], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as diff:
+        lines = text_stream(diff.stdout)
+        hunks = {hunk.id: hunk for hunk in iter_patch(tee(lines, sink) if sink else lines, context)}
+        stderr = diff.stderr.read()
+        phase.count(hunks=len(hunks))
+    if diff.returncode > 1:
+        raise RuntimeError(f'Failed to compute difference between {before} and {after}: {decode_line(stderr)}')
+    return hunks
+
+def merge_pipe(target: str, hunks: Optional[Dict[int, Hunk]], reject_file: str, before: str = None, after: str = None,
+               context: int = 0, ignore_whitespace: bool = False) -> Dict[int, Hunk]:
+    """Merges <hunks> into <target> feeding them into the patch utility through a pipe. If no hunks are
+    provided, the output of diff between <before> and <after> is streamed into patch while being parsed."""
+    patch = System.spawn(['patch', '-f', '-r', reject_file, target], stdin=subprocess.PIPE,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    sink = text_stream(patch.stdin)
+    try:
+        if hunks is None:
+            hunks = diff_pipe(before, after, sink, context)
+        else:
+            sink.writelines(format_patch(hunks.values(), context))
+        sink.close()
+    except BrokenPipeError:
+        # patch has exited prematurely, its exit code tells why
+        with suppress(BrokenPipeError):
+            sink.close()
+    except BaseException:
+        # Don't let patch apply a partially written difference
+        patch.kill()
+        with suppress(BrokenPipeError):
+            sink.close()
+        patch.wait()
+        raise
+    with Phase('patch'):
+        # The time patch needs once the whole difference has been streamed into it
+        stderr = patch.stderr.read()
+        patch.stderr.close()
+        patch.wait()
+    if patch.returncode == 2:
+        raise RuntimeError(f'Error occurred while patching the target: {decode_line(stderr)}')
+
+    if patch.returncode == 1:
+        update_rejected_hunks(hunks, reject_file, context, ignore_whitespace)
+    return hunks
 
-def update_rejected_hunks(hunks: Dict[int, Hunk], reject_file: str):
-    for hunk in formats.parse_reject(System.read_lines(reject_file)):
-        hunks.setdefault(hunk.id, hunk).conflicts = get_conflicts(hunk)
+# Long enough for the lines of any sensible source file, asyncio limits them to 64 KiB by default
+_STREAM_LIMIT = 1 << 24
 
-def get_conflicts(hunk: Hunk) -> Dict[int, Tuple[str, str]]:
-    lines = {i: l for i, l in zip(range(hunk.destination.begin, hunk.destination.end + 1), hunk.destination.body)}
-    return {
-        i: (l, lines.get(i))
-        for i, l in zip(range(hunk.source.begin, hunk.source.end + 1), hunk.source.body)
-            if l != lines.get(i)
-    }
+async def diff_async(before: str, after: str, sink: Optional[asyncio.StreamWriter] = None) -> Dict[int, Hunk]:
+    """Counterpart of diff_pipe which doesn't block the event loop. The output of diff is parsed as it
+    arrives and copied into <sink> if provided."""
+    with Phase('diff') as phase:
+        diff = await System.spawn_async(['diff', before, after], stdout=subprocess.PIPE, stderr=subprocess.PIPE, limit=_STREAM_LIMIT)
+        parser = formats.DiffParser()
+        hunks = {}
+        try:
+            async for line in diff.stdout:
+                if sink:
+                    sink.write(line)
+                    await sink.drain()
+                if hunk := parser.feed(decode_line(line)):
+                    hunks[hunk.id] = hunk
+            if hunk := parser.close():
+                hunks[hunk.id] = hunk
+            stderr = await diff.stderr.read()
+            await diff.wait()
+        except BaseException:
+            with suppress(ProcessLookupError):
+                diff.kill()
+            await diff.wait()
+            raise
+        phase.count(hunks=len(hunks))
+    if diff.returncode > 1:
+        raise RuntimeError(f'Failed to compute difference between {before} and {after}: {decode_line(stderr)}')
+    return hunks
+
+async def merge_pipe_async(target: str, hunks: Optional[Dict[int, Hunk]], reject_file: str, before: str = None,
+                           after: str = None) -> Dict[int, Hunk]:
+    """Counterpart of merge_pipe which doesn't block the event loop."""
+    patch = await System.spawn_async(['patch', '-f', '-r', reject_file, target], stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        if hunks is None:
+            hunks = await diff_async(before, after, patch.stdin)
+        else:
+            for line in formats.format_diff(hunks.values()):
+                patch.stdin.write(line.encode(errors='surrogateescape'))
+                await patch.stdin.drain()
+        patch.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # patch has exited prematurely, its exit code tells why
+        pass
+    except BaseException:
+        # Don't let patch apply a partially written difference, the task may also have been cancelled
+        with suppress(ProcessLookupError):
+            patch.kill()
+        await patch.wait()
+        raise
+    with Phase('patch'):
+        stderr = await patch.stderr.read()
+        await patch.wait()
+    if patch.returncode == 2:
+        raise RuntimeError(f'Error occurred while patching the target: {decode_line(stderr)}')
+
+    if patch.returncode == 1:
+        update_rejected_hunks(hunks, reject_file)
+    return hunks
+
+async def merge_async(before: str, after: str, target: str, limiter: Optional[asyncio.Semaphore] = None) -> Dict[int, Hunk]:
+    """Counterpart of merge with the pipe engine for asyncio. The merges sharing <limiter> don't run more
+    processes at a time than it allows, so that any number of them can be scheduled at once."""
+    async with limiter or nullcontext():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            return await merge_pipe_async(target, None, os.path.join(temp_dir, 'reject'), before, after)
+
+async def merge_all_async(triples: Iterable[Tuple[str, str, str]], concurrency: Optional[int] = None) -> List[Union[Dict[int, Hunk], Exception]]:
+    """Merges every (before, after, target) triple running at most <concurrency> merges at a time,
+    the number of CPUs by default. The failures are returned in place of the results."""
+    limiter = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+    return await asyncio.gather(*(merge_async(*triple, limiter) for triple in triples), return_exceptions=True)
+
+def compute_hunks(before: str, after: str, engine: Engine, patch_file: Optional[str], cache: Optional[HunkCache] = None,
+                  context: int = 0) -> Dict[int, Hunk]:
+    """Computes the hunks between <before> and <after> looking them up in <cache> first, with <context>
+    lines around them if it is positive. For the external engine the difference is also written into
+    <patch_file> for the patch utility."""
+    key, cached = None, None
+    if cache:
+        with Phase('cache') as phase:
+            key = cache.get_key(get_digest(before), get_digest(after), context)
+            cached = cache.get(key)
+            phase.count(hits=int(cached is not None))
+    if cached is not None:
+        if engine == Engine.EXTERNAL:
+            System.write_lines(patch_file, format_patch(cached, context))
+        return {hunk.id: hunk for hunk in cached}
+
+    if engine == Engine.NATIVE:
+        hunks = {hunk.id: hunk for hunk in get_hunks(before, after, context)}
+    elif engine == Engine.PIPE:
+        hunks = diff_pipe(before, after, context=context)
+    else:
+        hunks = diff_external(before, after, patch_file, context)
+    if cache:
+        cache.put(key, list(hunks.values()))
+    return hunks
+
+def merge(before: str, after: str, target: str, engine: Engine = DEFAULT_ENGINE, cache: Optional[HunkCache] = None,
+          context: int = 0, check: bool = False, ignore_whitespace: bool = False) -> Dict[int, Hunk]:
+    """Merges the difference between <before> and <after> into <target>. With a positive <context> the
+    difference is computed in the unified format, the context lines helping to locate the hunks in the
+    target. With <check> the target is left untouched, the hunks which would be rejected being found by
+    check_hunks whatever the engine computing the difference. With <ignore_whitespace> the conflicts of
+    the rejected hunks leave out the lines differing in their whitespace only."""
+    if check:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hunks = compute_hunks(before, after, engine, os.path.join(temp_dir, 'diff.patch'), cache, context)
+        return check_hunks(target, hunks, ignore_whitespace, before)
+    if engine == Engine.NATIVE:
+        return apply_hunks(target, compute_hunks(before, after, engine, None, cache, context), ignore_whitespace, before)
 
-def merge(before: str, after: str, target: str) -> Dict[int, Hunk]:
     with tempfile.TemporaryDirectory() as temp_dir:
-        hunks = None
-    
+        reject_file = os.path.join(temp_dir, 'reject')
+        if engine == Engine.PIPE:
+            if not cache:
+                return merge_pipe(target, None, reject_file, before, after, context, ignore_whitespace)
+            with Phase('cache') as phase:
+                key = cache.get_key(get_digest(before), get_digest(after), context)
+                cached = cache.get(key)
+                phase.count(hits=int(cached is not None))
+            hunks = merge_pipe(target, None if cached is None else {hunk.id: hunk for hunk in cached}, reject_file, before, after, context,
+                               ignore_whitespace)
+            if cached is None:
+                cache.put(key, list(hunks.values()))
+            return hunks
+
         patch_file = os.path.join(temp_dir, 'diff.patch')
-        diff = System.diff(before, after, patch_file)
-        if diff.returncode > 1:
-            raise RuntimeError(f'Failed to compute difference between {before} and {after}')
-        hunks = get_patch_hunks(patch_file)
+        hunks = compute_hunks(before, after, engine, patch_file, cache, context)
+        return patch_external(target, hunks, patch_file, os.path.join(temp_dir, 'reject'), context, ignore_whitespace)
 
-        reject_file = os.path.join(temp_dir, 'reject')
-        patch = System.patch(target, patch_file, reject_file)
-        if patch.returncode == 2:
-            raise RuntimeError(f'Error occurred while patching the target: {patch.stderr}') 
-
-        if patch.returncode == 1:
-            update_rejected_hunks(hunks, reject_file)
-        
-        return hunks 
-
-def get_log(before: str, after: str, target: str, hunks: List[Hunk]) -> Dict:
-    return {
-        'before': before,
-        'after': after,
-        'target': target,
-        'hunks': [hunk.to_dict() for hunk in hunks]
-    }
+def merge_target(target_and_reject: Tuple[str, str], hunks: Dict[int, Hunk], engine: Engine, patch_file: str,
+                 profile: bool = False, context: int = 0, check: bool = False,
+                 ignore_whitespace: bool = False, before: Optional[str] = None) -> Tuple[Union[Dict[int, Hunk], Exception], Optional[timing.Timings]]:
+    target, reject_file = target_and_reject
+    if not check:
+        hunks = copy.deepcopy(hunks)
+    with timing.profiling() if profile else nullcontext() as session:
+        try:
+            if check:
+                result = check_hunks(target, hunks, ignore_whitespace, before)
+            elif engine == Engine.NATIVE:
+                result = apply_hunks(target, hunks, ignore_whitespace, before)
+            elif engine == Engine.PIPE:
+                result = merge_pipe(target, hunks, reject_file, context=context, ignore_whitespace=ignore_whitespace)
+            else:
+                result = patch_external(target, hunks, patch_file, reject_file, context, ignore_whitespace)
+        except Exception as e:
+            result = e
+    return result, session and session.to_dict()
+
+def merge_many(before: str, after: str, targets: List[str], engine: Engine = DEFAULT_ENGINE, workers: Optional[int] = None,
+               cache: Optional[HunkCache] = None, context: int = 0, check: bool = False,
+               ignore_whitespace: bool = False) -> Dict[str, Union[Dict[int, Hunk], Exception]]:
+    """Merges the difference between <before> and <after> into every target, or only checks it with
+    <check>. The difference is computed only once and applied to the targets by a pool of worker
+    processes. The failure of a target is returned as its result instead of being raised."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        patch_file = os.path.join(temp_dir, 'diff.patch')
+        hunks = compute_hunks(before, after, engine, patch_file, cache, context)
+        items = [(target, os.path.join(temp_dir, f'reject.{i}')) for i, target in enumerate(targets)]
+        results = {}
+        merge_one = partial(merge_target, hunks=hunks, engine=engine, patch_file=patch_file, profile=timing.is_profiling(),
+                            context=context, check=check, ignore_whitespace=ignore_whitespace, before=before)
+        for target, (result, timings) in zip(targets, run_parallel(merge_one, items, workers)):
+            results[target] = result
+            timing.add_timings(timings or {})
+        return results
+
+def get_log(before: str, after: str, target: str, hunks: List[Hunk], cache_counters: Optional[Dict[str, int]] = None,
+            timings: Optional[timing.Timings] = None) -> Dict:
+    log = get_log_fields(before, after, target)
+    log['hunks'] = [hunk.to_dict() for hunk in hunks]
+    if cache_counters is not None:
+        log['cache'] = cache_counters
+    if timings is not None:
+        log['timings'] = timings
+    return log
+
+def get_log_fields(before: str, after: str, target: str) -> Dict:
+    return {'before': before, 'after': after, 'target': target}
+
+def format_log(before: str, after: str, target: str, hunks: Dict[int, Hunk], get_trailer: Callable[[], Optional[Dict]] = dict,
+               log_format: LogFormat = LogFormat.JSON) -> Iterator[str]:
+    """Streams the log get_log would build, converting the hunks one by one."""
+    return logs.format_log(get_log_fields(before, after, target), map(Hunk.to_dict, formats.sort_hunks(hunks)), get_trailer,
+                           log_format)
+
+def write_json(path: str, data: Dict):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def run_parallel(function: Callable, items: Iterable, jobs: Optional[int] = None) -> Iterator:
+    """Yields the results of <function> applied to <items> in their order, running at most <jobs> worker
+    processes and keeping at most twice as many items submitted at a time."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+
+def call_safely(function: Callable, *args):
+    """Returns the result of <function> or the exception it raised, e.g. to run it in a worker process."""
+    try:
+        return function(*args)
+    except Exception as e:
+        return e
+
+class JobStatus(Enum):
+    SUCCESS = 'success'
+    CONFLICT = 'conflict'
+    ERROR = 'error'
+
+def read_manifest(path: str) -> List[Dict[str, str]]:
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            jobs = list(csv.DictReader(f))
+        else:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    for i, job in enumerate(jobs, 1):
+        missing = [key for key in ('before', 'after', 'target') if not job.get(key)]
+        if missing:
+            raise ValueError(f'Entry {i} of the manifest "{path}" misses {", ".join(missing)}')
+    return jobs
+
+def merge_job(job: Dict[str, str], engine: Engine = DEFAULT_ENGINE, keep_hunks: bool = False, cache: Optional[HunkCache] = None,
+              profile: bool = False, context: int = 0, log_format: LogFormat = LogFormat.JSON, check: bool = False,
+              ignore_whitespace: bool = False) -> Dict:
+    """Merges a single manifest entry writing its log if requested. The failures are reported in the
+    result instead of being raised so that they don't affect the other entries. The target of an entry
+    whose before is the null device is created, the file having been added."""
+    result = {'before': job['before'], 'after': job['after'], 'target': job['target']}
+    counters = dict(cache.counters) if cache else None
+    try:
+        target = job['target']
+        # The file has been added
+        if job['before'] == os.devnull:
+            create_added_file(target, check)
+            if check:
+                # The hunks are checked against the empty file the target would be created as
+                target = os.devnull
+        for path in (job['before'], job['after'], target):
+            if path != os.devnull:
+                ensure_existing_file(path)
+        with timing.profiling() if profile else nullcontext() as session:
+            hunks = merge(job['before'], job['after'], target, engine, cache, context, check, ignore_whitespace)
+        timings = session and session.to_dict()
+        if timings:
+            result['timings'] = timings
+        if cache:
+            counters = {name: value - counters[name] for name, value in cache.counters.items()}
+            result['cache'] = counters
+        if job.get('log'):
+            trailer = {key: result[key] for key in ('cache', 'timings') if key in result}
+            logs.write_log(job['log'], format_log(job['before'], job['after'], job['target'], hunks, lambda: trailer, log_format))
+    except Exception as e:
+        return set_error(result, e)
+    return set_status(result, formats.sort_hunks(hunks), keep_hunks)
+
+def create_added_file(target: str, check: bool = False):
+    """Creates the empty <target> of a file added by the change unless only checking. An existing target
+    is not merged into, the whole file would be inserted in front of its content."""
+    if os.path.exists(target):
+        raise ValueError(f'The added file "{target}" already exists in the target')
+    if not check:
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        open(target, 'w').close()
+
+def set_error(result: Dict, error: Exception) -> Dict:
+    result['status'] = JobStatus.ERROR.value
+    result['error'] = str(error.args[0] if error.args else error)
+    return result
+
+def set_status(result: Dict, hunks: List[Hunk], keep_hunks: bool) -> Dict:
+    rejected = sum(hunk.conflicts is not None for hunk in hunks)
+    result['status'] = (JobStatus.CONFLICT if rejected else JobStatus.SUCCESS).value
+    result['rejected'] = rejected
+    if keep_hunks:
+        result['hunks'] = [hunk.to_dict() for hunk in hunks]
+    return result
+
+def get_summary(results: List[Dict], cache: Optional[HunkCache] = None, profile: bool = False) -> Dict:
+    summary = {status.value: sum(r['status'] == status.value for r in results) for status in JobStatus}
+    if cache:
+        summary['cache'] = {name: sum(r.get('cache', {}).get(name, 0) for r in results) for name in cache.counters}
+    if profile:
+        summary['timings'] = timing.merge_timings([r['timings'] for r in results if 'timings' in r])
+    return summary
+
+def merge_batch(jobs: Iterable[Dict[str, str]], engine: Engine = DEFAULT_ENGINE, workers: Optional[int] = None,
+                keep_hunks: bool = False, cache: Optional[HunkCache] = None, profile: bool = False, context: int = 0,
+                log_format: LogFormat = LogFormat.JSON, check: bool = False, ignore_whitespace: bool = False) -> Dict:
+    merge_one = partial(merge_job, engine=engine, keep_hunks=keep_hunks, cache=cache, profile=profile, context=context,
+                        log_format=log_format, check=check, ignore_whitespace=ignore_whitespace)
+    results = list(run_parallel(merge_one, jobs, workers))
+    return {'summary': get_summary(results, cache, profile), 'jobs': results}
+
+def is_unchanged(before: str, after: str) -> bool:
+    return os.path.getsize(before) == os.path.getsize(after) and get_digest(before) == get_digest(after)
+
+def pair_tree_files(before_dir: str, after_dir: str, target_dir: str, pattern: str = '*') -> Iterator[Dict[str, str]]:
+    """Yields the (before, after, target) triples of the files matching <pattern> in <after_dir> paired by
+    their relative path, skipping the files which are identical in <before_dir> and <after_dir>. The files
+    missing from <before_dir> have been added, their before is the null device so that they are created
+    in the target."""
+    for root, dirs, files in os.walk(after_dir):
+        dirs.sort()
+        for name in sorted(fnmatch.filter(files, pattern)):
+            after = os.path.join(root, name)
+            relative = os.path.relpath(after, after_dir)
+            before = os.path.join(before_dir, relative)
+            if not os.path.isfile(before):
+                before = os.devnull
+            elif is_unchanged(before, after):
+                continue
+            yield {'before': before, 'after': after, 'target': os.path.join(target_dir, relative)}
+
+def merge_tree(before_dir: str, after_dir: str, target_dir: str, pattern: str = '*', engine: Engine = DEFAULT_ENGINE,
+               workers: Optional[int] = None, cache: Optional[HunkCache] = None, profile: bool = False, context: int = 0,
+               check: bool = False, ignore_whitespace: bool = False) -> Dict:
+    files = pair_tree_files(before_dir, after_dir, target_dir, pattern)
+    result = merge_batch(files, engine, workers, keep_hunks=True, cache=cache, profile=profile, context=context, check=check,
+                         ignore_whitespace=ignore_whitespace)
+    return {'before': before_dir, 'after': after_dir, 'target': target_dir, 'summary': result['summary'], 'files': result['jobs']}
     
+def diff_blobs(job: Dict, cache: Optional[HunkCache] = None, context: int = 0) -> Dict[int, Hunk]:
+    # The identifiers of git blobs are hashes of their contents as well
+    key, hunks = None, None
+    if cache:
+        with Phase('cache') as phase:
+            key = cache.get_key(job['before_id'] or '', job['after_id'] or '', context)
+            hunks = cache.get(key)
+            phase.count(hits=int(hunks is not None))
+    if hunks is None:
+        with Phase('diff') as phase:
+            hunks = native.diff(job['before_lines'], job['after_lines'], context)
+            phase.count(hunks=len(hunks))
+        if cache:
+            cache.put(key, hunks)
+    return {hunk.id: hunk for hunk in hunks}
+
+def merge_blob_job(job: Dict, cache: Optional[HunkCache] = None, profile: bool = False, context: int = 0,
+                   check: bool = False, ignore_whitespace: bool = False) -> Dict:
+    """Merges the difference between the blobs read from git into the target of <job> on disk, or only
+    checks it with <check>, the failures being reported in the result the same way merge_job does."""
+    result = {'before': job['before'], 'after': job['after'], 'target': job['target']}
+    counters = dict(cache.counters) if cache else None
+    try:
+        # The file has been added
+        added = job['before_id'] is None
+        if added:
+            create_added_file(job['target'], check)
+        else:
+            ensure_existing_file(job['target'])
+        with timing.profiling() if profile else nullcontext() as session:
+            hunks = diff_blobs(job, cache, context)
+            if not check:
+                hunks = apply_hunks(job['target'], hunks, ignore_whitespace, before_lines=job['before_lines'])
+            elif not added:
+                hunks = check_hunks(job['target'], hunks, ignore_whitespace, before_lines=job['before_lines'])
+            hunks = formats.sort_hunks(hunks)
+        if session:
+            result['timings'] = session.to_dict()
+        if cache:
+            result['cache'] = {name: value - counters[name] for name, value in cache.counters.items()}
+    except Exception as e:
+        return set_error(result, e)
+    return set_status(result, hunks, keep_hunks=True)
+
+def iter_blob_jobs(repository: str, before: str, after: str, paths: Iterable[str], target_dir: str) -> Iterator[Dict]:
+    with gitstore.GitStore(repository) as store:
+        for path in paths:
+            with Phase('read') as phase:
+                before_id, before_lines = store.read_lines(before, path)
+                after_id, after_lines = store.read_lines(after, path)
+                phase.count(lines=len(before_lines) + len(after_lines))
+            yield {
+                'before': f'{before}:{path}', 'after': f'{after}:{path}', 'target': os.path.join(target_dir, path),
+                'before_id': before_id, 'before_lines': before_lines, 'after_id': after_id, 'after_lines': after_lines
+            }
+
+def merge_git(repository: str, before: str, after: str, pathspecs: Iterable[str] = (), target_dir: Optional[str] = None,
+              workers: Optional[int] = None, cache: Optional[HunkCache] = None, profile: bool = False, context: int = 0,
+              check: bool = False, ignore_whitespace: bool = False) -> Dict:
+    """Backports the changes of the files matching <pathspecs> between the commits <before> and <after> of
+    <repository> into the files with the same relative paths in <target_dir>, the working tree of the
+    repository by default. The blobs are read through a single git process and diffed in memory, a file
+    missing from one of the commits is considered empty and the added files are created in the target.
+    With <check> the target files are left untouched."""
+    before, after = gitstore.resolve(repository, before), gitstore.resolve(repository, after)
+    paths = gitstore.list_changed_paths(repository, before, after, list(pathspecs))
+    target_dir = target_dir or repository
+    jobs = iter_blob_jobs(repository, before, after, paths, target_dir)
+    results = list(run_parallel(partial(merge_blob_job, cache=cache, profile=profile, context=context, check=check,
+                                        ignore_whitespace=ignore_whitespace), jobs, workers))
+    return {'repository': repository, 'before': before, 'after': after, 'target': target_dir,
+            'summary': get_summary(results, cache, profile), 'files': results}
+
+def merge_request(request: Dict, engine: Engine = DEFAULT_ENGINE, cache: Optional[HunkCache] = None, context: int = 0) -> Dict:
+    """Handles a merge request of the daemon. The response holds the status of the merge along with
+    the log produced by get_log or the error."""
+    missing = [key for key in ('before', 'after', 'target') if not request.get(key)]
+    if missing:
+        return {'status': JobStatus.ERROR.value, 'error': f'The request misses {", ".join(missing)}'}
+    engine = Engine(request.get('engine', engine.value))
+    result = merge_job(request, engine, keep_hunks=True, cache=cache, profile=request.get('profile', False),
+                       context=int(request.get('context', context)))
+    if result['status'] == JobStatus.ERROR.value:
+        return {'status': result['status'], 'error': result['error']}
+    log = {key: result[key] for key in ('before', 'after', 'target', 'hunks', 'cache', 'timings') if key in result}
+    return {'status': result['status'], 'rejected': result['rejected'], 'log': log}
+
+def serve(path: str, engine: Engine = DEFAULT_ENGINE, workers: Optional[int] = None, cache: Optional[HunkCache] = None,
+          context: int = 0):
+    """Serves the merge requests received on the Unix socket <path> until interrupted. The requests of
+    the concurrent connections are merged by a pool of <workers> processes which stay warm between them."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as executor:
+        if executor:
+            handle = lambda request: executor.submit(merge_request, request, engine, cache, context).result()
+        else:
+            handle = partial(merge_request, engine=engine, cache=cache, context=context)
+        with daemon.Server(path, handle) as server:
+            with suppress(KeyboardInterrupt):
+                server.serve_forever()
+
 class ExitCodes(Enum):
     SUCCESS = 0
     BAD_ARGUMENT = 1
@@ -79,36 +863,372 @@ def ensure_existing_file(path: str):
     if not os.path.isfile(path):
         raise ValueError(f'The path "{path}" does not designate an existing file')
 
-def run_merge():
+def add_engine_argument(parser: ArgumentParser):
+    parser.add_argument('-e', '--engine', choices=[e.value for e in Engine], default=DEFAULT_ENGINE.value,
+        help='The way the changes are merged: "native" computes and applies the difference in-process, "external" '
+        'invokes the diff and patch utilities through a shell and temporary files, "pipe" executes them directly '
+        'streaming the output of diff into patch. Defaults to "external".')
+
+def add_context_argument(parser: ArgumentParser):
+    parser.add_argument('-U', '--context', type=int, default=0, help='The number of context lines around every hunk. When '
+        'positive the difference is computed in the unified format and the context lines help to locate the hunks in '
+        'targets which have drifted, up to two of them being ignored if needed. Defaults to 0, the normal format.')
+
+def check_jobs_argument(args):
+    if args.jobs is not None and args.jobs < 1:
+        sys.stderr.write('ERROR: The number of jobs must be positive\n')
+        sys.exit(ExitCodes.BAD_ARGUMENT.value)
+
+def check_context_argument(args):
+    if args.context < 0:
+        sys.stderr.write('ERROR: The number of context lines must not be negative\n')
+        sys.exit(ExitCodes.BAD_ARGUMENT.value)
+
+def add_cache_arguments(parser: ArgumentParser):
+    parser.add_argument('--cache', dest='cache_dir', help='The directory of the cache of the computed differences. '
+        'The differences between the files with the same contents are then computed only once.')
+    parser.add_argument('--cache-size', type=int, default=256, help='The maximal size of the cache in megabytes. '
+        'The least recently used entries are evicted first. Defaults to 256.')
+
+def add_log_format_argument(parser: ArgumentParser):
+    parser.add_argument('--log-format', choices=[f.value for f in LogFormat], default=LogFormat.JSON.value,
+        help='The format of the logs of the merges: an indented JSON document or JSON Lines with a record per '
+        'hunk.')
+
+def add_check_argument(parser: ArgumentParser):
+    parser.add_argument('--check', action='store_true', help='Only check which hunks apply to the targets, which are left '
+        'untouched. The status and the number of rejected hunks of every target are written to the standard output, '
+        'the hunks which would be rejected are marked in the log with their conflicts.')
+
+def add_ignore_whitespace_argument(parser: ArgumentParser):
+    parser.add_argument('-w', '--ignore-whitespace', action='store_true', help='Leave the lines differing in their '
+        'whitespace only out of the conflicts of the rejected hunks. The hunks are located the same way.')
+
+def add_profile_argument(parser: ArgumentParser):
+    parser.add_argument('--profile', action='store_true', help='Measure the duration of every phase of the merge. '
+        'The timings are written to the standard error and into the log.')
+
+def get_cache(args: Namespace) -> Optional[HunkCache]:
+    return HunkCache(args.cache_dir, args.cache_size << 20) if args.cache_dir else None
+
+def write_check(target: str, hunks: Union[Dict[int, Hunk], Exception]):
+    result = {'target': target}
+    if isinstance(hunks, Exception):
+        set_error(result, hunks)
+    else:
+        set_status(result, list(hunks.values()), keep_hunks=False)
+    sys.stdout.write(json.dumps(result) + '\n')
+
+def run_merge(argv: Optional[List[str]] = None):
     parser = ArgumentParser(
         prog='backport',
         description='Backport changes in C files. The tool computes the difference between the files ' 
-        '<before> and <after> and merges them into the file designated by <target>. If --log option is '
+        '<before> and <after> and merges them into the file designated by <target>. If several targets are '
+        'provided the difference is computed once and merged into every target in parallel. If --log option is '
         'specified the detailed information on merged and conflicting hunks is additionally written to '
-        'the provided file in JSON format.'
+        'the provided file in JSON format, as a list of logs of every target when there are several of them.'
     )
     parser.add_argument('before', help='The original file path')
     parser.add_argument('after', help='The file containing the changes to be backported')
-    parser.add_argument('target', help='The file to incorporate the changes into')
+    parser.add_argument('target', nargs='+', help='The file to incorporate the changes into')
     parser.add_argument('-l', '--log', action='store', dest='log_file', help='The path of the JSON file to write the operations into.')
-    args = parser.parse_args()
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes merging several targets. '
+        'Defaults to the number of CPUs.')
+    add_engine_argument(parser)
+    add_context_argument(parser)
+    add_log_format_argument(parser)
+    add_cache_arguments(parser)
+    add_check_argument(parser)
+    add_ignore_whitespace_argument(parser)
+    parser.add_argument('--incremental', action='store_true', help='Reuse the log of the previous merge into the target, '
+        'which must be written into the same file. When <before> and <after> are unchanged since, only the hunks '
+        'rejected then are retried, the hunks applied by hand being no longer rejected.')
+    add_profile_argument(parser)
+    args = parser.parse_args(argv)
+    check_context_argument(args)
+    check_jobs_argument(args)
     try:
-        for path in (args.before, args.after, args.target):
+        for path in (args.before, args.after, *args.target):
            ensure_existing_file(path)
+        if args.incremental and (not args.log_file or len(args.target) > 1 or args.check):
+            raise ValueError('The incremental merge requires a log and a single target and can\'t be checked')
     except ValueError as e:
         sys.stderr.write(f'ERROR: {e.args[0]}\n')
         sys.exit(ExitCodes.BAD_ARGUMENT.value)
 
+    if len(args.target) > 1:
+        run_merge_many(args)
+        return
+
+    [target] = args.target
     try:
-        hunks = merge(args.before, args.after, args.target)
-        if args.log_file:
-            with open(args.log_file, 'w') as f:
-                log = get_log(args.before, args.after, args.target, sorted(hunks.values(), key=lambda h: h.id))
-                f.write(json.dumps(log, indent=2))
+        cache = get_cache(args)
+        with timing.profiling() if args.profile else nullcontext() as session:
+            recorded = {}
+            if args.incremental:
+                hunks, recorded = merge_incremental(args.before, args.after, target, read_previous_log(args.log_file, target),
+                                                    Engine(args.engine), cache, args.context, args.ignore_whitespace)
+            else:
+                hunks = merge(args.before, args.after, target, Engine(args.engine), cache, args.context, args.check,
+                              args.ignore_whitespace)
+            if args.check:
+                write_check(target, hunks)
+            if args.log_file:
+                def get_trailer() -> Dict:
+                    # Known once the hunks are written, the timings cover the serialization of the hunks
+                    trailer = {'cache': cache.counters} if cache else {}
+                    trailer.update(recorded)
+                    if session:
+                        trailer['timings'] = session.to_dict()
+                    return trailer
+
+                with Phase('write_log') as phase:
+                    logs.write_log(args.log_file, format_log(args.before, args.after, target, hunks, get_trailer,
+                                                             LogFormat(args.log_format)))
+                    phase.count(hunks=len(hunks))
+        if session:
+            sys.stderr.write(timing.format_timings(session.to_dict()))
 
     except Exception as e:
         sys.stderr.write(f'ERROR: {e.args[0]}\n')
         sys.exit(ExitCodes.RUNTIME_ERROR.value)
 
+def run_merge_many(args):
+    with timing.profiling() if args.profile else nullcontext() as session:
+        try:
+            cache = get_cache(args)
+            results = merge_many(args.before, args.after, args.target, Engine(args.engine), args.jobs, cache, args.context,
+                                 args.check, args.ignore_whitespace)
+        except Exception as e:
+            sys.stderr.write(f'ERROR: {e.args[0]}\n')
+            sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+        entries, failed = [], False
+        for target, hunks in results.items():
+            if args.check:
+                write_check(target, hunks)
+            fields = get_log_fields(args.before, args.after, target)
+            if isinstance(hunks, Exception):
+                failed = True
+                sys.stderr.write(f'ERROR: {target}: {hunks.args[0]}\n')
+                entries.append(({**fields, 'error': str(hunks.args[0])}, None, None))
+            else:
+                entries.append((fields, map(Hunk.to_dict, formats.sort_hunks(hunks)), {'cache': cache.counters} if cache else None))
+        if args.log_file:
+            with Phase('write_log'):
+                logs.write_log(args.log_file, logs.format_logs(entries, LogFormat(args.log_format)))
+    if session:
+        sys.stderr.write(timing.format_timings(session.to_dict()))
+    if failed:
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+def run_batch(argv: List[str]):
+    parser = ArgumentParser(
+        prog='backport batch',
+        description='Backport changes for every (before, after, target) triple listed in the manifest. The manifest '
+        'is either a JSON Lines file with an object per line or a CSV file (with .csv extension) with a header, '
+        'the entries having "before", "after", "target" and optionally "log" fields. The triples are merged by a '
+        'pool of worker processes, a failure of one of them doesn\'t affect the others. The summary of successes, '
+        'conflicts and errors is written to the standard output in JSON format.'
+    )
+    parser.add_argument('manifest', help='The path of the manifest file')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes. Defaults to the number of CPUs.')
+    parser.add_argument('--log-dir', help='The directory to write the logs of the entries without "log" field into. '
+        'The logs are named after the position of the entry in the manifest and the log format, e.g. "1.json".')
+    parser.add_argument('-s', '--summary', help='The path of the JSON file to write the results of every entry into.')
+    add_engine_argument(parser)
+    add_context_argument(parser)
+    add_log_format_argument(parser)
+    add_cache_arguments(parser)
+    add_check_argument(parser)
+    add_ignore_whitespace_argument(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args(argv)
+    check_context_argument(args)
+    check_jobs_argument(args)
+    try:
+        ensure_existing_file(args.manifest)
+        jobs = read_manifest(args.manifest)
+    except (ValueError, json.JSONDecodeError) as e:
+        sys.stderr.write(f'ERROR: {e.args[0]}\n')
+        sys.exit(ExitCodes.BAD_ARGUMENT.value)
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+        for i, job in enumerate(jobs, 1):
+            if not job.get('log'):
+                job['log'] = os.path.join(args.log_dir, f'{i}.{args.log_format}')
+    result = merge_batch(jobs, Engine(args.engine), args.jobs, cache=get_cache(args), profile=args.profile, context=args.context,
+                         log_format=LogFormat(args.log_format), check=args.check, ignore_whitespace=args.ignore_whitespace)
+    if args.summary:
+        write_json(args.summary, result)
+    if args.profile:
+        sys.stderr.write(timing.format_timings(result['summary'].pop('timings')))
+    sys.stdout.write(json.dumps(result['summary']) + '\n')
+    if result['summary'][JobStatus.ERROR.value]:
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+def run_tree(argv: List[str]):
+    parser = ArgumentParser(
+        prog='backport tree',
+        description='Backport changes between two directory trees into a third one. The files of <after> '
+        'matching --pattern are paired with the files of <before> and <target> by their relative path. '
+        'The files identical in <before> and <after> are skipped, the others are merged by a pool of worker '
+        'processes. The summary is written to the standard output in JSON format.'
+    )
+    parser.add_argument('before', help='The original directory path')
+    parser.add_argument('after', help='The directory containing the changes to be backported')
+    parser.add_argument('target', help='The directory to incorporate the changes into')
+    parser.add_argument('-p', '--pattern', default='*', help='The shell pattern of the file names to backport, e.g. "*.c". Defaults to all files.')
+    parser.add_argument('-l', '--log', action='store', dest='log_file', help='The path of the JSON file to write the aggregated log into.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes. Defaults to the number of CPUs.')
+    add_engine_argument(parser)
+    add_context_argument(parser)
+    add_cache_arguments(parser)
+    add_check_argument(parser)
+    add_ignore_whitespace_argument(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args(argv)
+    check_context_argument(args)
+    check_jobs_argument(args)
+    for path in (args.before, args.after, args.target):
+        if not os.path.isdir(path):
+            sys.stderr.write(f'ERROR: The path "{path}" does not designate an existing directory\n')
+            sys.exit(ExitCodes.BAD_ARGUMENT.value)
+
+    log = merge_tree(args.before, args.after, args.target, args.pattern, Engine(args.engine), args.jobs, get_cache(args), args.profile,
+                     args.context, args.check, args.ignore_whitespace)
+    if args.log_file:
+        write_json(args.log_file, log)
+    if args.profile:
+        sys.stderr.write(timing.format_timings(log['summary'].pop('timings')))
+    sys.stdout.write(json.dumps(log['summary']) + '\n')
+    if log['summary'][JobStatus.ERROR.value]:
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+def run_serve(argv: List[str]):
+    parser = ArgumentParser(
+        prog='backport serve',
+        description='Keep a warm process merging the requests received on a Unix socket. Every request is a JSON '
+        'object on its own line with "before", "after", "target" and optionally "engine", "context", "profile" and "log" '
+        'fields, the '
+        'response is a JSON object on its own line with the status of the merge and its log. The client.py script '
+        'sends the requests with the same arguments as the backport command.'
+    )
+    parser.add_argument('-s', '--socket', default=daemon.get_socket_path(), help='The path of the socket to listen on. '
+        'Defaults to $BACKPORT_SOCKET or backport-<uid>.sock in the temporary directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes. Defaults to the number of CPUs.')
+    add_engine_argument(parser)
+    add_context_argument(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    check_context_argument(args)
+    check_jobs_argument(args)
+    # Stopping the daemon with SIGTERM removes its socket as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(ExitCodes.SUCCESS.value))
+    try:
+        serve(args.socket, Engine(args.engine), args.jobs, get_cache(args), args.context)
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f'ERROR: {e}\n')
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+def run_git(argv: List[str]):
+    parser = ArgumentParser(
+        prog='backport git',
+        description='Backport the changes between two commits of a local git repository without checking them out. '
+        'The files changed between <before> and <after>, optionally limited to the pathspecs, are read from the object '
+        'store, diffed in memory and merged into the files with the same relative paths in the target directory. '
+        'The summary is written to the standard output in JSON format.'
+    )
+    parser.add_argument('repository', help='The path of the git repository')
+    parser.add_argument('before', help='The commit, branch or tag the changes are based on')
+    parser.add_argument('after', help='The commit, branch or tag containing the changes to be backported')
+    parser.add_argument('paths', nargs='*', help='The pathspecs limiting the files to backport. Defaults to all changed files.')
+    parser.add_argument('-t', '--target-dir', help='The directory to incorporate the changes into. Defaults to the working tree of the repository.')
+    parser.add_argument('-l', '--log', action='store', dest='log_file', help='The path of the JSON file to write the aggregated log into.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes. Defaults to the number of CPUs.')
+    add_context_argument(parser)
+    add_cache_arguments(parser)
+    add_check_argument(parser)
+    add_ignore_whitespace_argument(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args(argv)
+    check_context_argument(args)
+    check_jobs_argument(args)
+    for path in (args.repository, args.target_dir or args.repository):
+        if not os.path.isdir(path):
+            sys.stderr.write(f'ERROR: The path "{path}" does not designate an existing directory\n')
+            sys.exit(ExitCodes.BAD_ARGUMENT.value)
+
+    try:
+        with timing.profiling() if args.profile else nullcontext() as session:
+            log = merge_git(args.repository, args.before, args.after, args.paths, args.target_dir, args.jobs, get_cache(args),
+                            args.profile, args.context, args.check, args.ignore_whitespace)
+    except gitstore.GitError as e:
+        sys.stderr.write(f'ERROR: {e}\n')
+        sys.exit(ExitCodes.BAD_ARGUMENT.value)
+    if session:
+        # Reading the blobs happens in this process, the merges in the workers
+        log['summary']['timings'] = timing.merge_timings([session.to_dict(), log['summary']['timings']])
+    if args.log_file:
+        write_json(args.log_file, log)
+    if args.profile:
+        sys.stderr.write(timing.format_timings(log['summary'].pop('timings')))
+    sys.stdout.write(json.dumps(log['summary']) + '\n')
+    if log['summary'][JobStatus.ERROR.value]:
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+def run_report(argv: List[str]):
+    parser = ArgumentParser(
+        prog='backport report',
+        description='Aggregate the rejected hunks of many logs. The logs are indexed into a SQLite database by a pool '
+        'of worker processes, the logs already indexed and unchanged since being skipped, and the files, branches, '
+        'functions or source line ranges with the most rejected hunks are written to the standard output as a JSON '
+        'object per line.'
+    )
+    parser.add_argument('database', help='The path of the SQLite database holding the index, created if missing')
+    parser.add_argument('logs', nargs='*', help='The logs, or the directories of logs, to index first')
+    parser.add_argument('-b', '--by', choices=[g.value for g in report.Grouping], default=report.Grouping.FILE.value,
+        help='What the rejected hunks are counted by: the changed file, the branch of the target, the function or '
+        'structure of the file, or the source line range of the hunk. Defaults to "file".')
+    parser.add_argument('--branch-pattern', help='The regular expression extracting the branch from the path of the '
+        'target, its first group if any. Defaults to the directory of the target.')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='The number of results. Defaults to 20.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes. Defaults to the number of CPUs.')
+    args = parser.parse_args(argv)
+    check_jobs_argument(args)
+    failed = False
+    try:
+        with report.Report(args.database) as index:
+            paths = [path for path in report.iter_log_paths(args.logs) if not index.is_indexed(path)]
+            for path, merges in zip(paths, run_parallel(partial(call_safely, report.read_log), paths, args.jobs)):
+                if isinstance(merges, Exception):
+                    failed = True
+                    sys.stderr.write(f'ERROR: {path}: {merges}\n')
+                else:
+                    index.add(path, merges)
+            for row in index.query(report.Grouping(args.by), args.limit, args.branch_pattern):
+                sys.stdout.write(json.dumps(row) + '\n')
+    except (OSError, sqlite3.Error) as e:
+        sys.stderr.write(f'ERROR: {e}\n')
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+    if failed:
+        sys.exit(ExitCodes.RUNTIME_ERROR.value)
+
+COMMANDS = {
+    'batch': run_batch,
+    'tree': run_tree,
+    'serve': run_serve,
+    'git': run_git,
+    'report': run_report,
+}
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        run_merge(argv)
+
 if __name__ == '__main__':
-    run_merge()
+    main()
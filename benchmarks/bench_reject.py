@@ -0,0 +1,92 @@
+"""Compares the reject parser with the former implementation trying every rule of the grammar
+as a regular expression on every line.
+
+    python benchmarks/bench_reject.py --hunks 50000 --size 6
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from re import compile as regex
+from timeit import repeat
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from formats import Chunk, ChangeType, FormatError, Hunk
+import formats
+
+def reject_hunk_separator(val, hunk):
+    return Hunk(ChangeType.CHANGED, Chunk(0), Chunk(0))
+
+def reject_header(val, hunk):
+    nums = list(map(int, val.split(',')))
+    hunk.source.begin = nums[0]
+    hunk.source.end = nums[1] if len(nums) > 1 else hunk.source.begin
+
+def reject_chunk_separator(val, hunk):
+    nums = list(map(int, val.split(',')))
+    hunk.destination.begin = nums[0]
+    hunk.destination.end = nums[1] if len(nums) > 1 else hunk.destination.begin
+
+def reject_source(val, hunk):
+    if not hunk.source.body:
+        hunk.source.body = []
+    hunk.source.body.append(val)
+
+def reject_destination(val, hunk):
+    if not hunk.destination.body:
+        hunk.destination.body = []
+    hunk.destination.body.append(val)
+
+_REJECT_GRAMMAR = [
+    (regex(r'^\*{10,}$'), reject_hunk_separator),
+    (regex(r'^\*{3} (\d+(?:,\d+)?)$'), reject_header),
+    (regex(r'^-{3} (\d+(?:,\d+)?) -{5,}$'), reject_chunk_separator),
+    (regex(r'^- (.*)$'), reject_source),
+    (regex(r'^\+ (.*)$'), reject_destination)
+]
+
+def legacy_parse_reject(lines):
+    result = []
+    hunk = None
+    for line in lines[2:]:
+        for pattern, handler in _REJECT_GRAMMAR:
+            if match := pattern.match(line.rstrip('\n')):
+                new_hunk = handler(match.group(1) if match.groups() else None, hunk)
+                if new_hunk:
+                    if hunk:
+                        result.append(hunk)
+                    hunk = new_hunk
+                break
+        else:
+            raise FormatError(f'Got unexpected line {line}')
+    if hunk:
+        result.append(hunk)
+    return result
+
+def generate_reject(hunks: int, size: int):
+    lines = ['*** /dev/null\n', '--- /dev/null\n']
+    for i in range(hunks):
+        begin = i * (size + 3) + 1
+        lines.append('***************\n')
+        lines.append(f'*** {begin},{begin + size - 1}\n')
+        lines.extend(f'-     value[{begin + j}] = compute({j}, "{i}");\n' for j in range(size))
+        lines.append(f'--- {begin},{begin + size} -----\n')
+        lines.extend(f'+     value[{begin + j}] = compute_fast({j}, "{i}");\n' for j in range(size + 1))
+    return lines
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hunks', type=int, default=50000)
+    parser.add_argument('--size', type=int, default=6, help='The number of lines removed by every hunk')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = generate_reject(args.hunks, args.size)
+    assert formats.parse_reject(lines) == legacy_parse_reject(lines)
+    legacy = min(repeat(lambda: legacy_parse_reject(lines), number=1, repeat=args.repeat))
+    current = min(repeat(lambda: formats.parse_reject(lines), number=1, repeat=args.repeat))
+    print(f'{len(lines)} lines, {args.hunks} hunks')
+    print(f'legacy:  {legacy:.3f}s')
+    print(f'current: {current:.3f}s')
+    print(f'speedup: {legacy / current:.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Generates synthetic C files to backport: <before>, <after> changing <hunks> regions of <size> lines
+and <target> being <before> shifted by a few lines, a <conflicts> share of the regions being modified
+so that their hunks don't apply.
+
+    python benchmarks/generate.py <directory> --lines 20000 --hunks 200 --size 6 --conflicts 0.1
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from random import Random
+from typing import Iterable, List, Tuple
+import os
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from formats import Hunk
+
+_FUNCTION_SIZE = 12
+
+def generate_lines(count: int, rng: Random) -> List[str]:
+    """Generates <count> lines of C functions. The statements are unique so that the hunks changing them
+    can be located unambiguously, the braces and blank lines repeat the way they do in real sources."""
+    lines = []
+    while len(lines) < count:
+        function = len(lines) // _FUNCTION_SIZE
+        lines.append(f'static int function_{function}(const int *values, int count)\n')
+        lines.append('{\n')
+        lines.append(f'    int result = {rng.randrange(1 << 16)};\n')
+        for i in range(_FUNCTION_SIZE - 6):
+            lines.append(f'    result += compute(values, count, {function}, {i}, {rng.randrange(1 << 16)});\n')
+        lines.append('    return result;\n')
+        lines.append('}\n')
+        lines.append('\n')
+    return lines[:count]
+
+def get_regions(lines: int, hunks: int, size: int) -> List[int]:
+    if hunks * (size + 1) > lines:
+        raise ValueError(f'{hunks} hunks of {size} lines don\'t fit into {lines} lines')
+    step = lines // hunks
+    return [i * step + (step - size) // 2 for i in range(hunks)]
+
+def generate_triple(lines: int, hunks: int, size: int, conflicts: float = 0.0, seed: int = 0) -> Tuple[List[str], List[str], List[str]]:
+    """Returns the lines of <before>, <after> and <target>. Every other hunk adds a line to the region it
+    changes so that the following hunks are shifted."""
+    rng = Random(seed)
+    before = generate_lines(lines, rng)
+    regions = get_regions(lines, hunks, size)
+    after = []
+    position = 0
+    for n, begin in enumerate(regions):
+        after.extend(before[position:begin])
+        after.extend(
+            line.replace('compute(', 'compute_fast(') if 'compute(' in line else f'    /* {n}.{i} */\n'
+            for i, line in enumerate(before[begin:begin + size])
+        )
+        if n % 2:
+            after.append(f'    trace({n});\n')
+        position = begin + size
+    after.extend(before[position:])
+
+    target = list(before)
+    for begin in rng.sample(regions, round(len(regions) * conflicts)):
+        target[begin + size // 2] = f'    legacy({begin});\n'
+    header = [f'/* Backported from revision {rng.randrange(1 << 32):x} */\n', '#include "compat.h"\n', '\n']
+    return before, after, header + target
+
+def write_triple(directory: str, lines: int, hunks: int, size: int, conflicts: float = 0.0, seed: int = 0) -> Tuple[str, str, str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = tuple(os.path.join(directory, name) for name in ('before.c', 'after.c', 'target.c'))
+    for path, content in zip(paths, generate_triple(lines, hunks, size, conflicts, seed)):
+        with open(path, 'w', newline='\n') as f:
+            f.writelines(content)
+    return paths
+
+def format_range(begin: int, end: int) -> str:
+    return f'{begin},{end}' if begin != end else str(begin)
+
+def format_reject(hunks: Iterable[Hunk]) -> List[str]:
+    """Formats the hunks the way the patch utility writes the rejects of the normal diff format."""
+    lines = ['*** before.c\n', '--- after.c\n']
+    for hunk in hunks:
+        lines.append('***************\n')
+        lines.append(f'*** {format_range(hunk.source.begin, hunk.source.end)}\n')
+        lines.extend('- ' + line.rstrip('\n') + '\n' for line in hunk.source.body or [])
+        lines.append(f'--- {format_range(hunk.destination.begin, hunk.destination.end)} -----\n')
+        lines.extend('+ ' + line.rstrip('\n') + '\n' for line in hunk.destination.body or [])
+    return lines
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--hunks', type=int, default=200)
+    parser.add_argument('--size', type=int, default=6, help='The number of lines changed by every hunk')
+    parser.add_argument('--conflicts', type=float, default=0.1, help='The share of the hunks conflicting with the target')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path in write_triple(args.directory, args.lines, args.hunks, args.size, args.conflicts, args.seed):
+        print(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Measures every phase of the merge on synthetic C files and compares the results with a baseline.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --scenario medium --baseline results.json --tolerance 0.1
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from random import Random
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+import collections
+import json
+import platform
+import shutil
+import os
+import sys
+import tempfile
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from backport import Engine
+from formats import ChangeType, Chunk, Hunk
+from generate import format_reject, generate_lines, write_triple
+import backport
+import formats
+
+# lines, hunks, size of a hunk, share of conflicting hunks
+SCENARIOS = {
+    'small': {'lines': 2000, 'hunks': 20, 'size': 4, 'conflicts': 0.1},
+    'medium': {'lines': 20000, 'hunks': 200, 'size': 6, 'conflicts': 0.1},
+    'large': {'lines': 100000, 'hunks': 100, 'size': 8, 'conflicts': 0.1},
+    'conflicting': {'lines': 20000, 'hunks': 100, 'size': 6, 'conflicts': 0.8},
+}
+
+Results = Dict[str, Dict[str, float]]
+
+# The share of the lines of a scenario rewritten by the single hunk whose conflicts are measured
+REWRITTEN_SHARE = 0.05
+
+def get_rewritten_hunk(lines: int) -> Hunk:
+    """Returns a rejected hunk replacing <lines> lines of functions by as many different ones, only their
+    braces, blank lines and return statements being the same."""
+    source = generate_lines(lines, Random(1))
+    destination = [line.replace('function_', 'handler_') for line in generate_lines(lines, Random(2))]
+    return Hunk(ChangeType.CHANGED, Chunk(1, lines, [line.rstrip('\n') for line in source]),
+                Chunk(1, lines, [line.rstrip('\n') for line in destination]))
+
+def measure(function: Callable, repeat: int, setup: Optional[Callable] = None) -> float:
+    """Returns the best time of <repeat> calls of <function>, <setup> being called before every one of them."""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+def run_scenario(directory: str, parameters: Dict, engine: Engine, repeat: int) -> Dict[str, float]:
+    before, after, original = write_triple(directory, **parameters)
+    target = os.path.join(directory, 'merged.c')
+    reset = lambda: shutil.copyfile(original, target)
+
+    timings = {'merge': measure(lambda: backport.merge(before, after, target, engine), repeat, reset)}
+    reset()
+    hunks = formats.sort_hunks(backport.merge(before, after, target, engine))
+    diff_lines = list(formats.format_diff(hunks))
+    reject_lines = format_reject(hunk for hunk in hunks if hunk.conflicts is not None)
+    rejected = formats.parse_reject(reject_lines)
+
+    timings['parse_diff'] = measure(lambda: formats.parse_diff(diff_lines), repeat)
+    timings['parse_reject'] = measure(lambda: formats.parse_reject(reject_lines), repeat)
+    timings['conflicts'] = measure(lambda: [backport.get_conflicts(hunk) for hunk in rejected], repeat)
+    rewritten = get_rewritten_hunk(int(parameters['lines'] * REWRITTEN_SHARE))
+    timings['rewritten'] = measure(lambda: backport.get_conflicts(rewritten), repeat)
+    by_id = {hunk.id: hunk for hunk in hunks}
+    timings['serialize'] = measure(lambda: collections.deque(backport.format_log(before, after, target, by_id), maxlen=0), repeat)
+    return timings
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[Tuple[str, str, float, float, bool]]:
+    """Returns the (scenario, measure, baseline, current, regressed) rows of the measures found in both results."""
+    rows = []
+    for scenario, timings in results.items():
+        for name, current in timings.items():
+            previous = baseline.get(scenario, {}).get(name)
+            if previous is not None:
+                rows.append((scenario, name, previous, current, current > previous * (1 + tolerance)))
+    return rows
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS, help='The scenarios to run, all by default')
+    parser.add_argument('-e', '--engine', choices=[e.value for e in Engine], default=Engine.NATIVE.value)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help='The JSON file to store the results into')
+    parser.add_argument('-b', '--baseline', help='The JSON file with the results to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1, help='The slowdown tolerated before reporting a regression')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in args.scenario or SCENARIOS:
+            results[name] = run_scenario(os.path.join(temp_dir, name), SCENARIOS[name], Engine(args.engine), args.repeat)
+            for measure_name, value in results[name].items():
+                print(f'{name:<14}{measure_name:<14}{value * 1000:>12.3f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'engine': args.engine,
+                'scenarios': {name: SCENARIOS[name] for name in results},
+                'results': results
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows = compare(results, baseline, args.tolerance)
+        print(f'\n{"scenario":<14}{"measure":<14}{"baseline, ms":>14}{"current, ms":>14}{"ratio":>8}')
+        for scenario, name, previous, current, regressed in rows:
+            print(f'{scenario:<14}{name:<14}{previous * 1000:>14.3f}{current * 1000:>14.3f}{current / previous:>8.2f}{"  REGRESSION" if regressed else ""}')
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+from formats import Chunk, ChangeType, Hunk
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+
+# Changes whenever the serialized form of the hunks or the way they are computed changes
+FORMAT_VERSION = 2
+
+def _listed(lines: Optional[Sequence[str]]) -> Optional[List[str]]:
+    # The lines may be a view of a mapped file which marshal doesn't support
+    return lines if lines is None or isinstance(lines, list) else list(lines)
+
+def dump_hunks(hunks: List[Hunk]) -> bytes:
+    return zlib.compress(marshal.dumps([
+        (h.type.value, h.source.begin, h.source.end, _listed(h.source.body), h.destination.begin, h.destination.end,
+         _listed(h.destination.body), _listed(h.leading), _listed(h.trailing))
+        for h in hunks
+    ]))
+
+def load_hunks(data: bytes) -> List[Hunk]:
+    return [
+        Hunk(ChangeType(type), Chunk(source_begin, source_end, source_body), Chunk(destination_begin, destination_end, destination_body),
+             leading=leading, trailing=trailing)
+        for type, source_begin, source_end, source_body, destination_begin, destination_end, destination_body, leading, trailing
+            in marshal.loads(zlib.decompress(data))
+    ]
+
+class HunkCache:
+    """On-disk cache of the hunks between two files keyed by the digests of their contents. The least
+    recently used entries are evicted once the total size of the cache exceeds <max_size> bytes. The size
+    is scanned once and then estimated from the entries written, the directory being scanned again only
+    when the estimate exceeds <max_size>."""
+
+    def __init__(self, directory: str, max_size: int = 256 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Unknown until the directory is scanned, the entries written by other processes are missed
+        self._size: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(before_digest: str, after_digest: str, context: int = 0) -> str:
+        return hashlib.blake2b(f'{FORMAT_VERSION}:{before_digest}:{after_digest}:{context}'.encode(), digest_size=20).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[List[Hunk]]:
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                hunks = load_hunks(f.read())
+            os.utime(path)
+        except (OSError, ValueError, EOFError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return hunks
+
+    def put(self, key: str, hunks: List[Hunk]):
+        # Written into a temporary file first as several processes may share the cache
+        data = dump_hunks(hunks)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._get_path(key))
+        if self._size is not None:
+            self._size += len(data)
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,82 @@
+"""Thin client of the backport daemon started with `backport.py serve`. It accepts the arguments of
+backport.py for a single target and keeps its outputs and exit codes, the merge being performed by the
+daemon. The invocations the daemon can't handle, e.g. several targets or when it is not running, are
+passed to backport.py in-process."""
+from typing import Dict, List, Optional
+import daemon
+import os
+import sys
+
+# Mirrors backport.ExitCodes.RUNTIME_ERROR, backport is not imported to keep the startup fast
+RUNTIME_ERROR = 2
+
+_PATHS = ('before', 'after', 'target')
+_ENGINES = ('native', 'external', 'pipe')
+_OPTIONS = {'-l': 'log', '--log': 'log', '-e': 'engine', '--engine': 'engine', '-U': 'context', '--context': 'context',
+            '--log-format': 'log_format'}
+_LOG_FORMATS = ('json', 'jsonl')
+
+def parse_args(argv: List[str]) -> Optional[Dict]:
+    """Returns the request for the arguments or None if the daemon can't handle them."""
+    request = {'profile': False}
+    positional = []
+    arguments = iter(argv)
+    for argument in arguments:
+        name, _, value = argument.partition('=')
+        if argument[:2] in _OPTIONS and not argument.startswith('--'):
+            # The values of the short options may be attached to them, e.g. -U3
+            name, value = argument[:2], argument[2:]
+        if name in _OPTIONS:
+            request[_OPTIONS[name]] = value or next(arguments, None)
+            if request[_OPTIONS[name]] is None:
+                return None
+        elif argument == '--profile':
+            request['profile'] = True
+        elif argument.startswith('-') or argument in ('batch', 'tree', 'serve', 'git', 'report') and not positional:
+            return None
+        else:
+            positional.append(argument)
+    if len(positional) != 3 or request.get('engine', 'native') not in _ENGINES or not request.get('context', '0').isdigit() \
+            or request.get('log_format', 'json') not in _LOG_FORMATS:
+        return None
+    if 'context' in request:
+        request['context'] = int(request['context'])
+    request.update(zip(_PATHS, positional))
+    return request
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    request = parse_args(argv)
+    response = None
+    # The missing files are reported by backport.py the same way as without the daemon
+    if request and all(os.path.isfile(request[key]) for key in _PATHS):
+        log_file = request.pop('log', None)
+        log_format = request.pop('log_format', 'json')
+        try:
+            # The daemon may run in another directory
+            response = daemon.request({**request, **{key: os.path.abspath(request[key]) for key in _PATHS}})
+        except (FileNotFoundError, ConnectionRefusedError):
+            # No daemon is listening, the target is untouched
+            pass
+        except OSError as e:
+            response = {'status': 'error', 'error': str(e)}
+    if response is None:
+        import backport
+        backport.main(argv)
+        return
+
+    if response['status'] == 'error':
+        sys.stderr.write(f'ERROR: {response["error"]}\n')
+        sys.exit(RUNTIME_ERROR)
+    if log_file:
+        import logs
+        log = response['log']
+        trailer = {key: log[key] for key in ('cache', 'timings') if key in log}
+        logs.write_log(log_file, logs.format_log({key: request[key] for key in _PATHS}, log['hunks'], lambda: trailer,
+                                                 logs.LogFormat(log_format)))
+    if request['profile']:
+        import timing
+        sys.stderr.write(timing.format_timings(response['log'].get('timings', {})))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Index of the functions and structures defined in C files, used to retry the hunks rejected from a target
+in which the code they change has moved, e.g. the functions have been reordered or reindented. The files
+are split into tokens by a lightweight tokenizer which only knows about comments, literals, preprocessor
+directives and the punctuation delimiting the definitions."""
+from bisect import bisect_left, bisect_right
+from formats import ChangeType, Hunk
+from re import compile as regex
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import native
+
+# The comments and preprocessor directives, the lines ending with a backslash continuing them, are skipped.
+# Outside of them and of the literals a hash only starts a directive.
+_SKIPPED = r'#(?:[^\n]*\\\r?\n)*[^\n]*|//[^\n]*|/\*(?s:.*?)(?:\*/|\Z)'
+_LITERALS = r'"(?:\\.|[^"\\\n])*"?|\'(?:\\.|[^\'\\\n])*\'?'
+_TOKEN_PATTERN = regex(rf'{_SKIPPED}|{_LITERALS}|[A-Za-z_]\w*|[{{}}();=]')
+# The tokens ending the declarations at the top level and the ones which matter within the bodies of the
+# definitions. As every alternative starts with a literal character, the search skips the others quickly.
+_DELIMITER_PATTERN = regex(rf'{_SKIPPED}|{_LITERALS}|\{{|\}}|;')
+_BODY_TOKEN_PATTERN = regex(rf'{_SKIPPED}|{_LITERALS}|\{{|\}}')
+_AGGREGATES = {'struct', 'union', 'enum'}
+
+class Symbol(NamedTuple):
+    name: str
+    # "function" or the keyword of the aggregate, e.g. "struct"
+    kind: str
+    # The indexes of the first line of the definition, its declarator included, and past its closing brace
+    begin: int
+    end: int
+
+def get_tokens(text: str, begin: int = 0, end: Optional[int] = None) -> List[str]:
+    """Returns the tokens of the <text> between the offsets <begin> and <end> relevant to the definitions,
+    the string and character literals being returned as their opening quote."""
+    tokens = _TOKEN_PATTERN.findall(text, begin, len(text) if end is None else end)
+    return [token[0] if token[0] in '"\'' else token for token in tokens if token[0] not in '/#']
+
+def _find_first_token(text: str, begin: int, end: int) -> int:
+    for match in _TOKEN_PATTERN.finditer(text, begin, end):
+        if match.group()[0] not in '/#':
+            return match.start()
+    return end
+
+def _get_symbol(tokens: List[str]) -> Optional[Tuple[str, str]]:
+    """Returns the name and kind of the definition the <tokens> preceding its opening brace declare."""
+    if '=' in tokens:
+        # An initializer
+        return None
+    if '(' in tokens:
+        before = tokens[:tokens.index('(')]
+        if before and before[-1].isidentifier() and before[-1] not in _AGGREGATES:
+            return before[-1], 'function'
+        return None
+    for keyword, name in zip(tokens, tokens[1:]):
+        if keyword in _AGGREGATES and name.isidentifier():
+            return name, keyword
+    return None
+
+def get_symbols(lines: Iterable[str]) -> List[Symbol]:
+    """Returns the functions and the named structures, unions and enumerations defined at the top level
+    of <lines>, the ones within extern "C" blocks included, in their order. The declarations at the top
+    level are split into tokens only when they open a definition, the search skipping the bodies."""
+    text = ''.join(lines)
+    symbols: List[Symbol] = []
+    depth = 0
+    # The offset following the previous declaration at the top level
+    declaration = 0
+    opened: Optional[Tuple[str, str, int]] = None
+    # The depths of the extern "C" blocks, which don't nest the definitions
+    transparent: List[int] = []
+    # The number of line feeds preceding the offset <counted>, which only grows
+    line = counted = 0
+    position = 0
+    while True:
+        top = depth == len(transparent)
+        match = (_DELIMITER_PATTERN if top else _BODY_TOKEN_PATTERN).search(text, position)
+        if not match:
+            return symbols
+        token, position = match.group(), match.end()
+        if token == '{':
+            if top:
+                tokens = get_tokens(text, declaration, match.start())
+                if tokens[-2:] == ['extern', '"']:
+                    transparent.append(depth + 1)
+                elif (symbol := _get_symbol(tokens)):
+                    first = _find_first_token(text, declaration, match.start())
+                    line += text.count('\n', counted, first)
+                    counted = first
+                    opened = (*symbol, line)
+            depth += 1
+            declaration = position
+        elif token == '}':
+            if transparent and transparent[-1] == depth:
+                transparent.pop()
+            depth = max(depth - 1, 0)
+            if depth == len(transparent):
+                if opened:
+                    line += text.count('\n', counted, match.start())
+                    counted = match.start()
+                    symbols.append(Symbol(opened[0], opened[1], opened[2], line + 1))
+                opened = None
+                declaration = position
+        elif token == ';' and top:
+            declaration = position
+
+class SymbolIndex:
+    """The symbols of the lines of a file, built once and looked up by position or by name."""
+
+    def __init__(self, lines: Iterable[str]):
+        self.symbols = get_symbols(lines)
+        self._begins = [symbol.begin for symbol in self.symbols]
+        self._by_name: Dict[Tuple[str, str], List[Symbol]] = {}
+        for symbol in self.symbols:
+            self._by_name.setdefault((symbol.name, symbol.kind), []).append(symbol)
+
+    def find_enclosing(self, index: int) -> Optional[Symbol]:
+        """Returns the symbol whose definition holds the line <index>, if any."""
+        i = bisect_right(self._begins, index) - 1
+        if i >= 0 and index < self.symbols[i].end:
+            return self.symbols[i]
+        return None
+
+    def find(self, name: str, kind: str) -> Optional[Symbol]:
+        """Returns the symbol <name> of the <kind>, None if there is none or it is defined several times,
+        e.g. under different preprocessor conditions."""
+        symbols = self._by_name.get((name, kind), [])
+        return symbols[0] if len(symbols) == 1 else None
+
+def _get_pattern(hunk: Hunk) -> Tuple[Sequence[str], int]:
+    """Returns the lines to find for the hunk in the moved symbol along with the offset of the place the
+    hunk applies at from the beginning of the lines found."""
+    if hunk.type != ChangeType.ADDED:
+        return hunk.source.body, 0
+    if hunk.leading:
+        return hunk.leading, len(hunk.leading)
+    return hunk.trailing or [], 0
+
+def _search(keys: Sequence[str], pattern: Sequence[str], expected: int) -> Optional[int]:
+    """Finds the occurrence of <pattern> in <keys> closest to the <expected> index."""
+    positions = [i for i in range(len(keys) - len(pattern) + 1) if keys[i:i + len(pattern)] == pattern]
+    return min(positions, key=lambda i: abs(i - expected), default=None)
+
+def _overlaps(placements: List[native.Placement], begin: int, end: int) -> bool:
+    i = bisect_left(placements, begin, key=lambda p: p[0])
+    if i < len(placements) and (placements[i][0] < end or placements[i][0] == begin):
+        return True
+    return i > 0 and placements[i - 1][1] > begin
+
+def relocate(before: Sequence[str], lines: Sequence[str], placements: List[native.Placement],
+             rejected: Iterable[Hunk]) -> Tuple[List[native.Placement], List[Hunk]]:
+    """Retries the hunks of the difference of <before> rejected from <lines> in the definition of the same
+    symbol in <lines>, the lines being compared regardless of their whitespace there and the context of
+    the hunks being ignored. The hunks overlapping the <placements> remain rejected. Returns the ordered
+    placements along with the hunks still rejected."""
+    before_index, index = SymbolIndex(before), SymbolIndex(lines)
+    placements = list(placements)
+    still_rejected: List[Hunk] = []
+    # The normalized lines of the symbols of the target looked for
+    keys: Dict[Symbol, List[str]] = {}
+    for hunk in rejected:
+        position = hunk.source.begin if hunk.type == ChangeType.ADDED else hunk.source.begin - 1
+        symbol = before_index.find_enclosing(position)
+        moved = symbol and index.find(symbol.name, symbol.kind)
+        pattern, shift = _get_pattern(hunk)
+        if not moved or not pattern:
+            still_rejected.append(hunk)
+            continue
+        if moved not in keys:
+            keys[moved] = [native.normalize_whitespace(line) for line in lines[moved.begin:moved.end]]
+        found = _search(keys[moved], [native.normalize_whitespace(line) for line in pattern], position - symbol.begin)
+        if found is None:
+            still_rejected.append(hunk)
+            continue
+        begin = moved.begin + found + shift
+        end = begin + (len(hunk.source.body) if hunk.type != ChangeType.ADDED else 0)
+        if _overlaps(placements, begin, end):
+            still_rejected.append(hunk)
+            continue
+        placements.insert(bisect_left(placements, begin, key=lambda p: p[0]), (begin, end, hunk))
+    return placements, still_rejected
@@ -0,0 +1,81 @@
+from typing import Callable, Dict, Optional
+import json
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+
+# Kept free of the heavy imports as it is loaded by the client on every invocation
+
+def get_socket_path() -> str:
+    return os.environ.get('BACKPORT_SOCKET') or os.path.join(tempfile.gettempdir(), f'backport-{os.getuid()}.sock')
+
+def send(stream, message: Dict):
+    stream.write(json.dumps(message).encode() + b'\n')
+    stream.flush()
+
+def receive(stream) -> Optional[Dict]:
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of a connection, every request and response being a JSON object on its own line."""
+
+    def handle(self):
+        while True:
+            try:
+                message = receive(self.rfile)
+            except ValueError as e:
+                send(self.wfile, {'status': 'error', 'error': f'Malformed request: {e}'})
+                continue
+            if message is None:
+                return
+            try:
+                response = self.server.handle_message(message)
+            except Exception as e:
+                response = {'status': 'error', 'error': str(e.args[0] if e.args else e)}
+            send(self.wfile, response)
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Listens on the Unix socket <path> passing every request received to <handle_message> in a thread
+    of its own. The socket left by a server which is not running anymore is replaced, any other file is kept."""
+    daemon_threads = True
+
+    def __init__(self, path: str, handle_message: Callable[[Dict], Dict]):
+        self.handle_message = handle_message
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise RuntimeError(f'The path "{path}" exists and is not a socket')
+            if is_running(path):
+                raise RuntimeError(f'A server is already listening on "{path}"')
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+def is_running(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(path)
+        except OSError:
+            return False
+        return True
+
+def request(message: Dict, path: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+    """Sends <message> to the server listening on <path> and returns its response. Raises OSError when
+    there is no server."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path or get_socket_path())
+        with client.makefile('rwb') as stream:
+            send(stream, message)
+            response = receive(stream)
+    if response is None:
+        raise ConnectionError('The server closed the connection without responding')
+    return response
@@ -1,29 +1,39 @@
 from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 from enum import Enum
-from re import compile as regex
-from typing import List, Optional, Tuple, Dict
+from itertools import islice
+from operator import attrgetter
+from re import MULTILINE, compile as regex
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-@dataclass
+# Slotted as there may be hundreds of thousands of hunks, each of them with two chunks
+@dataclass(slots=True)
 class Chunk:
     begin: int
     end: Optional[int] = None
-    body: Optional[str] = None
+    # The lines may be a view of a mapped file, see lines.LineIndex
+    body: Optional[Sequence[str]] = None
 
     def to_dict(self):
-        return self.__dict__
+        # The body may be a view of the lines of a mapped file
+        body = self.body if self.body is None or isinstance(self.body, list) else list(self.body)
+        return {'begin': self.begin, 'end': self.end, 'body': body}
 
 class ChangeType(Enum):
     CHANGED = 1
     ADDED = 2
     DELETED = 3
 
-@dataclass
+@dataclass(slots=True)
 class Hunk:
     type: ChangeType
     source: Chunk
     destination: Chunk
     conflicts: Optional[Dict[int, Tuple[str, str]]] = None
+    # The unchanged lines of the source preceding and following the hunk, known for unified diffs only
+    leading: Optional[Sequence[str]] = None
+    trailing: Optional[Sequence[str]] = None
 
     @property
     def id(self):
@@ -32,14 +42,104 @@ class Hunk:
     def to_dict(self):
         result = {
             'type': self.type.name,
-            'rejected': bool(self.conflicts),
+            'rejected': self.conflicts is not None,
             'source': self.source and self.source.to_dict(),
             'destination': self.destination and self.destination.to_dict()
         }
         if self.conflicts:
             result['conflicts'] = self.conflicts
+        if self.leading is not None:
+            result['leading'] = list(self.leading)
+            result['trailing'] = list(self.trailing)
         return result
 
+    @staticmethod
+    def from_dict(data: Dict) -> 'Hunk':
+        """The counterpart of to_dict, e.g. for the hunks read from a log."""
+        conflicts = None
+        if data['rejected']:
+            # The line numbers become strings and the pairs lists in JSON
+            conflicts = {int(line): tuple(lines) for line, lines in data.get('conflicts', {}).items()}
+        return Hunk(ChangeType[data['type']], Chunk(**data['source']), Chunk(**data['destination']), conflicts,
+                    data.get('leading'), data.get('trailing'))
+
+    def to_tuple(self) -> Tuple:
+        """Returns the fields of the hunk and of its chunks as a flat tuple, which is pickled several times
+        faster than the hunk, e.g. to send it to another process."""
+        source, destination = self.source, self.destination
+        return (self.type.value, source.begin, source.end, source.body, destination.begin, destination.end,
+                destination.body, self.conflicts, self.leading, self.trailing)
+
+    @staticmethod
+    def from_tuple(fields: Tuple) -> 'Hunk':
+        """The counterpart of to_tuple."""
+        type, source_begin, source_end, source_body, destination_begin, destination_end, destination_body, \
+            conflicts, leading, trailing = fields
+        return Hunk(ChangeType(type), Chunk(source_begin, source_end, source_body),
+                    Chunk(destination_begin, destination_end, destination_body), conflicts, leading, trailing)
+
+# The identifier of a hunk without the cost of calling the property, e.g. to sort them
+get_id = attrgetter('source.begin')
+
+def sort_hunks(hunks: Dict[int, Hunk]) -> List[Hunk]:
+    """Returns the hunks keyed by their identifiers in the order of the identifiers."""
+    return [hunks[id] for id in sorted(hunks)]
+
+def get_fingerprint(hunk: Hunk) -> int:
+    """Returns the hash of the lines removed and added by <hunk> whether they keep their line feeds or not."""
+    return hash((tuple(line.rstrip('\n') for line in hunk.source.body or ()),
+                 tuple(line.rstrip('\n') for line in hunk.destination.body or ())))
+
+class HunkIndex:
+    """Finds the hunks of a difference the hunks rejected by the patch utility come from. The rejects are
+    numbered after the target patched so far rather than the source, so they are matched by their lines
+    first, the hunk closest to the reject being chosen among the ones with the same lines, and by the
+    overlap of the source ranges otherwise. Every hunk is matched once at most."""
+
+    def __init__(self, hunks: Iterable[Hunk]):
+        self._hunks = {hunk.id: hunk for hunk in hunks}
+        self._ids = sorted(self._hunks)
+        self._by_fingerprint: Dict[int, List[int]] = {}
+        for id in self._ids:
+            self._by_fingerprint.setdefault(get_fingerprint(self._hunks[id]), []).append(id)
+        self._matched = set()
+
+    def _find_same(self, reject: Hunk) -> Optional[int]:
+        ids = self._by_fingerprint.get(get_fingerprint(reject), [])
+        while ids:
+            i = bisect_left(ids, reject.source.begin)
+            if i == len(ids) or i and reject.source.begin - ids[i - 1] <= ids[i] - reject.source.begin:
+                i -= 1
+            id = ids.pop(i)
+            # Skipping the hunks matched by their overlap
+            if id not in self._matched:
+                return id
+        return None
+
+    def _find_overlapping(self, reject: Hunk) -> Optional[int]:
+        begin = reject.source.begin
+        end = begin if reject.source.end is None else reject.source.end
+        # The hunks are ordered and don't overlap, so the ones ending after <begin> follow each other
+        i = bisect_right(self._ids, end)
+        while i > 0:
+            i -= 1
+            id = self._ids[i]
+            hunk = self._hunks[id]
+            if (hunk.source.end if hunk.source.end is not None else id) < begin:
+                return None
+            if id not in self._matched:
+                return id
+        return None
+
+    def find(self, reject: Hunk) -> Optional[Hunk]:
+        """Returns the hunk <reject> comes from, None if there is none."""
+        id = self._find_same(reject)
+        if id is None:
+            id = self._find_overlapping(reject)
+        if id is None:
+            return None
+        self._matched.add(id)
+        return self._hunks[id]
 
 class FormatError(Exception):
     pass
@@ -49,6 +149,12 @@ class Context(ABC):
         self._hunk = hunk
 
     def process(self, line: str) -> bool:
+        if line.startswith('\\'):
+            # "\ No newline at end of file" refers to the last line of the current chunk
+            body = self._get_chunk().body
+            if body:
+                body[-1] = body[-1].rstrip('\n')
+            return True
         if not line.startswith(self._get_prefix()):
             return False
         self._get_chunk().body.append(line[2:])
@@ -134,15 +240,44 @@ def parse_hunk_header(groups: tuple) -> Hunk:
 
 _DIFF_HEADER_PATTERN = regex(r'^(\d+(?:,\d+)?)(\w)(\d+(?:,\d+)?)$')
 
-def parse_diff(lines: List[str], contexts=_CONTEXTS) -> List[Hunk]:
-    result:  List[Hunk] = []
+class DiffParser:
+    """Counterpart of iter_diff for the lines which are pushed rather than pulled, e.g. when they are
+    read from an asyncio stream. iter_diff is kept separate as it is faster."""
+
+    def __init__(self, contexts=_CONTEXTS):
+        self._contexts = contexts
+        self._context: Context = None
+        self._hunk: Hunk = None
+
+    def feed(self, line: str) -> Optional[Hunk]:
+        """Processes the next line returning the hunk it completes, if any."""
+        if self._context and self._context.process(line):
+            return None
+        completed = self._hunk
+
+        match = _DIFF_HEADER_PATTERN.match(line.strip())
+        if not match:
+            raise FormatError(f'Bad header format: "{line}"')
+
+        self._hunk = parse_hunk_header(match.groups())
+        self._context = self._contexts[match.group(2)](self._hunk)
+        return completed
+
+    def close(self) -> Optional[Hunk]:
+        """Returns the last hunk once all the lines have been fed."""
+        hunk, self._hunk, self._context = self._hunk, None, None
+        return hunk
+
+def iter_diff(lines: Iterable[str], contexts=_CONTEXTS) -> Iterator[Hunk]:
+    """Parses the hunks of a normal format diff yielding each of them as soon as it is complete. The
+    lines may come from any iterable including an open file or a pipe."""
     context: Context = None
     hunk: Hunk = None
     for line in lines:
         if context:
             if context.process(line):
                 continue
-            result.append(hunk)
+            yield hunk
 
         match = _DIFF_HEADER_PATTERN.match(line.strip())
         if not match:
@@ -151,63 +286,272 @@ def parse_diff(lines: List[str], contexts=_CONTEXTS) -> List[Hunk]:
         hunk = parse_hunk_header(match.groups())
         context = contexts[match.group(2)](hunk)
     if hunk:
-        result.append(hunk)
-    return result    
-
-def reject_hunk_separator(val: Optional[str], hunk: Hunk) -> Optional[Hunk]:
-    return Hunk(ChangeType.CHANGED, Chunk(0), Chunk(0))
-
-def reject_header(val: str, hunk: Hunk) -> Optional[Hunk]:
-    nums = list(map(int, val.split(',')))
-    if not (1 <= len(nums) <= 2):
-        raise FormatError(f'Bad format of line numbers in header {val}')
-    hunk.source.begin = nums[0]
-    hunk.source.end = nums[1] if len(nums) > 1 else hunk.source.begin
-    return None
-
-def reject_chunk_separator(val: str, hunk: Hunk) -> Optional[Hunk]:
-    nums = list(map(int, val.split(',')))
-    if not (1 <= len(nums) <= 2):
-        raise FormatError(f'Bad format of line numbers in separator {val}')
-    hunk.destination.begin = nums[0]
-    hunk.destination.end = nums[1] if len(nums) > 1 else hunk.destination.begin
-    return None
-
-def reject_source(val: str, hunk: Hunk) -> Optional[Hunk]:
-    if not hunk.source.body:
-        hunk.source.body = []
-    hunk.source.body.append(val)
-    return None
-
-def reject_destination(val: str, hunk: Hunk) -> Optional[Hunk]:
-    if not hunk.destination.body:
-        hunk.destination.body = []
-    hunk.destination.body.append(val)
-    return None
-
-_REJECT_GRAMMAR = [
-    (regex(r'^\*{10,}$'), reject_hunk_separator),
-    (regex(r'^\*{3} (\d+(?:,\d+)?)$'), reject_header),
-    (regex(r'^-{3} (\d+(?:,\d+)?) -{5,}$'), reject_chunk_separator),
-    (regex(r'^- (.*)$'), reject_source),
-    (regex(r'^\+ (.*)$'), reject_destination)
-]
-
-def parse_reject(lines: List[str]) -> List[Hunk]:
-    result = []
-    hunk: Hunk = None
+        yield hunk
+
+def parse_diff(lines: Iterable[str], contexts=_CONTEXTS) -> List[Hunk]:
+    return list(iter_diff(lines, contexts))
+
+def format_range(chunk: Chunk) -> str:
+    return f'{chunk.begin}' if chunk.begin == chunk.end else f'{chunk.begin},{chunk.end}'
+
+def format_body(prefix: str, body: List[str]) -> Iterator[str]:
+    for line in body:
+        if line.endswith('\n'):
+            yield prefix + line
+        else:
+            yield prefix + line + '\n'
+            yield '\\ No newline at end of file\n'
+
+_ABBREVIATIONS = {
+    ChangeType.CHANGED: 'c',
+    ChangeType.ADDED: 'a',
+    ChangeType.DELETED: 'd'
+}
 
-    for line in lines[2:]:
-        for pattern, handler in _REJECT_GRAMMAR:
-            if match := pattern.match(line.rstrip('\n')):
-                new_hunk = handler(match.group(1) if match.groups() else None, hunk)
-                if new_hunk:
+def format_diff(hunks: Iterable[Hunk]) -> Iterator[str]:
+    """Formats the hunks in the normal diff format understood by parse_diff and the patch utility."""
+    for hunk in hunks:
+        yield f'{format_range(hunk.source)}{_ABBREVIATIONS[hunk.type]}{format_range(hunk.destination)}\n'
+        if hunk.type != ChangeType.ADDED:
+            yield from format_body('< ', hunk.source.body)
+        if hunk.type == ChangeType.CHANGED:
+            yield '---\n'
+        if hunk.type != ChangeType.DELETED:
+            yield from format_body('> ', hunk.destination.body)
+
+_UNIFIED_HEADER_PATTERN = regex(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def to_hunk(source_line: int, removed: List[str], destination_line: int, added: List[str], leading: List[str]) -> Hunk:
+    """Builds the hunk of a block of removed and added lines of a unified diff starting at the given lines,
+    using the coordinates of the normal format."""
+    if not removed:
+        return Hunk(ChangeType.ADDED, Chunk(source_line - 1, source_line - 1),
+                    Chunk(destination_line, destination_line + len(added) - 1, added), leading=leading, trailing=[])
+    if not added:
+        return Hunk(ChangeType.DELETED, Chunk(source_line, source_line + len(removed) - 1, removed),
+                    Chunk(destination_line - 1, destination_line - 1), leading=leading, trailing=[])
+    return Hunk(ChangeType.CHANGED, Chunk(source_line, source_line + len(removed) - 1, removed),
+                Chunk(destination_line, destination_line + len(added) - 1, added), leading=leading, trailing=[])
+
+def iter_unified(lines: Iterable[str]) -> Iterator[Hunk]:
+    """Parses a unified format diff, or the rejects of one, yielding the hunks as soon as they are complete.
+    Every block of removed and added lines becomes a hunk of its own with the coordinates of the normal
+    format, the context lines around it being kept as its leading and trailing lines. The lines outside
+    of the hunks, e.g. the names of the files, are skipped."""
+    source_left = destination_left = 0
+    hunk: Hunk = None
+    # The block of removed and added lines being read
+    removed: List[str] = None
+    added: List[str] = None
+    context: List[str] = []
+    last: List[str] = None
+    for line in lines:
+        prefix = line[:1]
+        if source_left or destination_left:
+            if prefix == ' ' and source_left and destination_left:
+                if removed is not None:
+                    hunk = to_hunk(block_source, removed, block_destination, added, leading)
+                    removed = None
+                if hunk:
+                    hunk.trailing.append(line[1:])
+                context.append(line[1:])
+                last = context
+                source_line += 1
+                destination_line += 1
+                source_left -= 1
+                destination_left -= 1
+                continue
+            if prefix == '-' and source_left or prefix == '+' and destination_left:
+                if removed is None:
                     if hunk:
-                        result.append(hunk)
-                    hunk = new_hunk
-                break
+                        yield hunk
+                        hunk = None
+                    removed, added, leading = [], [], context
+                    block_source, block_destination = source_line, destination_line
+                    context = []
+                if prefix == '-':
+                    removed.append(line[1:])
+                    last = removed
+                    source_line += 1
+                    source_left -= 1
+                else:
+                    added.append(line[1:])
+                    last = added
+                    destination_line += 1
+                    destination_left -= 1
+                continue
+        if prefix == '\\':
+            # "\ No newline at end of file" refers to the previous line
+            if last:
+                last[-1] = last[-1].rstrip('\n')
+                if last is context and hunk and hunk.trailing:
+                    hunk.trailing[-1] = last[-1]
+            continue
+        if source_left or destination_left:
+            raise FormatError(f'Unexpected line in hunk: "{line}"')
+        if removed is not None:
+            hunk = to_hunk(block_source, removed, block_destination, added, leading)
+            removed = None
+        if hunk:
+            yield hunk
+            hunk = None
+        match = _UNIFIED_HEADER_PATTERN.match(line)
+        if match:
+            source_begin, source_count, destination_begin, destination_count = match.groups()
+            source_left = 1 if source_count is None else int(source_count)
+            destination_left = 1 if destination_count is None else int(destination_count)
+            # An empty range designates the line preceding it
+            source_line = int(source_begin) + (source_left == 0)
+            destination_line = int(destination_begin) + (destination_left == 0)
+            context, last = [], None
+        elif prefix == '@':
+            raise FormatError(f'Bad header format: "{line}"')
+    if source_left or destination_left:
+        raise FormatError('Unexpected end of the diff')
+    if removed is not None:
+        hunk = to_hunk(block_source, removed, block_destination, added, leading)
+    if hunk:
+        yield hunk
+
+def parse_unified(lines: Iterable[str]) -> List[Hunk]:
+    return list(iter_unified(lines))
+
+def get_source_range(hunk: Hunk) -> Tuple[int, int]:
+    """Returns the first line and the number of lines of the source replaced by the hunk."""
+    if hunk.type == ChangeType.ADDED:
+        return hunk.source.begin + 1, 0
+    return hunk.source.begin, hunk.source.end - hunk.source.begin + 1
+
+def get_destination_range(hunk: Hunk) -> Tuple[int, int]:
+    if hunk.type == ChangeType.DELETED:
+        return hunk.destination.begin + 1, 0
+    return hunk.destination.begin, hunk.destination.end - hunk.destination.begin + 1
+
+def format_unified_range(begin: int, count: int) -> str:
+    # An empty range designates the line preceding it, the count of a single line is omitted
+    if count == 1:
+        return f'{begin}'
+    return f'{begin - (count == 0)},{count}'
+
+def format_unified(hunks: Iterable[Hunk], before: str = 'before', after: str = 'after') -> Iterator[str]:
+    """Formats the hunks in the unified diff format understood by parse_unified and the patch utility. The
+    hunks whose context lines touch are combined the way the diff utility does."""
+    yield f'--- {before}\n'
+    yield f'+++ {after}\n'
+    group: List[Hunk] = []
+    for hunk in hunks:
+        if group:
+            previous = group[-1]
+            begin, count = get_source_range(previous)
+            gap = get_source_range(hunk)[0] - begin - count
+            if len(previous.trailing or []) + len(hunk.leading or []) < gap:
+                yield from format_unified_group(group)
+                group = []
+        group.append(hunk)
+    if group:
+        yield from format_unified_group(group)
+
+def format_unified_group(group: List[Hunk]) -> Iterator[str]:
+    lines: List[str] = []
+    leading = group[0].leading or []
+    lines.extend(format_body(' ', leading))
+    for i, hunk in enumerate(group):
+        if hunk.type != ChangeType.ADDED:
+            lines.extend(format_body('-', hunk.source.body))
+        if hunk.type != ChangeType.DELETED:
+            lines.extend(format_body('+', hunk.destination.body))
+        trailing = hunk.trailing or []
+        if i + 1 < len(group):
+            # The lines between the hunks are covered by the trailing context of one and the leading of the other
+            begin, count = get_source_range(hunk)
+            gap = get_source_range(group[i + 1])[0] - begin - count
+            following = group[i + 1].leading or []
+            trailing = trailing[:gap] + following[max(0, len(trailing) - gap + len(following)):]
+        lines.extend(format_body(' ', trailing))
+
+    source, _ = get_source_range(group[0])
+    destination, _ = get_destination_range(group[0])
+    context = sum(line[0] == ' ' for line in lines)
+    source_count = context + sum(line[0] == '-' for line in lines)
+    destination_count = context + sum(line[0] == '+' for line in lines)
+    yield f'@@ -{format_unified_range(source - len(leading), source_count)} +{format_unified_range(destination - len(leading), destination_count)} @@\n'
+    yield from lines
+
+_REJECT_HEADER_PATTERN = regex(r'^\*{3} (\d+(?:,\d+)?)$')
+_REJECT_SEPARATOR_PATTERN = regex(r'^-{3} (\d+(?:,\d+)?) -{5,}$')
+
+def parse_reject_range(val: str, chunk: Chunk):
+    begin, _, end = val.partition(',')
+    chunk.begin = int(begin)
+    chunk.end = int(end) if end else chunk.begin
+
+def iter_reject(lines: Iterable[str], names: bool = True) -> Iterator[Hunk]:
+    """Parses the hunks of a reject file yielding each of them as soon as it is complete. The
+    lines may come from any iterable including an open file or a pipe. Every line is dispatched on
+    its two leading characters, the body lines, being the most frequent ones, are checked first.
+    The first two lines hold the names of the files unless <names> is false, e.g. for a segment of
+    the file."""
+    hunk: Hunk = None
+
+    for line in islice(lines, 2 if names else 0, None):
+        line = line.rstrip('\n')
+        prefix = line[:2]
+        if prefix == '- ' and hunk:
+            if hunk.source.body is None:
+                hunk.source.body = []
+            hunk.source.body.append(line[2:])
+        elif prefix == '+ ' and hunk:
+            if hunk.destination.body is None:
+                hunk.destination.body = []
+            hunk.destination.body.append(line[2:])
+        elif prefix == '**' and len(line) >= 10 and not line.strip('*'):
+            if hunk:
+                yield hunk
+            hunk = Hunk(ChangeType.CHANGED, Chunk(0), Chunk(0))
+        elif prefix == '**' and hunk and (match := _REJECT_HEADER_PATTERN.match(line)):
+            parse_reject_range(match.group(1), hunk.source)
+        elif prefix == '--' and hunk and (match := _REJECT_SEPARATOR_PATTERN.match(line)):
+            parse_reject_range(match.group(1), hunk.destination)
         else:
             raise FormatError(f'Got unexpected line {line}')
     if hunk:
-        result.append(hunk)
-    return result
+        yield hunk
+
+def parse_reject(lines: Iterable[str]) -> List[Hunk]:
+    return list(iter_reject(lines))
+
+class PatchFormat(Enum):
+    NORMAL = 'normal'
+    UNIFIED = 'unified'
+    REJECT = 'reject'
+
+# The lines starting the hunks, which no line of a hunk starts with
+_BOUNDARY_PATTERNS = {
+    PatchFormat.NORMAL: regex(rb'^\d', MULTILINE),
+    PatchFormat.UNIFIED: regex(rb'^@@ ', MULTILINE),
+    PatchFormat.REJECT: regex(rb'^\*{10,}$', MULTILINE),
+}
+
+def find_segments(buffer, patch_format: PatchFormat, parts: int) -> List[Tuple[int, int]]:
+    """Splits <buffer>, e.g. a mapped file, into at most <parts> segments of about the same size which
+    begin with a hunk, but the first one, so that they are parsed independently. Returns the (begin, end)
+    offsets of the segments."""
+    pattern = _BOUNDARY_PATTERNS[patch_format]
+    offsets = [0]
+    for i in range(1, parts):
+        # Searching past the hunk beginning the previous segment keeps the segments from being empty
+        match = pattern.search(buffer, max(len(buffer) * i // parts, offsets[-1] + 1))
+        if not match:
+            break
+        offsets.append(match.start())
+    offsets.append(len(buffer))
+    return list(zip(offsets, offsets[1:]))
+
+def parse_segment(lines: Iterable[str], patch_format: PatchFormat, first: bool = True) -> List[Hunk]:
+    """Parses the lines of a segment returned by find_segments, the <first> one holding the names of the
+    files of a reject."""
+    if patch_format == PatchFormat.NORMAL:
+        return parse_diff(lines)
+    if patch_format == PatchFormat.UNIFIED:
+        return parse_unified(lines)
+    return list(iter_reject(lines, names=first))
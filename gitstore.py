@@ -0,0 +1,69 @@
+from typing import List, Optional, Sequence, Tuple
+import io
+import subprocess
+
+class GitError(Exception):
+    pass
+
+def run_git(repository: str, args: List[str]) -> bytes:
+    result = subprocess.run(['git', '-C', repository, *args], capture_output=True)
+    if result.returncode:
+        raise GitError(f'git {args[0]} failed in "{repository}": {result.stderr.decode(errors="replace").strip()}')
+    return result.stdout
+
+def resolve(repository: str, revision: str) -> str:
+    """Returns the identifier of the commit designated by <revision>, e.g. a branch or a tag."""
+    return run_git(repository, ['rev-parse', '--verify', '--end-of-options', f'{revision}^{{commit}}']).decode().strip()
+
+def list_changed_paths(repository: str, before: str, after: str, pathspecs: Sequence[str] = ()) -> List[str]:
+    """Returns the paths of the files differing between the commits <before> and <after>, limited to
+    <pathspecs> if any."""
+    output = run_git(repository, ['diff', '--name-only', '--no-renames', '-z', before, after, '--', *pathspecs])
+    return [path.decode(errors='surrogateescape') for path in output.split(b'\0') if path]
+
+class GitStore:
+    """Reads the blobs of <repository> through a single long-lived `git cat-file --batch` process."""
+
+    def __init__(self, repository: str):
+        self._process = subprocess.Popen(['git', '-C', repository, 'cat-file', '--batch'], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read(self, revision: str, path: str) -> Optional[Tuple[str, bytes]]:
+        """Returns the identifier and the contents of the file <path> of <revision> or None if it doesn't
+        exist there."""
+        self._process.stdin.write(f'{revision}:{path}\n'.encode(errors='surrogateescape'))
+        self._process.stdin.flush()
+        header = self._process.stdout.readline()
+        if not header:
+            raise GitError('git cat-file exited unexpectedly')
+        fields = header.split()
+        if fields[-1] in (b'missing', b'ambiguous'):
+            return None
+        object_id, object_type, size = fields
+        # The contents are followed by a line feed
+        contents = self._process.stdout.read(int(size) + 1)[:-1]
+        if object_type != b'blob':
+            raise GitError(f'"{revision}:{path}" designates a {object_type.decode()}, not a file')
+        return object_id.decode(), contents
+
+    def read_lines(self, revision: str, path: str) -> Tuple[Optional[str], List[str]]:
+        """Returns the identifier and the lines of the file, a missing file having no lines."""
+        blob = self.read(revision, path)
+        if blob is None:
+            return None, []
+        object_id, contents = blob
+        # Split on line feeds only, the way System.read_lines does
+        return object_id, io.StringIO(contents.decode(errors='surrogateescape'), newline='\n').readlines()
+
+    def close(self):
+        # The worker processes forked meanwhile hold its standard input open, so closing ours isn't enough
+        self._process.stdin.close()
+        self._process.stdout.close()
+        self._process.terminate()
+        self._process.wait()
+
+    def __enter__(self) -> 'GitStore':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,109 @@
+from array import array
+from collections.abc import Sequence
+from itertools import accumulate
+from typing import Iterator, Union
+import io
+import locale
+import mmap
+import os
+
+# The number of bytes scanned for line feeds, or lines decoded, at once
+_BLOCK_SIZE = 1 << 20
+_BLOCK_LINES = 4096
+
+def get_offsets(buffer) -> array:
+    """Returns the offsets of the beginnings of the lines of <buffer> followed by its size."""
+    offsets = array('q', [0])
+    for start in range(0, len(buffer), _BLOCK_SIZE):
+        ends = accumulate((len(part) + 1 for part in buffer[start:start + _BLOCK_SIZE].split(b'\n')[:-1]), initial=start)
+        next(ends)
+        offsets.extend(ends)
+    if offsets[-1] != len(buffer):
+        # The last line has no line feed
+        offsets.append(len(buffer))
+    return offsets
+
+class LineRange(Sequence):
+    """Read-only view of the lines [<begin>, <end>) of a LineIndex decoded on access. When <terminated>,
+    the last line of the file gets a line feed if it lacks one."""
+
+    def __init__(self, index: 'LineIndex', begin: int, end: int, terminated: bool = False):
+        self.index = index
+        self.begin = begin
+        self.end = end
+        self.terminated = terminated
+
+    def __len__(self) -> int:
+        return self.end - self.begin
+
+    def __getitem__(self, key: Union[int, slice]):
+        if isinstance(key, slice):
+            begin, end, step = key.indices(len(self))
+            if step != 1:
+                return list(self)[key]
+            return LineRange(self.index, self.begin + begin, self.begin + max(begin, end), self.terminated)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('line index out of range')
+        line = self.index.decode(self.begin + key, self.begin + key + 1)
+        if self.terminated and not line.endswith('\n'):
+            line += '\n'
+        return line
+
+    def __iter__(self) -> Iterator[str]:
+        for begin in range(self.begin, self.end, _BLOCK_LINES):
+            end = min(begin + _BLOCK_LINES, self.end)
+            # Split on line feeds only, the way System.read_lines does
+            lines = io.StringIO(self.index.decode(begin, end), newline='\n').readlines()
+            if self.terminated and end == len(self.index) and not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+            yield from lines
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def __reduce__(self):
+        # The mapping can't be shared with other processes, the lines are copied instead
+        return list, (list(self),)
+
+    def get_terminated(self) -> 'LineRange':
+        return LineRange(self.index, self.begin, self.end, True)
+
+    def get_bytes(self) -> memoryview:
+        """Returns the raw contents of the lines without copying them."""
+        return self.index.view(self.begin, self.end)
+
+class LineIndex(LineRange):
+    """The lines of the file <path> mapped into memory rather than read. Only the offsets of the lines are
+    kept, the lines themselves being decoded when accessed and their slices being views of the mapping."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # Empty files can't be mapped
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._offsets = get_offsets(self._buffer)
+        self._encoding = locale.getpreferredencoding(False)
+        super().__init__(self, 0, len(self._offsets) - 1)
+
+    def decode(self, begin: int, end: int) -> str:
+        return self._buffer[self._offsets[begin]:self._offsets[end]].decode(self._encoding, errors='surrogateescape')
+
+    def view(self, begin: int, end: int) -> memoryview:
+        return memoryview(self._buffer)[self._offsets[begin]:self._offsets[end]]
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self) -> 'LineIndex':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
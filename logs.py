@@ -0,0 +1,216 @@
+"""Streaming writer and lazy reader of the logs of the merges. A log holds the "before", "after" and
+"target" paths, the "hunks" and optionally the "cache" counters and the "timings". It is written either
+as an indented JSON object or in the JSON Lines format with a record per line: the paths first, then
+every hunk and finally the remaining fields, if any. Several logs are written one after another in the
+JSON Lines format and as a list in the JSON format."""
+from enum import Enum
+from formats import FormatError, Hunk
+from itertools import chain, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+import json
+
+class LogFormat(Enum):
+    JSON = 'json'
+    JSONL = 'jsonl'
+
+_INDENT = '  '
+_ENCODER = json.JSONEncoder(indent=len(_INDENT))
+
+def _dumps(value, newline: str) -> str:
+    # Strings are escaped so the only line feeds of the output are the ones of the indentation
+    return _ENCODER.encode(value).replace('\n', newline)
+
+def format_log(fields: Dict, hunks: Iterable[Dict], get_trailer: Callable[[], Optional[Dict]] = dict,
+               log_format: LogFormat = LogFormat.JSON, level: int = 0) -> Iterator[str]:
+    """Yields the log piece by piece: the <fields>, the <hunks> serialized one by one as they are consumed
+    and the fields returned by <get_trailer> once the hunks are exhausted, e.g. the timings of the merge.
+    The JSON format is the one of json.dumps with an indentation of 2, <level> being the nesting level of
+    the log in the enclosing document."""
+    if log_format == LogFormat.JSONL:
+        yield json.dumps(fields) + '\n'
+        for hunk in hunks:
+            yield json.dumps(hunk) + '\n'
+        trailer = get_trailer()
+        if trailer:
+            yield json.dumps(trailer) + '\n'
+        return
+
+    outer = '\n' + _INDENT * level
+    inner = outer + _INDENT
+    yield '{'
+    for key, value in fields.items():
+        yield f'{inner}{json.dumps(key)}: {_dumps(value, inner)},'
+    yield f'{inner}"hunks": ['
+    separator = ''
+    for hunk in hunks:
+        yield f'{separator}{inner}{_INDENT}{_dumps(hunk, inner + _INDENT)}'
+        separator = ','
+    yield f'{inner}]' if separator else ']'
+    for key, value in (get_trailer() or {}).items():
+        yield f',{inner}{json.dumps(key)}: {_dumps(value, inner)}'
+    yield f'{outer}}}'
+
+def format_logs(logs: Iterable[Tuple[Dict, Optional[Iterable[Dict]], Optional[Dict]]],
+                log_format: LogFormat = LogFormat.JSON) -> Iterator[str]:
+    """Yields the logs of several merges given as (fields, hunks, trailing fields) triples, the logs of
+    the failed merges having no hunks."""
+    separator = ''
+    if log_format == LogFormat.JSON:
+        yield '['
+    for fields, hunks, trailer in logs:
+        if log_format == LogFormat.JSON:
+            yield f'{separator}\n{_INDENT}'
+        if hunks is None:
+            yield json.dumps(fields) + '\n' if log_format == LogFormat.JSONL else _dumps(fields, '\n' + _INDENT)
+        else:
+            yield from format_log(fields, hunks, lambda: trailer, log_format, level=1)
+        separator = ','
+    if log_format == LogFormat.JSON:
+        yield '\n]' if separator else ']'
+
+def write_log(path: str, pieces: Iterable[str]):
+    with open(path, 'w') as f:
+        f.writelines(pieces)
+
+class _Scanner:
+    """Reads the JSON values of a file one at a time, the file being read by blocks. <buffer> holds the
+    beginning of the file already read from it, if any."""
+
+    def __init__(self, file: TextIO, buffer: str = '', block_size: int = 1 << 16):
+        self._file = file
+        self._block_size = block_size
+        self._buffer = buffer
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        block = self._file.read(self._block_size)
+        self._eof = not block
+        self._buffer = self._buffer[self._position:] + block
+        self._position = 0
+        return not self._eof
+
+    def peek(self) -> str:
+        """Returns the next character which is not a whitespace, an empty string at the end of the file."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n':
+                self._position += 1
+            if self._position < len(self._buffer) or not self._fill():
+                return self._buffer[self._position:self._position + 1]
+
+    def expect(self, character: str):
+        found = self.peek()
+        if found != character:
+            raise FormatError(f'Expected "{character}" in the log, found "{found}"')
+        self._position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise FormatError(f'Malformed log: {e}')
+            # A number at the end of the buffer may continue in the next block
+            if end < len(self._buffer) or not self._fill():
+                self._position = end
+                return value
+
+class Log:
+    """A log being read. Its <fields> other than the hunks are complete once <hunks> is exhausted."""
+
+    def __init__(self, fields: Dict, hunks: Iterator[Hunk]):
+        self.fields = fields
+        self.hunks = hunks
+
+def _iter_object_hunks(scanner: _Scanner, fields: Dict) -> Iterator[Hunk]:
+    scanner.expect('{')
+    separated = False
+    while scanner.peek() != '}':
+        if separated:
+            scanner.expect(',')
+        separated = True
+        key = scanner.value()
+        scanner.expect(':')
+        if key != 'hunks':
+            fields[key] = scanner.value()
+            continue
+        scanner.expect('[')
+        while scanner.peek() != ']':
+            yield _to_hunk(scanner.value())
+            if scanner.peek() != ']':
+                scanner.expect(',')
+        scanner.expect(']')
+    scanner.expect('}')
+
+def _read_object(scanner: _Scanner) -> Log:
+    fields = {}
+    hunks = _iter_object_hunks(scanner, fields)
+    # Reading the first hunk reads the paths preceding it
+    first = next(hunks, None)
+    return Log(fields, iter(()) if first is None else chain([first], hunks))
+
+def _iter_json_logs(scanner: _Scanner) -> Iterator[Log]:
+    if scanner.peek() != '[':
+        yield _read_object(scanner)
+        return
+    scanner.expect('[')
+    while scanner.peek() != ']':
+        log = _read_object(scanner)
+        yield log
+        # The hunks not consumed by the caller are skipped
+        for _ in log.hunks:
+            pass
+        if scanner.peek() != ']':
+            scanner.expect(',')
+
+def _iter_jsonl_hunks(records: Iterator[Dict], fields: Dict, following: List[Dict]) -> Iterator[Hunk]:
+    for record in records:
+        if 'target' in record:
+            # The paths starting the next log
+            following.append(record)
+            return
+        if 'type' in record:
+            yield _to_hunk(record)
+        else:
+            fields.update(record)
+
+def _iter_jsonl_logs(lines: Iterable[str]) -> Iterator[Log]:
+    records = (_loads(line) for line in lines if line.strip())
+    following = list(islice(records, 1))
+    while following:
+        fields = following.pop()
+        log = Log(fields, _iter_jsonl_hunks(records, fields, following))
+        yield log
+        for _ in log.hunks:
+            pass
+
+def _to_hunk(record) -> Hunk:
+    try:
+        return Hunk.from_dict(record)
+    except (KeyError, TypeError, ValueError) as e:
+        raise FormatError(f'Malformed hunk in the log: {record}') from e
+
+def _loads(line: str):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        raise FormatError(f'Malformed log: {e}')
+
+def iter_logs(file: TextIO) -> Iterator[Log]:
+    """Reads the logs of <file> written in either format lazily: the hunks of every log are parsed as they
+    are iterated, the ones left being skipped when moving to the next log."""
+    first = file.readline()
+    try:
+        record = json.loads(first)
+    except json.JSONDecodeError:
+        # The first line of an indented JSON document is an opening brace or bracket
+        record = None
+    if isinstance(record, dict) and 'hunks' not in record:
+        return _iter_jsonl_logs(chain([first], file))
+    return _iter_json_logs(_Scanner(file, first))
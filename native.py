@@ -0,0 +1,379 @@
+from bisect import bisect_left
+from collections import Counter
+from itertools import count, islice
+from operator import lt
+from formats import Chunk, ChangeType, Hunk, get_id
+from lines import LineRange
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+Edit = Tuple[int, int, int, int]
+
+def normalize_whitespace(line: str) -> str:
+    """Returns <line> with its runs of whitespace collapsed into single spaces and stripped."""
+    return ' '.join(line.split())
+
+def intern_lines(*sequences: Sequence[str]) -> List[List[int]]:
+    table: Dict[str, int] = {}
+    return [[table.setdefault(line, len(table)) for line in lines] for lines in sequences]
+
+class CostExceeded(Exception):
+    """Raised when the edit script would be longer than the maximum cost it is computed with."""
+
+def _middle_snake(a: Sequence[int], a_begin: int, a_end: int, b: Sequence[int], b_begin: int, b_end: int,
+                  forward: List[int], backward: List[int], max_cost: Optional[int] = None) -> Edit:
+    """Finds the middle snake of the ranges, <forward> and <backward> being the V arrays of the Myers
+    algorithm shared by all the calls. They are indexed by the diagonal plus half their length, which
+    must exceed the lengths of the ranges, and only hold the diagonals visited by the current call.
+    Raises CostExceeded if the ranges need more than <max_cost> edits."""
+    n, m = a_end - a_begin, b_end - b_begin
+    delta = n - m
+    odd = delta & 1
+    limit = (n + m + 1) // 2 + 1
+    if max_cost is not None:
+        # The snake of a script of D edits is found in step (D + 1) / 2, forward if D is odd
+        limit = min(limit, (max_cost + 1) // 2 + 1)
+    offset = len(forward) // 2
+    # The diagonal read by the first step
+    forward[offset + 1] = backward[offset + 1] = 0
+    for d in range(limit):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1 + offset] < forward[k + 1 + offset]):
+                x = forward[k + 1 + offset]
+            else:
+                x = forward[k - 1 + offset] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_begin + x] == b[b_begin + y]:
+                x += 1
+                y += 1
+            forward[k + offset] = x
+            if odd and delta - d < k < delta + d and x + backward[delta - k + offset] >= n:
+                return a_begin + start_x, b_begin + start_y, a_begin + x, b_begin + y
+        if max_cost is not None and 2 * d > max_cost:
+            # The backward snakes of this step end the scripts of 2 * d edits
+            break
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1 + offset] < backward[k + 1 + offset]):
+                x = backward[k + 1 + offset]
+            else:
+                x = backward[k - 1 + offset] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_end - 1 - x] == b[b_end - 1 - y]:
+                x += 1
+                y += 1
+            backward[k + offset] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k + offset] >= n:
+                return a_end - x, b_end - y, a_end - start_x, b_end - start_y
+    if max_cost is not None:
+        raise CostExceeded(f'The ranges need more than {max_cost} edits')
+    raise AssertionError('The middle snake must be found within (n + m) / 2 steps')
+
+# The ranges with more lines than this are split at the lines they have in common once first, which are
+# most of them in the common case of unique lines. The smaller ones are compared by the Myers algorithm alone.
+ANCHORING_SIZE = 256
+
+def _get_anchors(a: Sequence[int], a_begin: int, a_end: int, b: Sequence[int], b_begin: int,
+                 b_end: int) -> Tuple[List[int], List[int]]:
+    """Returns the positions in both ranges of the longest sequence of lines found once in both of them and
+    in the same order in both, the way the patience diff does."""
+    a_range, b_range = a[a_begin:a_end], b[b_begin:b_end]
+    a_counts, b_counts = Counter(a_range), Counter(b_range)
+    unique = {line for line, occurrences in b_counts.items() if occurrences == 1 and a_counts.get(line) == 1}
+    # The positions of the lines found several times are overwritten, they aren't looked up
+    b_indexes = dict(zip(b_range, count(b_begin)))
+    a_positions = [i for i, line in enumerate(a_range, a_begin) if line in unique]
+    b_positions = [b_indexes[a[i]] for i in a_positions]
+    if all(map(lt, b_positions, islice(b_positions, 1, None))):
+        # No line has moved
+        return a_positions, b_positions
+    # The patience sorting: <tails> holds the smallest position in b ending a sequence of every length
+    tails: List[int] = []
+    ends: List[int] = []
+    previous: List[int] = []
+    for index, j in enumerate(b_positions):
+        length = bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            ends.append(index)
+        else:
+            tails[length] = j
+            ends[length] = index
+        previous.append(ends[length - 1] if length else -1)
+    indexes = []
+    index = ends[-1] if ends else -1
+    while index >= 0:
+        indexes.append(index)
+        index = previous[index]
+    indexes.reverse()
+    return [a_positions[i] for i in indexes], [b_positions[i] for i in indexes]
+
+def _compare_anchored(a: Sequence[int], b: Sequence[int], a_anchors: List[int], b_anchors: List[int], first: int,
+                      last: int, edits: List[Edit], forward: List[int], backward: List[int],
+                      max_cost: Optional[int] = None):
+    """Compares the lines between the anchors <first> and <last>, which are the same when the anchors are
+    as far apart in both sequences and the lines between them are equal. The other ranges are halved
+    until they are, so the lines between two anchors are compared only around the changes."""
+    a_first, a_last, b_first, b_last = a_anchors[first], a_anchors[last], b_anchors[first], b_anchors[last]
+    if a_last - a_first == b_last - b_first and a[a_first:a_last] == b[b_first:b_last]:
+        return
+    if last - first == 1:
+        _compare(a, a_first + 1, a_last, b, b_first + 1, b_last, edits, forward, backward, max_cost)
+        return
+    middle = (first + last) // 2
+    _compare_anchored(a, b, a_anchors, b_anchors, first, middle, edits, forward, backward, max_cost)
+    _compare_anchored(a, b, a_anchors, b_anchors, middle, last, edits, forward, backward, max_cost)
+
+def _compare(a: Sequence[int], a_begin: int, a_end: int, b: Sequence[int], b_begin: int, b_end: int, edits: List[Edit],
+             forward: List[int], backward: List[int], max_cost: Optional[int] = None):
+    while a_begin < a_end and b_begin < b_end and a[a_begin] == b[b_begin]:
+        a_begin += 1
+        b_begin += 1
+    while a_begin < a_end and b_begin < b_end and a[a_end - 1] == b[b_end - 1]:
+        a_end -= 1
+        b_end -= 1
+    if a_begin == a_end or b_begin == b_end:
+        if a_begin != a_end or b_begin != b_end:
+            edits.append((a_begin, a_end, b_begin, b_end))
+        return
+    if a_end - a_begin + b_end - b_begin > ANCHORING_SIZE:
+        a_anchors, b_anchors = _get_anchors(a, a_begin, a_end, b, b_begin, b_end)
+        if a_anchors:
+            # The ends of the ranges become anchors as well
+            a_anchors = [a_begin - 1, *a_anchors, a_end]
+            b_anchors = [b_begin - 1, *b_anchors, b_end]
+            _compare_anchored(a, b, a_anchors, b_anchors, 0, len(a_anchors) - 1, edits, forward, backward, max_cost)
+            return
+    x0, y0, x1, y1 = _middle_snake(a, a_begin, a_end, b, b_begin, b_end, forward, backward, max_cost)
+    _compare(a, a_begin, x0, b, b_begin, y0, edits, forward, backward, max_cost)
+    _compare(a, x1, a_end, b, y1, b_end, edits, forward, backward, max_cost)
+
+def get_edits(a: Sequence[int], b: Sequence[int], max_cost: Optional[int] = None) -> List[Edit]:
+    """Computes the edit script between two interned sequences with the linear space variation of the
+    Myers algorithm. The large ranges are first split at the lines found once in both of them, so the
+    script is the shortest one for the small sequences only. The edits are returned as half-open ranges
+    (a_begin, a_end, b_begin, b_end), adjacent deletions and insertions being combined into changes.
+    With <max_cost> the comparison gives up, raising CostExceeded, once a range needs more inserted and
+    removed lines, which bounds its time by the lengths of the sequences times <max_cost>."""
+    edits: List[Edit] = []
+    size = 2 * (len(a) + len(b) + 2)
+    _compare(a, 0, len(a), b, 0, len(b), edits, [0] * size, [0] * size, max_cost)
+    result: List[Edit] = []
+    for edit in edits:
+        if result and result[-1][1] == edit[0] and result[-1][3] == edit[2]:
+            result[-1] = (result[-1][0], edit[1], result[-1][2], edit[3])
+        else:
+            result.append(edit)
+    return result
+
+def to_hunk(before: Sequence[str], after: Sequence[str], edit: Edit) -> Hunk:
+    a_begin, a_end, b_begin, b_end = edit
+    if a_begin == a_end:
+        return Hunk(
+            ChangeType.ADDED,
+            Chunk(a_begin, a_begin),
+            Chunk(b_begin + 1, b_end, after[b_begin:b_end])
+        )
+    if b_begin == b_end:
+        return Hunk(
+            ChangeType.DELETED,
+            Chunk(a_begin + 1, a_end, before[a_begin:a_end]),
+            Chunk(b_begin, b_begin)
+        )
+    return Hunk(
+        ChangeType.CHANGED,
+        Chunk(a_begin + 1, a_end, before[a_begin:a_end]),
+        Chunk(b_begin + 1, b_end, after[b_begin:b_end])
+    )
+
+def diff(before: Sequence[str], after: Sequence[str], context: int = 0) -> List[Hunk]:
+    """Computes the hunks transforming the lines of <before> into the lines of <after>. The result
+    is equivalent to parsing the normal format output of the diff utility with formats.parse_diff or,
+    if <context> is positive, the unified format output with as many context lines with
+    formats.parse_unified."""
+    a, b = intern_lines(before, after)
+    edits = get_edits(a, b)
+    hunks = [to_hunk(before, after, edit) for edit in edits]
+    if context > 0:
+        for i, (hunk, edit) in enumerate(zip(hunks, edits)):
+            # The edits closer than twice the context share all the lines between them the way the
+            # diff utility combines them into a single unified hunk
+            previous_end = edits[i - 1][1] if i else 0
+            next_begin = edits[i + 1][0] if i + 1 < len(edits) else len(before)
+            leading = edit[0] - previous_end if i and edit[0] - previous_end <= 2 * context else context
+            trailing = next_begin - edit[1] if i + 1 < len(edits) and next_begin - edit[1] <= 2 * context else context
+            hunk.leading = before[max(previous_end, edit[0] - leading):edit[0]]
+            hunk.trailing = before[edit[1]:min(next_begin, edit[1] + trailing)]
+    return hunks
+
+def _terminated(lines: Sequence[str]) -> Sequence[str]:
+    if lines and not lines[-1].endswith('\n'):
+        if isinstance(lines, LineRange):
+            return lines.get_terminated()
+        return list(lines[:-1]) + [lines[-1] + '\n']
+    return lines
+
+def _extend(result: List[str], lines: Sequence[str]):
+    if lines and result and not result[-1].endswith('\n'):
+        result[-1] += '\n'
+    result.extend(lines)
+
+def get_positions(lines: Sequence[str], wanted: Optional[Iterable[str]] = None) -> Dict[str, List[int]]:
+    """Returns the indexes of the occurrences of the lines, of the <wanted> ones only if specified."""
+    if wanted is None:
+        positions: Dict[str, List[int]] = {}
+        for i, line in enumerate(lines):
+            positions.setdefault(line, []).append(i)
+        return positions
+    positions = {line: [] for line in wanted}
+    for i, line in enumerate(lines):
+        if line in positions:
+            positions[line].append(i)
+    return positions
+
+def locate(lines: Sequence[str], positions: Dict[str, List[int]], body: Sequence[str], expected: int) -> Optional[int]:
+    """Finds the occurrence of <body> in <lines> closest to the <expected> index."""
+    candidates = positions.get(body[0], [])
+    right = bisect_left(candidates, expected)
+    left = right - 1
+    while left >= 0 or right < len(candidates):
+        if right < len(candidates) and (left < 0 or candidates[right] - expected <= expected - candidates[left]):
+            candidate = candidates[right]
+            right += 1
+        else:
+            candidate = candidates[left]
+            left -= 1
+        if lines[candidate:candidate + len(body)] == body:
+            return candidate
+    return None
+
+# The number of context lines the patch utility ignores at most when it can't find the hunk otherwise
+MAX_FUZZ = 2
+
+def get_patterns(hunk: Hunk, max_fuzz: int = MAX_FUZZ) -> Iterator[Tuple[int, Sequence[str]]]:
+    """Yields the lines searched for a hunk with context, the outermost context lines being ignored one
+    by one up to <max_fuzz> of them, along with the number of leading context lines they start with."""
+    leading, trailing = hunk.leading or [], hunk.trailing or []
+    body = hunk.source.body if hunk.type != ChangeType.ADDED else []
+    for fuzz in range(min(max_fuzz, max(len(leading), len(trailing))) + 1):
+        used = leading[min(fuzz, len(leading)):]
+        yield len(used), _terminated(list(used) + list(body) + list(trailing[:max(0, len(trailing) - fuzz)]))
+
+def locate_with_context(lines: Sequence[str], positions: Dict[str, List[int]], hunk: Hunk, expected: int,
+                        max_fuzz: int = MAX_FUZZ) -> Optional[int]:
+    """Finds the lines removed by the hunk, or the place the lines are added at, surrounded by its context
+    closest to the <expected> index. Like the patch utility, the outermost context lines are ignored one
+    by one, up to <max_fuzz> of them, if the hunk can't be found otherwise."""
+    for used, pattern in get_patterns(hunk, max_fuzz):
+        if not pattern:
+            # Added at the very beginning or end of an empty context
+            return expected
+        begin = locate(lines, positions, pattern, expected - used)
+        if begin is not None:
+            return begin + used
+    return None
+
+def get_first_lines(hunks: Iterable[Hunk], max_fuzz: int = MAX_FUZZ) -> Set[str]:
+    """Returns the lines the hunks may start with in the patched file, the only ones to index there."""
+    first_lines = set()
+    for hunk in hunks:
+        if hunk.leading is not None:
+            first_lines.update(pattern[0] for _, pattern in get_patterns(hunk, max_fuzz) if pattern)
+        elif hunk.type != ChangeType.ADDED and hunk.source.body:
+            first_lines.add(_terminated(hunk.source.body)[0])
+    return first_lines
+
+Placement = Tuple[int, int, Hunk]
+
+def place(lines: Sequence[str], hunks: Iterable[Hunk], max_fuzz: int = MAX_FUZZ) -> Tuple[List[Placement], List[Hunk]]:
+    """Finds where the hunks apply to <lines> the way the patch utility does: the lines removed by a hunk,
+    along with its context if it comes from a unified diff, are searched for starting from the position
+    expected by the hunk and moving away from it, the offset found being carried over to the following
+    hunks. Returns the ordered, non-overlapping (begin, end, hunk) ranges of <lines> replaced by the hunks
+    along with the hunks which could not be applied."""
+    hunks = sorted(hunks, key=get_id)
+    keys = _terminated(lines)
+    positions = get_positions(keys, get_first_lines(hunks, max_fuzz))
+    offset = 0
+    placed: List[Placement] = []
+    rejected: List[Hunk] = []
+    for hunk in hunks:
+        if hunk.type == ChangeType.ADDED:
+            begin = hunk.source.begin + offset
+            if hunk.leading is not None:
+                begin = locate_with_context(keys, positions, hunk, begin, max_fuzz)
+            if begin is not None and 0 <= begin <= len(lines):
+                offset = begin - hunk.source.begin
+                placed.append((begin, begin, hunk))
+            else:
+                rejected.append(hunk)
+            continue
+        body = _terminated(hunk.source.body)
+        expected = hunk.source.begin - 1 + offset
+        if not body:
+            begin = None
+        elif hunk.leading is not None:
+            begin = locate_with_context(keys, positions, hunk, expected, max_fuzz)
+        else:
+            begin = locate(keys, positions, body, expected)
+        if begin is None:
+            rejected.append(hunk)
+            continue
+        offset = begin - (hunk.source.begin - 1)
+        placed.append((begin, begin + len(body), hunk))
+
+    placements: List[Placement] = []
+    position = 0
+    for begin, end, hunk in sorted(placed, key=lambda p: p[:2]):
+        if begin < position:
+            rejected.append(hunk)
+            continue
+        placements.append((begin, end, hunk))
+        position = end
+    return placements, sorted(rejected, key=get_id)
+
+_REVERSED_TYPES = {ChangeType.ADDED: ChangeType.DELETED, ChangeType.DELETED: ChangeType.ADDED, ChangeType.CHANGED: ChangeType.CHANGED}
+
+def reverse(hunk: Hunk) -> Hunk:
+    """Returns the hunk undoing <hunk>, its source being the destination of <hunk> and conversely."""
+    return Hunk(_REVERSED_TYPES[hunk.type], hunk.destination, hunk.source, None, hunk.leading, hunk.trailing)
+
+def find_applied(lines: Sequence[str], hunks: Iterable[Hunk], max_fuzz: int = MAX_FUZZ) -> List[Hunk]:
+    """Returns the hunks already applied to <lines>, e.g. by hand: the lines they add, along with their
+    context if any, are found the way place finds the lines removed by a hunk. The hunks only removing
+    lines can't be told applied without their context."""
+    candidates = [(reverse(hunk), hunk) for hunk in hunks if hunk.type != ChangeType.DELETED or hunk.leading is not None]
+    placements, _ = place(lines, [reversed_hunk for reversed_hunk, _ in candidates], max_fuzz)
+    placed = {id(reversed_hunk) for _, _, reversed_hunk in placements}
+    return [hunk for reversed_hunk, hunk in candidates if id(reversed_hunk) in placed]
+
+def _iter_runs(lines: Sequence[str], placements: Iterable[Placement]) -> Iterator[Sequence[str]]:
+    position = 0
+    for begin, end, hunk in placements:
+        yield lines[position:begin]
+        yield hunk.destination.body or []
+        position = end
+    yield lines[position:]
+
+def iter_patched(lines: Sequence[str], placements: Iterable[Placement]) -> Iterator[str]:
+    """Yields the patched lines one by one without collecting them, <lines> being only sliced."""
+    last = None
+    for run in _iter_runs(lines, placements):
+        if not run:
+            continue
+        if last is not None:
+            # Only the last line of the file may lack a line feed
+            yield last if last.endswith('\n') else last + '\n'
+        yield from islice(run, len(run) - 1)
+        last = run[-1]
+    if last is not None:
+        yield last
+
+def apply(lines: Sequence[str], hunks: Iterable[Hunk], max_fuzz: int = MAX_FUZZ) -> Tuple[List[str], List[Hunk]]:
+    """Applies the hunks to <lines> as placed by the place function. Returns the patched lines along with
+    the hunks which could not be applied."""
+    placements, rejected = place(lines, hunks, max_fuzz)
+    result: List[str] = []
+    for run in _iter_runs(lines, placements):
+        _extend(result, run)
+    return result, rejected
@@ -0,0 +1,174 @@
+"""Index of the logs of many merges in a SQLite database. The logs are read once, the rejected hunks being
+recorded along with the file, the branch and the function they belong to, so that the aggregations over
+thousands of logs, e.g. the files conflicting in most branches, are answered by queries of the index."""
+from enum import Enum
+from formats import ChangeType, Hunk
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import csymbols
+import logs
+import os
+import re
+import sqlite3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS merges (
+    id INTEGER PRIMARY KEY,
+    log_id INTEGER NOT NULL REFERENCES logs(id) ON DELETE CASCADE,
+    file TEXT NOT NULL,
+    target TEXT NOT NULL,
+    hunks INTEGER NOT NULL,
+    rejected INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rejects (
+    merge_id INTEGER NOT NULL REFERENCES merges(id) ON DELETE CASCADE,
+    begin INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    symbol TEXT
+);
+CREATE INDEX IF NOT EXISTS merges_by_log ON merges(log_id);
+CREATE INDEX IF NOT EXISTS rejects_by_merge ON rejects(merge_id);
+'''
+
+class Grouping(Enum):
+    FILE = 'file'
+    BRANCH = 'branch'
+    SYMBOL = 'symbol'
+    RANGE = 'range'
+
+_QUERIES = {
+    Grouping.FILE: '''
+        SELECT file, SUM(rejected) AS rejected, COUNT(*) AS merges, COUNT(DISTINCT branch(target)) AS branches
+        FROM merges GROUP BY file HAVING SUM(rejected) > 0 ORDER BY rejected DESC, file LIMIT ?''',
+    Grouping.BRANCH: '''
+        SELECT branch(target) AS branch, SUM(rejected) AS rejected, COUNT(*) AS merges, COUNT(DISTINCT file) AS files
+        FROM merges GROUP BY branch(target) HAVING SUM(rejected) > 0 ORDER BY rejected DESC, branch LIMIT ?''',
+    Grouping.SYMBOL: '''
+        SELECT file, symbol, COUNT(*) AS rejected, COUNT(DISTINCT branch(target)) AS branches
+        FROM rejects JOIN merges ON merges.id = rejects.merge_id WHERE symbol IS NOT NULL
+        GROUP BY file, symbol ORDER BY rejected DESC, file, symbol LIMIT ?''',
+    Grouping.RANGE: '''
+        SELECT file, begin, end, COUNT(*) AS rejected, COUNT(DISTINCT branch(target)) AS branches
+        FROM rejects JOIN merges ON merges.id = rejects.merge_id
+        GROUP BY file, begin, end ORDER BY rejected DESC, file, begin LIMIT ?''',
+}
+
+class Merge(NamedTuple):
+    """The merge of the difference of <file> into <target>, <rejects> holding the (begin, end, symbol)
+    source ranges of its rejected hunks."""
+    file: str
+    target: str
+    hunks: int
+    rejects: List[Tuple[int, int, Optional[str]]]
+
+def get_branch(target: str, pattern: Optional[str] = None) -> str:
+    """Returns the branch of <target>: the first group, or the whole match, of the regular expression
+    <pattern> searched for in its path, its directory without a pattern or if it doesn't match."""
+    match = re.search(pattern, target) if pattern else None
+    if not match:
+        return os.path.dirname(target)
+    return match.group(1) if match.re.groups else match.group()
+
+@lru_cache(maxsize=64)
+def _get_symbols(path: str, mtime_ns: int) -> csymbols.SymbolIndex:
+    with open(path, newline='\n', errors='surrogateescape') as f:
+        return csymbols.SymbolIndex(f)
+
+def get_symbol(before: str, hunk: Hunk) -> Optional[str]:
+    """Returns the name of the symbol of the <before> file, if it still exists, changed by <hunk>."""
+    try:
+        index = _get_symbols(before, os.stat(before).st_mtime_ns)
+    except OSError:
+        # The file is gone or comes from a git repository
+        return None
+    symbol = index.find_enclosing(hunk.source.begin if hunk.type == ChangeType.ADDED else hunk.source.begin - 1)
+    return symbol and symbol.name
+
+def _get_merge(fields: Dict, hunks: Iterable[Hunk]) -> Merge:
+    count = 0
+    rejects = []
+    for hunk in hunks:
+        count += 1
+        if hunk.conflicts is not None:
+            rejects.append((hunk.source.begin, hunk.source.end, get_symbol(fields['before'], hunk)))
+    return Merge(fields['after'], fields['target'], count, rejects)
+
+def iter_merges(path: str) -> Iterator[Merge]:
+    """Reads the merges of the log <path>, written by a merge, a batch or a tree or git command."""
+    with open(path) as f:
+        for log in logs.iter_logs(f):
+            # The hunks of the tree and git logs are held by their files, which are read along with the paths
+            if 'files' not in log.fields:
+                if 'error' not in log.fields:
+                    yield _get_merge(log.fields, log.hunks)
+                continue
+            for result in log.fields['files']:
+                if 'hunks' in result:
+                    yield _get_merge(result, map(Hunk.from_dict, result['hunks']))
+
+def read_log(path: str) -> List[Merge]:
+    return list(iter_merges(path))
+
+class Report:
+    """The index stored in the SQLite database <path>."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self) -> 'Report':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_indexed(self, path: str) -> bool:
+        """Tells whether the log <path> is indexed and hasn't changed since."""
+        stat = os.stat(path)
+        row = self._connection.execute('SELECT mtime_ns, size FROM logs WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return row == (stat.st_mtime_ns, stat.st_size)
+
+    def add(self, path: str, merges: Iterable[Merge]):
+        """Indexes the <merges> read from the log <path>, replacing the ones read from it previously."""
+        stat = os.stat(path)
+        with self._connection:
+            self._connection.execute('DELETE FROM logs WHERE path = ?', (os.path.abspath(path),))
+            log_id = self._connection.execute('INSERT INTO logs (path, mtime_ns, size) VALUES (?, ?, ?)',
+                                              (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)).lastrowid
+            for merge in merges:
+                merge_id = self._connection.execute(
+                    'INSERT INTO merges (log_id, file, target, hunks, rejected) VALUES (?, ?, ?, ?, ?)',
+                    (log_id, merge.file, merge.target, merge.hunks, len(merge.rejects))).lastrowid
+                self._connection.executemany('INSERT INTO rejects (merge_id, begin, end, symbol) VALUES (?, ?, ?, ?)',
+                                             [(merge_id, *reject) for reject in merge.rejects])
+
+    def query(self, grouping: Grouping, limit: int = 20, branch_pattern: Optional[str] = None) -> List[Dict]:
+        """Returns the rejected hunk counts of the <limit> files, branches, symbols or source ranges with the
+        most of them, in the descending order. The branches are extracted from the targets with <branch_pattern>
+        when querying, so that the index doesn't depend on it."""
+        self._connection.create_function('branch', 1, lambda target: get_branch(target, branch_pattern),
+                                         deterministic=True)
+        cursor = self._connection.execute(_QUERIES[grouping], (limit,))
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+def iter_log_paths(paths: Iterable[str]) -> Iterator[str]:
+    """Yields the <paths> of the logs, the .json and .jsonl files of the directories among them included."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if name.endswith(('.json', '.jsonl')):
+                    yield os.path.join(directory, name)
@@ -1,3 +1,4 @@
+from pathlib import Path
 from unittest.mock import Mock, MagicMock
 import pytest
 
@@ -5,6 +6,7 @@ import pytest
 def mock_system(monkeypatch):
     system = Mock()
     system.read_lines.return_value = []
+    system.iter_lines.side_effect = lambda path: iter([])
     system.diff.return_value.returncode = 1
     system.patch.return_value.returncode = 0
     monkeypatch.setattr('backport.System', system)
@@ -17,3 +19,12 @@ def mock_tempdir(monkeypatch):
     monkeypatch.setattr('tempfile.TemporaryDirectory', temp)
     return temp
 
+@pytest.fixture
+def triple(tmp_path):
+    def create(name, target='hello\n', before='hello\n', after='salut\n'):
+        paths = {}
+        for kind, content in (('before', before), ('after', after), ('target', target)):
+            paths[kind] = str(tmp_path / f'{name}.{kind}')
+            Path(paths[kind]).write_text(content)
+        return paths
+    return create
@@ -0,0 +1,50 @@
+from pathlib import Path
+import asyncio
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+
+@pytest.fixture
+def files(triple):
+    # The (before, after, target) tuples taken by merge_all_async
+    return lambda name, target: tuple(triple(name, target, 'a\nb\nc\n', 'a\nB\nc\nd\n').values())
+
+def test_merges_without_blocking(files):
+    before, after, target = files('clean', 'x\na\nb\nc\n')
+    hunks = asyncio.run(backport.merge_async(before, after, target))
+    assert Path(target).read_text() == 'x\na\nB\nc\nd\n'
+    assert [hunk.conflicts for hunk in hunks.values()] == [None, None]
+
+def test_parses_rejects(files):
+    before, after, target = files('conflict', 'q\nq\nq\n')
+    hunks = asyncio.run(backport.merge_async(before, after, target))
+    assert hunks[2].conflicts == {2: ('b', 'B')}
+    assert hunks[3].conflicts is None
+
+def test_limits_concurrent_merges(files, monkeypatch):
+    spawn = backport.System.spawn_async
+    running, peak = set(), []
+    async def spawn_async(args, **kwargs):
+        process = await spawn(args, **kwargs)
+        if args[0] == 'patch':
+            running.add(process)
+            peak.append(len(running))
+            wait = process.wait
+            async def wait_and_forget():
+                returncode = await wait()
+                running.discard(process)
+                return returncode
+            process.wait = wait_and_forget
+        return process
+    monkeypatch.setattr('backport.System.spawn_async', spawn_async)
+    triples = [files(str(i), 'a\nb\nc\n') for i in range(6)]
+    results = asyncio.run(backport.merge_all_async(triples, concurrency=2))
+    assert len(results) == 6 and max(peak) == 2
+    assert all(Path(target).read_text() == 'a\nB\nc\nd\n' for _, _, target in triples)
+
+def test_returns_failures_in_place_of_results(files):
+    triples = [files('clean', 'a\nb\nc\n'), ('missing', 'missing', 'missing')]
+    results = asyncio.run(backport.merge_all_async(triples))
+    assert isinstance(results[0], dict)
+    assert isinstance(results[1], RuntimeError)
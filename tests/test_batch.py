@@ -0,0 +1,137 @@
+from pathlib import Path
+import json
+import os
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+
+def test_reads_json_lines_manifest(tmp_path):
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('{"before": "b", "after": "a", "target": "t"}\n\n{"before": "b2", "after": "a2", "target": "t2", "log": "l"}\n')
+    assert backport.read_manifest(str(manifest)) == [
+        {'before': 'b', 'after': 'a', 'target': 't'},
+        {'before': 'b2', 'after': 'a2', 'target': 't2', 'log': 'l'},
+    ]
+
+def test_reads_csv_manifest(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('before,after,target\nb,a,t\n')
+    assert backport.read_manifest(str(manifest)) == [{'before': 'b', 'after': 'a', 'target': 't'}]
+
+def test_manifest_entries_must_be_complete(tmp_path):
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('{"before": "b", "after": "a"}\n')
+    with pytest.raises(ValueError):
+        backport.read_manifest(str(manifest))
+
+def test_job_failure_is_isolated(triple, tmp_path):
+    jobs = [triple('clean'), {'before': 'missing', 'after': 'missing', 'target': 'missing'}, triple('conflict', 'bonjour\n')]
+    jobs[0]['log'] = str(tmp_path / 'clean.json')
+    result = backport.merge_batch(jobs, workers=1)
+    assert result['summary'] == {'success': 1, 'conflict': 1, 'error': 1}
+    assert [job['status'] for job in result['jobs']] == ['success', 'error', 'conflict']
+    assert Path(jobs[0]['target']).read_text() == 'salut\n'
+    assert json.loads(Path(jobs[0]['log']).read_text())['target'] == jobs[0]['target']
+
+def test_batch_runs_in_worker_pool(triple):
+    jobs = [triple(f'job{i}') for i in range(4)]
+    result = backport.merge_batch(jobs, workers=2)
+    assert result['summary'] == {'success': 4, 'conflict': 0, 'error': 0}
+    assert all(Path(job['target']).read_text() == 'salut\n' for job in jobs)
+
+def test_computes_difference_once_for_many_targets(triple, monkeypatch):
+    paths = [triple('first'), triple('second', 'hello\nworld\n'), triple('third', 'bonjour\n')]
+    calls = []
+    get_hunks = backport.get_hunks
+    monkeypatch.setattr('backport.get_hunks', lambda *args: calls.append(args) or get_hunks(*args))
+    targets = [p['target'] for p in paths]
+    results = backport.merge_many(paths[0]['before'], paths[0]['after'], targets, backport.Engine.NATIVE, workers=1)
+    assert len(calls) == 1
+    assert list(results) == targets
+    assert Path(targets[1]).read_text() == 'salut\nworld\n'
+    assert results[targets[0]][1].conflicts is None
+    assert results[targets[2]][1].conflicts == {1: ('hello', 'salut')}
+
+def test_failure_of_one_target_is_returned(triple):
+    paths = triple('first')
+    missing = str(Path(paths['target']).parent / 'missing')
+    results = backport.merge_many(paths['before'], paths['after'], [paths['target'], missing], workers=2)
+    assert results[paths['target']][1].conflicts is None
+    assert isinstance(results[missing], Exception)
+
+def test_pairs_changed_tree_files(tmp_path):
+    for tree, files in {
+        'before': {'same.c': 'x\n', 'sub/changed.c': 'hello\n', 'other.h': 'a\n'},
+        'after': {'same.c': 'x\n', 'sub/changed.c': 'salut\n', 'other.h': 'b\n'},
+        'target': {'same.c': 'x\n', 'sub/changed.c': 'hello\n', 'other.h': 'a\n'},
+    }.items():
+        for name, content in files.items():
+            (tmp_path / tree / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / tree / name).write_text(content)
+    before, after, target = (str(tmp_path / tree) for tree in ('before', 'after', 'target'))
+    assert list(backport.pair_tree_files(before, after, target, '*.c')) == [{
+        'before': str(tmp_path / 'before/sub/changed.c'),
+        'after': str(tmp_path / 'after/sub/changed.c'),
+        'target': str(tmp_path / 'target/sub/changed.c'),
+    }]
+    log = backport.merge_tree(before, after, target, '*.c', workers=1)
+    assert log['summary'] == {'success': 1, 'conflict': 0, 'error': 0}
+    assert log['files'][0]['hunks'][0]['destination']['body'] == ['salut\n']
+    assert (tmp_path / 'target/sub/changed.c').read_text() == 'salut\n'
+    assert (tmp_path / 'target/other.h').read_text() == 'a\n'
+
+@pytest.mark.parametrize('engine', list(backport.Engine))
+@pytest.mark.parametrize('check', [False, True])
+def test_creates_files_added_to_tree(tmp_path, engine, check):
+    (tmp_path / 'before').mkdir()
+    (tmp_path / 'after/sub').mkdir(parents=True)
+    (tmp_path / 'after/sub/added.c').write_text('int x;\n')
+    before, after, target = (str(tmp_path / tree) for tree in ('before', 'after', 'target'))
+    assert [job['before'] for job in backport.pair_tree_files(before, after, target)] == [os.devnull]
+    log = backport.merge_tree(before, after, target, engine=engine, workers=1, check=check)
+    assert log['summary'] == {'success': 1, 'conflict': 0, 'error': 0}
+    assert (tmp_path / 'target/sub/added.c').exists() != check
+    if not check:
+        assert (tmp_path / 'target/sub/added.c').read_text() == 'int x;\n'
+
+@pytest.mark.parametrize('engine', list(backport.Engine))
+def test_added_file_existing_in_target_is_an_error(tmp_path, engine):
+    for tree in ('before', 'after', 'target'):
+        (tmp_path / tree).mkdir()
+    for tree in ('after', 'target'):
+        (tmp_path / tree / 'added.c').write_text('int x;\n')
+    log = backport.merge_tree(*(str(tmp_path / tree) for tree in ('before', 'after', 'target')), engine=engine, workers=1)
+    assert log['summary'] == {'success': 0, 'conflict': 0, 'error': 1}
+    assert 'already exists' in log['files'][0]['error']
+    assert (tmp_path / 'target/added.c').read_text() == 'int x;\n'
+
+@pytest.mark.parametrize('engine', list(backport.Engine))
+def test_check_reports_conflicts_of_merge_without_patching(triple, monkeypatch, engine):
+    paths = [triple('first'), triple('second', 'hello\nworld\n'), triple('third', 'bonjour\n')]
+    targets = [p['target'] for p in paths]
+    monkeypatch.setattr('backport.System.patch', lambda *args: pytest.fail('patch must not run'))
+    spawn = backport.System.spawn
+    monkeypatch.setattr('backport.System.spawn', lambda args, **kwargs: args[0] == 'patch' and pytest.fail('patch must not run')
+                        or spawn(args, **kwargs))
+    results = backport.merge_many(paths[0]['before'], paths[0]['after'], targets, engine, workers=1, check=True)
+    assert [Path(target).read_text() for target in targets] == ['hello\n', 'hello\nworld\n', 'bonjour\n']
+    assert results[targets[0]][1].conflicts is None
+    assert results[targets[2]][1].conflicts == {1: ('hello', 'salut')}
+    assert not list(Path(targets[2]).parent.glob('*.rej'))
+
+def test_check_batch_leaves_targets_untouched(triple):
+    jobs = [triple(f'job{i}', 'bonjour\n' if i % 2 else 'hello\n') for i in range(4)]
+    result = backport.merge_batch(jobs, workers=2, check=True)
+    assert result['summary'] == {'success': 2, 'conflict': 2, 'error': 0}
+    assert [job['rejected'] for job in result['jobs']] == [0, 1, 0, 1]
+    assert [Path(job['target']).read_text() for job in jobs] == ['hello\n', 'bonjour\n', 'hello\n', 'bonjour\n']
+
+def test_check_writes_status_of_every_target(triple, capsys):
+    paths = [triple('first'), triple('second', 'bonjour\n')]
+    backport.run_merge([paths[0]['before'], paths[0]['after'], *(p['target'] for p in paths), '-j', '1', '--check'])
+    assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+        {'target': paths[0]['target'], 'status': 'success', 'rejected': 0},
+        {'target': paths[1]['target'], 'status': 'conflict', 'rejected': 1},
+    ]
+    assert Path(paths[0]['target']).read_text() == 'hello\n'
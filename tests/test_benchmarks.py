@@ -0,0 +1,28 @@
+from pathlib import Path
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute() / 'benchmarks'))
+import formats
+import generate
+import native
+
+def test_generates_requested_hunks_and_conflicts():
+    before, after, target = generate.generate_triple(2000, 20, 4, conflicts=0.25, seed=1)
+    hunks = native.diff(before, after)
+    assert len(hunks) == 20
+    assert all(hunk.source.end - hunk.source.begin == 3 for hunk in hunks)
+    _, rejected = native.apply(target, hunks)
+    assert len(rejected) == 5
+
+def test_generated_rejects_are_parsed_back():
+    before, after, _ = generate.generate_triple(200, 5, 3)
+    hunks = native.diff(before, after)
+    parsed = formats.parse_reject(generate.format_reject(hunks))
+    assert [(h.source.begin, h.source.end, h.destination.begin, h.destination.end) for h in parsed] == \
+        [(h.source.begin, h.source.end, h.destination.begin, h.destination.end) for h in hunks]
+    assert parsed[0].source.body == [line.rstrip('\n') for line in hunks[0].source.body]
+
+def test_rejects_hunks_not_fitting_into_the_file():
+    with pytest.raises(ValueError):
+        generate.generate_triple(10, 5, 4)
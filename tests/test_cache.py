@@ -0,0 +1,72 @@
+from pathlib import Path
+import os
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from cache import HunkCache, dump_hunks, load_hunks
+from formats import Hunk, Chunk, ChangeType
+import backport
+
+HUNKS = [
+    Hunk(ChangeType.CHANGED, Chunk(1, 2, ['a\n', 'b\n']), Chunk(1, 1, ['c\n'])),
+    Hunk(ChangeType.ADDED, Chunk(4, 4), Chunk(4, 4, ['d'])),
+    Hunk(ChangeType.DELETED, Chunk(7, 7, ['e\n']), Chunk(6, 6)),
+]
+
+def test_serialized_hunks_are_loaded_back():
+    assert load_hunks(dump_hunks(HUNKS)) == HUNKS
+
+def test_counts_hits_and_misses(tmp_path):
+    cache = HunkCache(str(tmp_path))
+    key = cache.get_key('before', 'after')
+    assert cache.get(key) is None
+    cache.put(key, HUNKS)
+    assert cache.get(key) == HUNKS
+    assert cache.counters == {'hits': 1, 'misses': 1}
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = HunkCache(str(tmp_path), max_size=len(dump_hunks(HUNKS)) * 2)
+    keys = [cache.get_key(str(i), str(i)) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, HUNKS)
+        os.utime(tmp_path / key, (i, i))
+    cache.get(keys[0])
+    cache.put(keys[2], HUNKS)
+    assert sorted(os.listdir(tmp_path)) == sorted([keys[0], keys[2]])
+
+def test_scans_directory_only_when_estimated_size_exceeds_limit(tmp_path, monkeypatch):
+    cache = HunkCache(str(tmp_path), max_size=len(dump_hunks(HUNKS)) * 3)
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr('os.scandir', lambda path: scans.append(path) or scandir(path))
+    for i in range(4):
+        cache.put(cache.get_key(str(i), str(i)), HUNKS)
+    assert len(scans) == 2
+    assert len(os.listdir(tmp_path)) == 3
+
+def test_merge_skips_diff_on_cache_hit(tmp_path, monkeypatch):
+    (tmp_path / 'before').write_text('hello\n')
+    (tmp_path / 'after').write_text('salut\n')
+    cache = HunkCache(str(tmp_path / 'cache'))
+    for name in ('first', 'second'):
+        (tmp_path / name).write_text('hello\n')
+        backport.merge(str(tmp_path / 'before'), str(tmp_path / 'after'), str(tmp_path / name), cache=cache)
+        monkeypatch.setattr('backport.get_hunks', None)
+    assert (tmp_path / 'second').read_text() == 'salut\n'
+    assert cache.counters == {'hits': 1, 'misses': 1}
+
+def test_pipe_engine_merges_cached_empty_difference(tmp_path):
+    for name in ('before', 'after', 'target'):
+        (tmp_path / name).write_text('hello\n')
+    cache = HunkCache(str(tmp_path / 'cache'))
+    for _ in range(2):
+        hunks = backport.merge(*(str(tmp_path / name) for name in ('before', 'after', 'target')), backport.Engine.PIPE,
+                               cache=cache)
+        assert hunks == {}
+    assert cache.counters == {'hits': 1, 'misses': 1}
+
+def test_context_is_part_of_the_key(tmp_path):
+    cache = HunkCache(str(tmp_path))
+    assert cache.get_key('before', 'after') != cache.get_key('before', 'after', context=3)
+    hunks = [Hunk(ChangeType.CHANGED, Chunk(2, 2, ['b\n']), Chunk(2, 2, ['B\n']), leading=['a\n'], trailing=[])]
+    assert load_hunks(dump_hunks(hunks)) == hunks
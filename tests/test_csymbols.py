@@ -0,0 +1,75 @@
+from pathlib import Path
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from csymbols import Symbol, SymbolIndex
+import backport
+import csymbols
+import native
+
+SOURCE = '''#include <stdio.h>
+#define MAX(a, b) \\
+    ((a) > (b) ? (a) : (b))
+
+/* int commented(void) { */
+struct point {
+    int x, y;
+};
+
+static int table[] = { 1, 2 };
+
+extern "C" {
+int
+add(int a, int b)
+{
+    const char *brace = "}";
+    if (a) { return a + b; }  // }
+    return '{';
+}
+}
+
+typedef struct { int z; } anonymous;
+'''
+
+def test_finds_top_level_definitions():
+    assert csymbols.get_symbols(SOURCE.splitlines(keepends=True)) == [
+        Symbol('point', 'struct', 5, 8),
+        Symbol('add', 'function', 12, 19),
+    ]
+
+def test_index_finds_enclosing_and_unique_symbols():
+    index = SymbolIndex(['void f() {\n', '}\n', 'void g() {\n', '}\n', 'void g() {\n', '}\n', 'int x;\n'])
+    assert index.find_enclosing(1) == Symbol('f', 'function', 0, 2)
+    assert index.find_enclosing(6) is None
+    assert index.find('f', 'function') == Symbol('f', 'function', 0, 2)
+    # Defined twice, e.g. under different preprocessor conditions
+    assert index.find('g', 'function') is None
+    assert index.find('f', 'struct') is None
+
+FIRST = ['int first(void)\n', '{\n', '    int i = 0;\n', '    return i;\n', '}\n']
+SECOND = ['int second(void)\n', '{\n', '    int i = 1;\n', '    return i;\n', '}\n']
+
+def test_relocates_hunks_into_moved_and_reindented_symbol():
+    before = FIRST + ['\n'] + SECOND
+    after = FIRST + ['\n'] + SECOND[:3] + ['    i++;\n'] + SECOND[3:]
+    target = ['int second(void)\n', '{\n', '\tint i = 1;\n', '\treturn i;\n', '}\n', '\n'] + FIRST
+    hunks = native.diff(before, after, context=3)
+    placements, rejected = native.place(target, hunks)
+    assert rejected == hunks
+    placements, rejected = csymbols.relocate(before, target, placements, rejected)
+    assert rejected == []
+    assert list(native.iter_patched(target, placements)) == target[:3] + ['    i++;\n'] + target[3:]
+
+def test_keeps_hunks_of_missing_symbols_rejected():
+    before = FIRST + ['\n'] + SECOND
+    after = FIRST + ['\n'] + SECOND[:2] + ['    int i = 2;\n'] + SECOND[3:]
+    hunks = native.diff(before, after)
+    assert csymbols.relocate(before, FIRST, [], hunks) == ([], hunks)
+
+def test_native_merge_relocates_rejected_hunks(tmp_path):
+    (tmp_path / 'before.c').write_text(''.join(FIRST + ['\n'] + SECOND))
+    (tmp_path / 'after.c').write_text(''.join(FIRST + ['\n'] + SECOND[:2] + ['    int i = 2;\n'] + SECOND[3:]))
+    target = ['int second(void)\n', '{\n', '  int i = 1;\n', '  return i;\n', '}\n', '\n'] + FIRST
+    (tmp_path / 'target.c').write_text(''.join(target))
+    hunks = backport.merge(*(str(tmp_path / name) for name in ('before.c', 'after.c', 'target.c')), backport.Engine.NATIVE)
+    assert [hunk.conflicts for hunk in hunks.values()] == [None]
+    assert (tmp_path / 'target.c').read_text() == ''.join(target[:2] + ['    int i = 2;\n'] + target[3:])
@@ -0,0 +1,98 @@
+from functools import partial
+from pathlib import Path
+from unittest.mock import Mock
+import json
+import os
+import pytest
+import socket
+import sys
+import tempfile
+import threading
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+import client
+import daemon
+
+@pytest.fixture
+def paths(triple):
+    return triple('request', 'bonjour\nworld\n', 'hello\nworld\n', 'salut\nworld\n')
+
+@pytest.fixture
+def server(monkeypatch):
+    # The paths of Unix sockets are limited to about a hundred characters
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'backport.sock')
+        monkeypatch.setenv('BACKPORT_SOCKET', path)
+        with daemon.Server(path, partial(backport.merge_request, engine=backport.Engine.NATIVE)) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            yield path
+            server.shutdown()
+            thread.join()
+
+def test_responds_with_log(server, paths):
+    response = daemon.request(paths, server)
+    assert response['status'] == 'conflict'
+    assert response['rejected'] == 1
+    assert response['log']['target'] == paths['target']
+    assert response['log']['hunks'][0]['conflicts'] == {'1': ['hello', 'salut']}
+
+def test_responds_with_error(server, paths):
+    response = daemon.request({**paths, 'before': 'missing'}, server)
+    assert response['status'] == 'error'
+    assert 'missing' in response['error']
+
+def test_responds_with_missing_fields(server, paths):
+    response = daemon.request({'before': paths['before']}, server)
+    assert response == {'status': 'error', 'error': 'The request misses after, target'}
+
+def test_connection_survives_malformed_request(server, paths):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(server)
+        with connection.makefile('rwb') as stream:
+            stream.write(b'{"before"\n')
+            stream.flush()
+            assert daemon.receive(stream)['status'] == 'error'
+            daemon.send(stream, paths)
+            assert daemon.receive(stream)['status'] == 'conflict'
+
+def test_refuses_to_replace_running_server(server):
+    with pytest.raises(RuntimeError):
+        daemon.Server(server, lambda message: message)
+
+def test_keeps_file_which_is_not_socket(tmp_path):
+    path = tmp_path / 'precious.txt'
+    path.write_text('precious\n')
+    with pytest.raises(RuntimeError):
+        daemon.Server(str(path), lambda message: message)
+    assert path.read_text() == 'precious\n'
+
+@pytest.mark.parametrize('argv, expected', [
+    (['b', 'a', 't'], {'profile': False, 'before': 'b', 'after': 'a', 'target': 't'}),
+    (['b', '--log=l', 'a', '-e', 'pipe', 't', '--profile'], {'profile': True, 'log': 'l', 'engine': 'pipe', 'before': 'b', 'after': 'a', 'target': 't'}),
+    (['b', 'a', 't', '--log-format', 'jsonl'], {'profile': False, 'log_format': 'jsonl', 'before': 'b', 'after': 'a', 'target': 't'}),
+    (['b', 'a', 't', '--log-format=xml'], None),
+    (['b', 'a', 't1', 't2'], None),
+    (['batch', 'manifest'], None),
+    (['b', 'a', 't', '--jobs', '2'], None),
+    (['b', 'a', 't', '--check'], None),
+    (['b', 'a', 't', '-e', 'unknown'], None),
+    (['-h'], None),
+])
+def test_parses_client_arguments(argv, expected):
+    assert client.parse_args(argv) == expected
+
+def test_client_merges_through_daemon(server, paths, tmp_path, monkeypatch):
+    monkeypatch.setattr('backport.main', Mock(side_effect=AssertionError('The merge must not be performed by the client')))
+    log = tmp_path / 'log.json'
+    client.main([paths['before'], paths['after'], paths['target'], '-l', str(log)])
+    assert Path(paths['target']).read_text() == 'bonjour\nworld\n'
+    assert json.loads(log.read_text())['hunks'][0]['type'] == 'CHANGED'
+    client.main([paths['before'], paths['after'], paths['target'], '-l', str(log), '--log-format', 'jsonl'])
+    header, *hunks = [json.loads(line) for line in log.read_text().splitlines()]
+    assert header == {key: paths[key] for key in ('before', 'after', 'target')} and hunks[0]['rejected']
+
+def test_client_falls_back_without_daemon(paths, tmp_path, monkeypatch):
+    monkeypatch.setenv('BACKPORT_SOCKET', str(tmp_path / 'missing.sock'))
+    client.main([paths['before'], paths['after'], paths['target']])
+    assert Path(paths['target']).read_text() == 'bonjour\nworld\n'
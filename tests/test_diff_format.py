@@ -80,3 +80,23 @@ def test_throws_if_bad_header_format():
 
 def test_returns_empty_list_on_empty_input():
     assert formats.parse_diff([]) == []
+
+def test_iterates_hunks_lazily():
+    def lines():
+        yield '1c1'
+        yield '< hello'
+        yield '---'
+        yield '> salut'
+        yield '3a4'
+        raise AssertionError('The second hunk must not be read before the first one is consumed')
+    hunk = next(formats.iter_diff(lines()))
+    assert hunk.destination.body == ['salut']
+
+def test_parser_returns_hunks_as_they_are_completed():
+    lines = ['1c1\n', '< hello\n', '---\n', '> salut\n', '3a4\n', '> world\n', '5,6d5\n', '< a\n', '< b\n']
+    parser = formats.DiffParser()
+    completed = [parser.feed(line) for line in lines]
+    assert [i for i, hunk in enumerate(completed) if hunk] == [4, 6]
+    assert completed[4].destination.body == ['salut\n']
+    assert [completed[4], completed[6], parser.close()] == formats.parse_diff(lines)
+    assert parser.close() is None
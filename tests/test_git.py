@@ -0,0 +1,99 @@
+from pathlib import Path
+import pytest
+import subprocess
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+import gitstore
+
+def git(repository, *args):
+    subprocess.run(['git', '-C', str(repository), '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                   check=True, capture_output=True)
+
+@pytest.fixture
+def repository(tmp_path):
+    git(tmp_path, 'init', '-q')
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'x.c').write_text('a\nb\nc\n')
+    (tmp_path / 'y.c').write_text('one\r\ntwo\n')
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'before')
+    git(tmp_path, 'tag', 'before')
+    (tmp_path / 'src' / 'x.c').write_text('a\nB\nc\n')
+    (tmp_path / 'src' / 'z.c').write_text('new\n')
+    (tmp_path / 'y.c').write_text('one\r\n2\n')
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'after')
+    git(tmp_path, 'tag', 'after')
+    git(tmp_path, 'checkout', '-q', 'before')
+    return tmp_path
+
+def test_reads_blobs(repository):
+    with gitstore.GitStore(str(repository)) as store:
+        object_id, lines = store.read_lines('after', 'y.c')
+        assert lines == ['one\r\n', '2\n']
+        assert store.read('before', 'src/z.c') is None
+        assert store.read_lines('after', 'src/x.c')[1] == ['a\n', 'B\n', 'c\n']
+        assert len(object_id) == 40
+
+def test_rejects_directories(repository):
+    with gitstore.GitStore(str(repository)) as store:
+        with pytest.raises(gitstore.GitError):
+            store.read('after', 'src')
+
+def test_lists_changed_paths(repository):
+    assert gitstore.list_changed_paths(str(repository), 'before', 'after') == ['src/x.c', 'src/z.c', 'y.c']
+    assert gitstore.list_changed_paths(str(repository), 'before', 'after', ['src']) == ['src/x.c', 'src/z.c']
+
+def test_resolve_fails_on_unknown_revision(repository):
+    with pytest.raises(gitstore.GitError):
+        gitstore.resolve(str(repository), 'unknown')
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_merges_into_target_directory(repository, tmp_path_factory, workers):
+    target = tmp_path_factory.mktemp('target')
+    (target / 'src').mkdir()
+    (target / 'src' / 'x.c').write_text('x\na\nb\nc\n')
+    log = backport.merge_git(str(repository), 'before', 'after', ['src'], str(target), workers)
+    assert log['summary'] == {'success': 2, 'conflict': 0, 'error': 0}
+    assert (target / 'src' / 'x.c').read_text() == 'x\na\nB\nc\n'
+    assert (target / 'src' / 'z.c').read_text() == 'new\n'
+    assert log['files'][0]['before'] == f'{log["before"]}:src/x.c'
+
+def test_merges_into_working_tree_with_cache(repository, tmp_path):
+    cache = backport.HunkCache(str(tmp_path / 'cache'))
+    log = backport.merge_git(str(repository), 'before', 'after', workers=1, cache=cache)
+    assert log['summary']['cache'] == {'hits': 0, 'misses': 3}
+    assert (repository / 'y.c').read_bytes() == b'one\r\n2\n'
+
+def test_check_leaves_target_directory_untouched(repository, tmp_path_factory):
+    target = tmp_path_factory.mktemp('target')
+    (target / 'src').mkdir()
+    (target / 'src' / 'x.c').write_text('a\nd\nc\n')
+    log = backport.merge_git(str(repository), 'before', 'after', ['src'], str(target), workers=1, check=True)
+    assert log['summary'] == {'success': 1, 'conflict': 1, 'error': 0}
+    assert log['files'][0]['hunks'][0]['conflicts'] == {2: ('b', 'B')}
+    assert (target / 'src' / 'x.c').read_text() == 'a\nd\nc\n'
+    assert not (target / 'src' / 'z.c').exists()
+
+def test_added_file_existing_in_target_is_an_error(repository, tmp_path_factory):
+    target = tmp_path_factory.mktemp('target')
+    (target / 'src').mkdir()
+    (target / 'src' / 'z.c').write_text('new\n')
+    log = backport.merge_git(str(repository), 'before', 'after', ['src/z.c'], str(target), 1)
+    assert log['summary'] == {'success': 0, 'conflict': 0, 'error': 1}
+    assert (target / 'src' / 'z.c').read_text() == 'new\n'
+
+def test_relocates_hunks_into_moved_functions(tmp_path_factory):
+    repository, target = tmp_path_factory.mktemp('repository'), tmp_path_factory.mktemp('target')
+    f, g = 'int f(void)\n{\n    return 0;\n}\n', 'int g(void)\n{\n    return 1;\n}\n'
+    git(repository, 'init', '-q')
+    (repository / 'x.c').write_text(f + '\n' + g)
+    git(repository, 'add', '.')
+    git(repository, 'commit', '-q', '-m', 'before')
+    (repository / 'x.c').write_text(f + '\n' + g.replace('1', '2'))
+    git(repository, 'commit', '-q', '-a', '-m', 'after')
+    (target / 'x.c').write_text(g.replace('    ', '  ') + '\n' + f)
+    log = backport.merge_git(str(repository), 'HEAD~', 'HEAD', target_dir=str(target), workers=1)
+    assert log['summary'] == {'success': 1, 'conflict': 0, 'error': 0}
+    assert (target / 'x.c').read_text() == 'int g(void)\n{\n    return 2;\n}\n\n' + f
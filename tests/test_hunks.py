@@ -4,6 +4,8 @@ import sys
 sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
 from formats import Hunk, Chunk, ChangeType
 from unittest.mock import Mock
+import formats
+import pickle
 
 def test_id_is_source_begin():
     hunk = Hunk(type=ChangeType.CHANGED, source=Chunk(begin=1, end=2), destination=Chunk(begin=3, end=4))
@@ -69,3 +71,48 @@ def test_skips_conflicts_if_none():
             'body': ['salut', 'monde']
         },
     }
+
+def test_hunks_have_no_instance_dictionary():
+    hunk = Hunk(type=ChangeType.ADDED, source=Chunk(begin=1, end=1), destination=Chunk(begin=2, end=2, body=['a\n']))
+    assert not hasattr(hunk, '__dict__') and not hasattr(hunk.source, '__dict__')
+    with pytest.raises(AttributeError):
+        hunk.extra = True
+
+def test_chunk_dictionary_is_a_copy():
+    chunk = Chunk(begin=1, end=2, body=['a\n', 'b\n'])
+    chunk.to_dict()['begin'] = 5
+    assert chunk.to_dict() == {'begin': 1, 'end': 2, 'body': ['a\n', 'b\n']}
+
+def test_hunks_are_pickled():
+    hunk = Hunk(type=ChangeType.DELETED, source=Chunk(begin=3, end=3, body=['a\n']), destination=Chunk(begin=2, end=2),
+                conflicts={3: ('a', None)}, leading=['b\n'], trailing=[])
+    assert pickle.loads(pickle.dumps(hunk)) == hunk
+
+def test_hunks_are_converted_to_tuples():
+    hunk = Hunk(type=ChangeType.CHANGED, source=Chunk(begin=3, end=3, body=['a\n']), destination=Chunk(3, 3, ['b\n']),
+                conflicts={3: ('a', 'c')}, leading=['x\n'], trailing=['y\n'])
+    assert Hunk.from_tuple(pickle.loads(pickle.dumps(hunk.to_tuple()))) == hunk
+
+def test_sorts_hunks_by_identifier():
+    hunks = {i: Hunk(type=ChangeType.ADDED, source=Chunk(begin=i, end=i), destination=Chunk(begin=i, end=i, body=['a\n'])) for i in (5, 1, 3)}
+    assert [hunk.id for hunk in formats.sort_hunks(hunks)] == [1, 3, 5]
+    assert sorted(hunks.values(), key=formats.get_id) == formats.sort_hunks(hunks)
+
+def changed(begin, removed, added, shift=0):
+    return Hunk(ChangeType.CHANGED, Chunk(begin, begin, [removed]), Chunk(begin + shift, begin + shift, [added]))
+
+def test_index_matches_shifted_rejects_by_lines():
+    hunks = [changed(2, 'a\n', 'A\n'), changed(7, 'g\n', 'G\n'), changed(20, 'g\n', 'G\n')]
+    index = formats.HunkIndex(hunks)
+    # Rejects lack the line feeds and are numbered after the patched target
+    assert index.find(changed(9, 'g', 'G')) is hunks[1]
+    assert index.find(changed(9, 'g', 'G')) is hunks[2]
+    assert index.find(changed(9, 'g', 'G')) is None
+
+def test_index_falls_back_to_overlapping_hunk():
+    hunks = [changed(2, 'a\n', 'A\n'), Hunk(ChangeType.CHANGED, Chunk(5, 8, ['e\n'] * 4), Chunk(5, 5, ['E\n']))]
+    index = formats.HunkIndex(hunks)
+    assert index.find(changed(6, 'x', 'y')) is hunks[1]
+    assert index.find(changed(6, 'x', 'y')) is None
+    assert index.find(changed(12, 'x', 'y')) is None
+    assert index.find(changed(2, 'a', 'A')) is hunks[0]
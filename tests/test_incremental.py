@@ -0,0 +1,102 @@
+from pathlib import Path
+import json
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+
+BEFORE = ''.join(f'line {i}\n' for i in range(1, 11))
+AFTER = BEFORE.replace('line 2\n', 'line two\n').replace('line 8\n', 'line eight\n')
+
+@pytest.fixture
+def paths(triple, tmp_path):
+    paths = triple('merge', BEFORE.replace('line 8\n', 'line 8 fixed\n'), BEFORE, AFTER)
+    paths['log'] = str(tmp_path / 'log.json')
+    return paths
+
+def run(paths, *options):
+    backport.run_merge([paths['before'], paths['after'], paths['target'], '-l', paths['log'], '--incremental', *options])
+    return json.loads(Path(paths['log']).read_text())
+
+def forbid_diff(monkeypatch):
+    monkeypatch.setattr('backport.merge', lambda *args: pytest.fail('The difference must not be computed again'))
+
+def test_first_merge_records_digests(paths):
+    log = run(paths)
+    assert [hunk['rejected'] for hunk in log['hunks']] == [False, True]
+    assert log['digests'] == {kind: backport.get_digest(paths[kind]) for kind in ('before', 'after', 'target')}
+    assert log['context'] == 0
+
+def test_unchanged_target_carries_hunks_forward(paths, monkeypatch):
+    first = run(paths)
+    forbid_diff(monkeypatch)
+    monkeypatch.setattr('backport.System.read_lines', lambda path: pytest.fail('The target must not be read'))
+    assert run(paths) == first
+
+def test_conflict_resolved_by_hand_is_no_longer_rejected(paths, monkeypatch):
+    run(paths)
+    target = Path(paths['target'])
+    target.write_text(target.read_text().replace('line 8 fixed\n', 'line eight\n'))
+    forbid_diff(monkeypatch)
+    log = run(paths)
+    assert [hunk['rejected'] for hunk in log['hunks']] == [False, False]
+    assert target.read_text() == AFTER
+    assert log['digests']['target'] == backport.get_digest(paths['target'])
+
+def test_rejected_hunk_applying_now_is_applied(paths, monkeypatch):
+    run(paths)
+    target = Path(paths['target'])
+    target.write_text(target.read_text().replace('line 8 fixed\n', 'line 8\n'))
+    forbid_diff(monkeypatch)
+    assert [hunk['rejected'] for hunk in run(paths)['hunks']] == [False, False]
+    assert target.read_text() == AFTER
+
+def test_hunks_undone_in_target_are_applied_again(paths, monkeypatch):
+    original = Path(paths['target']).read_text()
+    run(paths)
+    Path(paths['target']).write_text(original)
+    forbid_diff(monkeypatch)
+    log = run(paths)
+    assert [hunk['rejected'] for hunk in log['hunks']] == [False, True]
+    assert Path(paths['target']).read_text() == original.replace('line 2\n', 'line two\n')
+
+def test_applied_hunk_no_longer_applying_is_rejected(paths, monkeypatch):
+    run(paths)
+    target = Path(paths['target'])
+    target.write_text(target.read_text().replace('line two\n', 'line 2 fixed\n'))
+    forbid_diff(monkeypatch)
+    log = run(paths)
+    assert [hunk['rejected'] for hunk in log['hunks']] == [True, True]
+    assert log['hunks'][0]['conflicts'] == {'2': ['line 2', 'line two']}
+
+def test_still_rejected_hunk_keeps_conflicts(paths):
+    first = run(paths)
+    target = Path(paths['target'])
+    target.write_text('line 0\n' + target.read_text())
+    log = run(paths)
+    assert log['hunks'] == first['hunks']
+    assert log['digests']['target'] != first['digests']['target']
+
+@pytest.mark.parametrize('change', ['after', 'context'])
+def test_changed_inputs_are_merged_again(paths, change):
+    run(paths)
+    Path(paths['target']).write_text(BEFORE)
+    options = ['-U', '1'] if change == 'context' else []
+    if change == 'after':
+        Path(paths['after']).write_text(AFTER.replace('line 5\n', 'line five\n'))
+    log = run(paths, *options)
+    assert not any(hunk['rejected'] for hunk in log['hunks'])
+    assert Path(paths['target']).read_text() == Path(paths['after']).read_text()
+
+def test_reads_log_of_target(paths, tmp_path):
+    hunks = [backport.Hunk.from_dict(hunk) for hunk in run(paths)['hunks']]
+    log = backport.read_previous_log(paths['log'], paths['target'])
+    assert list(log.hunks) == hunks
+    assert 'digests' in log.fields
+    assert backport.read_previous_log(paths['log'], 'other') is None
+    assert backport.read_previous_log(str(tmp_path / 'missing.json'), paths['target']) is None
+
+def test_requires_log(paths):
+    with pytest.raises(SystemExit) as e:
+        backport.run_merge([paths['before'], paths['after'], paths['target'], '--incremental'])
+    assert e.value.code == backport.ExitCodes.BAD_ARGUMENT.value
@@ -0,0 +1,60 @@
+from pathlib import Path
+import os
+import pickle
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from lines import LineIndex, get_offsets
+import backport
+import lines as lines_module
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / 'file').write_bytes(b'a\nb\n\nc')
+    with LineIndex(str(tmp_path / 'file')) as index:
+        yield index
+
+def test_finds_line_offsets(monkeypatch):
+    assert list(get_offsets(b'a\nbc\n')) == [0, 2, 5]
+    assert list(get_offsets(b'a\nbc')) == [0, 2, 4]
+    assert list(get_offsets(b'')) == [0]
+    monkeypatch.setattr(lines_module, '_BLOCK_SIZE', 3)
+    assert list(get_offsets(b'ab\ncd\n\nefgh\ni')) == [0, 3, 6, 7, 12, 13]
+
+def test_reads_lines_like_readlines(index):
+    assert len(index) == 4
+    assert list(index) == ['a\n', 'b\n', '\n', 'c']
+    assert index[1] == 'b\n' and index[-1] == 'c'
+    with pytest.raises(IndexError):
+        index[4]
+
+def test_slices_are_views(index):
+    view = index[1:3]
+    assert (view.begin, view.end) == (1, 3)
+    assert view == ['b\n', '\n'] and ['b\n', '\n'] == view
+    assert view[1:] == ['\n'] and index[3:1] == []
+    assert bytes(view.get_bytes()) == b'b\n\n'
+    assert list(index.get_terminated()[2:]) == ['\n', 'c\n']
+
+def test_views_are_pickled_as_lists(index):
+    assert pickle.loads(pickle.dumps(index[0:2])) == ['a\n', 'b\n']
+
+def test_maps_empty_file(tmp_path):
+    (tmp_path / 'empty').write_text('')
+    assert list(LineIndex(str(tmp_path / 'empty'))) == []
+
+@pytest.mark.parametrize('context', [0, 2])
+def test_merges_mapped_files(tmp_path, monkeypatch, context):
+    before = [f'line {i}\n' for i in range(50)]
+    after = before[:10] + ['added\n'] + before[10:30] + ['changed\n'] + before[31:]
+    (tmp_path / 'before').write_text(''.join(before))
+    (tmp_path / 'after').write_text(''.join(after))
+    target = before[:30] + ['other\n'] + before[31:-1] + ['last']
+    (tmp_path / 'target').write_text(''.join(target))
+    os.chmod(tmp_path / 'target', 0o640)
+    monkeypatch.setattr('backport.MAPPED_FILE_SIZE', 0)
+    hunks = backport.merge(str(tmp_path / 'before'), str(tmp_path / 'after'), str(tmp_path / 'target'), context=context)
+    assert (tmp_path / 'target').read_text() == ''.join(target[:10] + ['added\n'] + target[10:])
+    assert os.stat(tmp_path / 'target').st_mode & 0o777 == 0o640
+    assert [hunk.conflicts for hunk in hunks.values()] == [None, {31: ('line 30', 'changed')}]
+    assert backport.get_log('before', 'after', 'target', hunks.values())['hunks'][0]['destination']['body'] == ['added\n']
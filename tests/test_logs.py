@@ -0,0 +1,92 @@
+from pathlib import Path
+import io
+import json
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from formats import Hunk, Chunk, ChangeType, FormatError
+from logs import LogFormat
+import backport
+import logs
+
+FIELDS = {'before': 'b', 'after': 'a', 'target': 't'}
+HUNKS = [
+    Hunk(ChangeType.CHANGED, Chunk(1, 2, ['a\n', 'b "quoted"\n']), Chunk(1, 1, ['c'])),
+    Hunk(ChangeType.ADDED, Chunk(4, 4), Chunk(4, 4, ['d\n']), conflicts={5: ('x', None)}, leading=['z\n'], trailing=[]),
+    Hunk(ChangeType.DELETED, Chunk(7, 7, ['e\n']), Chunk(6, 6), conflicts={}),
+]
+TRAILER = {'cache': {'hits': 1, 'misses': 0}}
+
+def format_log(hunks, trailer, log_format=LogFormat.JSON):
+    return ''.join(logs.format_log(FIELDS, (hunk.to_dict() for hunk in hunks), lambda: trailer, log_format))
+
+@pytest.mark.parametrize('hunks', [HUNKS, []])
+@pytest.mark.parametrize('trailer', [TRAILER, {}])
+def test_json_log_matches_json_dumps(hunks, trailer):
+    assert format_log(hunks, trailer) == json.dumps(backport.get_log('b', 'a', 't', hunks, trailer.get('cache')), indent=2)
+
+def test_several_json_logs_match_json_dumps():
+    error = {**FIELDS, 'error': 'boom'}
+    text = ''.join(logs.format_logs([(FIELDS, [h.to_dict() for h in HUNKS], TRAILER), (error, None, None)]))
+    assert text == json.dumps([backport.get_log('b', 'a', 't', HUNKS, TRAILER['cache']), error], indent=2)
+    assert ''.join(logs.format_logs([])) == '[]'
+
+def test_json_lines_log_has_a_record_per_hunk():
+    lines = format_log(HUNKS, TRAILER, LogFormat.JSONL).splitlines()
+    assert [json.loads(line) for line in lines] == [FIELDS] + [json.loads(json.dumps(h.to_dict())) for h in HUNKS] + [TRAILER]
+
+def test_hunks_are_converted_back():
+    assert [Hunk.from_dict(json.loads(json.dumps(h.to_dict()))) for h in HUNKS] == HUNKS
+
+@pytest.mark.parametrize('log_format', list(LogFormat))
+def test_reads_logs_back(log_format):
+    log = next(logs.iter_logs(io.StringIO(format_log(HUNKS, TRAILER, log_format))))
+    assert log.fields == FIELDS
+    assert list(log.hunks) == HUNKS
+    assert log.fields == {**FIELDS, **TRAILER}
+
+@pytest.mark.parametrize('log_format', list(LogFormat))
+def test_skips_hunks_left_unread(log_format):
+    text = ''.join(logs.format_logs([(FIELDS, [h.to_dict() for h in HUNKS], None), ({**FIELDS, 'error': 'boom'}, None, None),
+                                     ({**FIELDS, 'target': 't2'}, [HUNKS[0].to_dict()], TRAILER)], log_format))
+    assert [log.fields['target'] for log in logs.iter_logs(io.StringIO(text))] == ['t', 't', 't2']
+    assert [list(log.hunks) for log in logs.iter_logs(io.StringIO(text))] == [HUNKS, [], [HUNKS[0]]]
+
+def test_reads_values_across_blocks():
+    scanner = logs._Scanner(io.StringIO(' [12345, "abcdef", {"a": [1, 2]}]'), block_size=3)
+    scanner.expect('[')
+    values = [scanner.value()]
+    while scanner.peek() == ',':
+        scanner.expect(',')
+        values.append(scanner.value())
+    scanner.expect(']')
+    assert values == [12345, 'abcdef', {'a': [1, 2]}]
+
+def test_reads_hunks_lazily():
+    class Truncated(io.StringIO):
+        def read(self, size=-1):
+            data = super().read(size)
+            if not data:
+                raise AssertionError('The end of the log must not be read before the hunks are iterated')
+            return data
+    text = format_log(HUNKS, TRAILER)
+    log = next(logs.iter_logs(Truncated(text[:text.index('"type": "ADDED"')])))
+    assert next(log.hunks) == HUNKS[0]
+
+@pytest.mark.parametrize('text', ['', '{\n  "before": "b",\n  "hunks": [1]}', '{\n  "before": "b",\n  "hunks": [{}', '{"before": "b"}\n{"type": '])
+def test_throws_on_malformed_log(text):
+    with pytest.raises(FormatError):
+        for log in logs.iter_logs(io.StringIO(text)):
+            list(log.hunks)
+
+@pytest.mark.parametrize('log_format', list(LogFormat))
+def test_merge_writes_log_in_format(tmp_path, log_format):
+    for name, content in (('before', 'hello\n'), ('after', 'salut\n'), ('target', 'bonjour\n'), ('other', 'hello\n')):
+        (tmp_path / name).write_text(content)
+    paths = [str(tmp_path / name) for name in ('before', 'after', 'target')]
+    backport.main([*paths, '-l', str(tmp_path / 'log'), '--log-format', log_format.value, '--profile', '-e', 'native'])
+    log = next(logs.iter_logs(open(tmp_path / 'log')))
+    assert [hunk.conflicts for hunk in log.hunks] == [{1: ('hello', 'salut')}]
+    assert log.fields['target'] == paths[2] and 'apply' in log.fields['timings']
+    backport.main([*paths, str(tmp_path / 'other'), '-l', str(tmp_path / 'logs'), '--log-format', log_format.value, '-j', '1'])
+    assert [[h.conflicts for h in log.hunks] for log in logs.iter_logs(open(tmp_path / 'logs'))] == [[{1: ('hello', 'salut')}], [None]]
@@ -0,0 +1,178 @@
+from pathlib import Path
+import pytest
+import random
+import shutil
+import subprocess
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from formats import Hunk, Chunk, ChangeType
+import formats
+import native
+
+def apply_hunks(before, hunks):
+    result, position = [], 0
+    for hunk in hunks:
+        begin = hunk.source.begin if hunk.type == ChangeType.ADDED else hunk.source.begin - 1
+        result.extend(before[position:begin])
+        position = begin + len(hunk.source.body or [])
+        result.extend(hunk.destination.body or [])
+    return result + before[position:]
+
+def lcs_length(a, b):
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a)):
+        for j in range(len(b)):
+            lengths[i + 1][j + 1] = lengths[i][j] + 1 if a[i] == b[j] else max(lengths[i][j + 1], lengths[i + 1][j])
+    return lengths[-1][-1]
+
+def test_interns_equal_lines_to_equal_numbers():
+    assert native.intern_lines(['a', 'b', 'a'], ['b', 'c']) == [[0, 1, 0], [1, 2]]
+
+def test_returns_no_hunks_for_equal_input():
+    assert native.diff(['a\n', 'b\n'], ['a\n', 'b\n']) == []
+    assert native.diff([], []) == []
+
+def test_produces_hunks_in_normal_format_coordinates():
+    hunks = native.diff(['a\n', 'b\n', 'c\n', 'd\n'], ['b\n', 'C\n', 'd\n', 'e\n'])
+    assert hunks == [
+        Hunk(ChangeType.DELETED, Chunk(1, 1, ['a\n']), Chunk(0, 0)),
+        Hunk(ChangeType.CHANGED, Chunk(3, 3, ['c\n']), Chunk(2, 2, ['C\n'])),
+        Hunk(ChangeType.ADDED, Chunk(4, 4), Chunk(4, 4, ['e\n'])),
+    ]
+
+def test_diff_is_minimal_and_reconstructs_after():
+    generator = random.Random(42)
+    for _ in range(300):
+        before = [generator.choice('abcd') for _ in range(generator.randint(0, 12))]
+        after = [generator.choice('abcd') for _ in range(generator.randint(0, 12))]
+        hunks = native.diff(before, after)
+        assert apply_hunks(before, hunks) == after
+        removed = sum(len(h.source.body or []) for h in hunks)
+        added = sum(len(h.destination.body or []) for h in hunks)
+        assert removed + added == len(before) + len(after) - 2 * lcs_length(before, after)
+
+def test_diff_of_large_input_anchored_on_unique_lines_reconstructs_after():
+    generator = random.Random(7)
+    before = [f'{index}\n' if index % 3 else 'common\n' for index in range(2000)]
+    after = list(before)
+    for _ in range(100):
+        position = generator.randrange(len(after))
+        if generator.random() < 0.5:
+            del after[position]
+        else:
+            after.insert(position, generator.choice(('common\n', f'new {position}\n')))
+    hunks = native.diff(before, after)
+    assert apply_hunks(before, hunks) == after
+    assert sum(len(h.source.body or []) + len(h.destination.body or []) for h in hunks) <= 200
+
+def test_gives_up_beyond_maximum_cost():
+    a, b = native.intern_lines(['a', 'b', 'c', 'd'], ['x', 'a', 'c', 'y'])
+    assert native.get_edits(a, b, max_cost=4) == native.get_edits(a, b)
+    with pytest.raises(native.CostExceeded):
+        native.get_edits(a, b, max_cost=3)
+    with pytest.raises(native.CostExceeded):
+        native.get_edits(a, b, max_cost=2)
+
+def test_formatted_diff_is_parsed_back():
+    hunks = native.diff(['a\n', 'b\n', 'c\n'], ['a\n', 'B\n', 'c\n', 'd'])
+    assert formats.parse_diff(list(formats.format_diff(hunks))) == hunks
+
+@pytest.mark.skipif(shutil.which('diff') is None, reason='The diff utility is not available')
+def test_matches_diff_utility(tmp_path):
+    before = ['#include <stdio.h>\n', '\n', 'int main() {\n', '    return 0;\n', '}\n']
+    after = ['#include <stdio.h>\n', '#include <stdlib.h>\n', '\n', 'int main() {\n', '    puts("hi");\n', '    return 1;\n', '}']
+    (tmp_path / 'before').write_text(''.join(before))
+    (tmp_path / 'after').write_text(''.join(after))
+    output = subprocess.run(['diff', tmp_path / 'before', tmp_path / 'after'], capture_output=True, text=True).stdout
+    assert native.diff(before, after) == formats.parse_diff(output.splitlines(keepends=True))
+
+def test_applies_hunks_with_offset():
+    hunks = native.diff(['a\n', 'b\n', 'c\n'], ['a\n', 'B\n', 'c\n', 'd\n'])
+    lines, rejected = native.apply(['x\n', 'y\n', 'a\n', 'b\n', 'c\n'], hunks)
+    assert lines == ['x\n', 'y\n', 'a\n', 'B\n', 'c\n', 'd\n']
+    assert rejected == []
+
+def test_prefers_closest_occurrence():
+    hunks = native.diff(['a\n', 'b\n', 'a\n'], ['a\n', 'b\n', 'A\n'])
+    lines, _ = native.apply(['a\n', 'b\n', 'a\n', 'a\n'], hunks)
+    assert lines == ['a\n', 'b\n', 'A\n', 'a\n']
+
+def test_rejects_hunks_whose_lines_are_missing():
+    hunks = native.diff(['a\n', 'b\n', 'c\n'], ['a\n', 'B\n', 'c\n', 'd\n'])
+    lines, rejected = native.apply(['q\n', 'q\n', 'q\n'], hunks)
+    assert lines == ['q\n', 'q\n', 'q\n', 'd\n']
+    assert rejected == [hunks[0]]
+
+def test_handles_missing_newline_at_end_of_file():
+    hunks = native.diff(['a\n', 'b'], ['a\n', 'b\n', 'c'])
+    lines, rejected = native.apply(['a\n', 'b'], hunks)
+    assert lines == ['a\n', 'b\n', 'c']
+    assert rejected == []
+
+@pytest.mark.skipif(shutil.which('patch') is None, reason='The patch utility is not available')
+def test_matches_patch_utility(tmp_path):
+    generator = random.Random(7)
+    before = [f'line {i}\n' for i in range(200)]
+    after = list(before)
+    for i in sorted(generator.sample(range(200), 20), reverse=True):
+        after[i:i + 1] = [f'changed {i}\n', f'added {i}\n'] if i % 2 else []
+    target = [f'extra {i}\n' for i in range(5)] + before[:100] + [f'extra {i}\n' for i in range(5, 10)] + before[100:]
+    (tmp_path / 'target').write_text(''.join(target))
+    (tmp_path / 'diff.patch').write_text(''.join(formats.format_diff(native.diff(before, after))))
+    subprocess.run(['patch', '-f', '-s', tmp_path / 'target', tmp_path / 'diff.patch'], check=True)
+    lines, rejected = native.apply(target, native.diff(before, after))
+    assert lines == (tmp_path / 'target').read_text().splitlines(keepends=True)
+    assert rejected == []
+
+@pytest.mark.skipif(shutil.which('diff') is None, reason='The diff utility is not available')
+def test_matches_unified_diff_utility(tmp_path):
+    generator = random.Random(11)
+    before = [f'line {i}\n' for i in range(100)]
+    after = [line if generator.random() < 0.8 else f'new {line}' for line in before if generator.random() < 0.9]
+    (tmp_path / 'before').write_text(''.join(before))
+    (tmp_path / 'after').write_text(''.join(after))
+    output = subprocess.run(['diff', '-U3', tmp_path / 'before', tmp_path / 'after'], capture_output=True, text=True).stdout
+    assert native.diff(before, after, context=3) == formats.parse_unified(output.splitlines(keepends=True))
+
+def test_places_added_lines_by_context():
+    hunks = native.diff(['a\n', 'b\n', 'x\n', 'c\n', 'd\n', 'x\n'], ['a\n', 'b\n', 'x\n', 'c\n', 'd\n', 'x\n', 'e\n'], context=2)
+    lines, rejected = native.apply(['c\n', 'd\n', 'x\n', 'a\n', 'b\n', 'x\n'], hunks)
+    assert lines == ['c\n', 'd\n', 'x\n', 'e\n', 'a\n', 'b\n', 'x\n']
+    assert rejected == []
+
+def test_ignores_outer_context_lines_with_fuzz():
+    hunks = native.diff(['a\n', 'b\n', 'c\n', 'd\n', 'e\n'], ['a\n', 'b\n', 'C\n', 'd\n', 'e\n'], context=2)
+    lines, rejected = native.apply(['A\n', 'b\n', 'c\n', 'd\n', 'E\n'], hunks)
+    assert lines == ['A\n', 'b\n', 'C\n', 'd\n', 'E\n']
+    assert rejected == []
+    assert native.apply(['A\n', 'b\n', 'c\n', 'd\n', 'E\n'], hunks, max_fuzz=0) == (['A\n', 'b\n', 'c\n', 'd\n', 'E\n'], hunks)
+
+def test_reversed_hunks_undo_the_change():
+    before, after = ['a\n', 'b\n', 'c\n', 'd\n'], ['a\n', 'B\n', 'c\n', 'e\n', 'd\n']
+    hunks = native.diff(before, after)
+    assert native.apply(after, [native.reverse(hunk) for hunk in hunks]) == (before, [])
+
+@pytest.mark.parametrize('context', [0, 1])
+def test_finds_hunks_applied_by_hand(context):
+    before = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n', 'f\n']
+    hunks = native.diff(before, ['a\n', 'B\n', 'c\n', 'x\n', 'd\n', 'f\n'], context)
+    assert [hunk.type for hunk in hunks] == [ChangeType.CHANGED, ChangeType.ADDED, ChangeType.DELETED]
+    applied = native.find_applied(['z\n', 'a\n', 'B\n', 'c\n', 'd\n', 'f\n'], hunks)
+    # The deletion is told applied by its context only
+    assert applied == ([hunks[0], hunks[2]] if context else [hunks[0]])
+
+@pytest.mark.skipif(shutil.which('patch') is None, reason='The patch utility is not available')
+def test_matches_patch_utility_with_unified_diff(tmp_path):
+    generator = random.Random(7)
+    before = [f'line {i}\n' for i in range(200)]
+    after = list(before)
+    for i in sorted(generator.sample(range(200), 20), reverse=True):
+        after[i:i + 1] = [f'changed {i}\n', f'added {i}\n'] if i % 2 else []
+    target = [f'extra {i}\n' for i in range(5)] + before[:100] + [f'extra {i}\n' for i in range(5, 10)] + before[100:]
+    hunks = native.diff(before, after, context=3)
+    (tmp_path / 'target').write_text(''.join(target))
+    (tmp_path / 'diff.patch').write_text(''.join(formats.format_unified(hunks)))
+    subprocess.run(['patch', '-f', '-s', tmp_path / 'target', tmp_path / 'diff.patch'], check=True)
+    lines, rejected = native.apply(target, hunks)
+    assert lines == (tmp_path / 'target').read_text().splitlines(keepends=True)
+    assert rejected == []
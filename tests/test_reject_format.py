@@ -45,3 +45,17 @@ def test_parse_reject_raises_on_garbage():
 
 def test_returns_empty_list_on_empty_input():
     assert formats.parse_reject([]) == []
+
+def test_parses_reject_from_iterator():
+    lines = iter(['*** /dev/null', '--- /dev/null', '***************', '*** 6', '- bye', '--- 0 -----'])
+    hunks = list(formats.iter_reject(lines))
+    assert len(hunks) == 1
+    assert hunks[0].source.body == ['bye']
+
+def test_parse_reject_raises_on_body_outside_of_hunk():
+    with pytest.raises(formats.FormatError):
+        formats.parse_reject(['skip', 'skip', '- hello'])
+
+def test_parse_reject_requires_long_separator():
+    with pytest.raises(formats.FormatError):
+        formats.parse_reject(['skip', 'skip', '*****'])
@@ -0,0 +1,84 @@
+from pathlib import Path
+import json
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+import report
+
+BEFORE = 'int f(void)\n{\n    return 0;\n}\n\nint g(void)\n{\n    return 1;\n}\n'
+AFTER = BEFORE.replace('return 0;', 'return 2;').replace('return 1;', 'return 3;')
+
+@pytest.fixture
+def campaign(tmp_path):
+    (tmp_path / 'before.c').write_text(BEFORE)
+    (tmp_path / 'after.c').write_text(AFTER)
+    targets = {
+        'v1': BEFORE,
+        'v2': BEFORE.replace('return 1;', 'return -1;'),
+        'v3': BEFORE.replace('return', 'return (int)'),
+    }
+    (tmp_path / 'logs').mkdir()
+    for branch, content in targets.items():
+        (tmp_path / branch).mkdir()
+        (tmp_path / branch / 'f.c').write_text(content)
+        backport.run_merge([str(tmp_path / 'before.c'), str(tmp_path / 'after.c'), str(tmp_path / branch / 'f.c'),
+                            '-l', str(tmp_path / 'logs' / f'{branch}.json')])
+    return tmp_path
+
+def run_report(campaign, *options):
+    backport.run_report([str(campaign / 'index.db'), str(campaign / 'logs'), '-j', '1', *options])
+
+def read_rows(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+def test_counts_rejected_hunks_by_file_and_branch(campaign, capsys):
+    file = str(campaign / 'after.c')
+    run_report(campaign)
+    assert read_rows(capsys) == [{'file': file, 'rejected': 3, 'merges': 3, 'branches': 3}]
+    run_report(campaign, '--by', 'branch', '--branch-pattern', r'/(v\d)/')
+    assert read_rows(capsys) == [{'branch': 'v3', 'rejected': 2, 'merges': 1, 'files': 1},
+                                 {'branch': 'v2', 'rejected': 1, 'merges': 1, 'files': 1}]
+
+def test_counts_rejected_hunks_by_symbol_and_range(campaign, capsys):
+    file = str(campaign / 'after.c')
+    run_report(campaign, '--by', 'symbol')
+    assert read_rows(capsys) == [{'file': file, 'symbol': 'g', 'rejected': 2, 'branches': 2},
+                                 {'file': file, 'symbol': 'f', 'rejected': 1, 'branches': 1}]
+    run_report(campaign, '--by', 'range', '--limit', '1')
+    assert read_rows(capsys) == [{'file': file, 'begin': 8, 'end': 8, 'rejected': 2, 'branches': 2}]
+
+def test_skips_unchanged_logs(campaign, capsys, monkeypatch):
+    run_report(campaign)
+    read_rows(capsys)
+    monkeypatch.setattr('report.read_log', lambda *args, **kwargs: pytest.fail('The log must not be read again'))
+    run_report(campaign)
+    assert read_rows(capsys)[0]['rejected'] == 3
+
+def test_replaces_changed_logs(campaign, capsys):
+    run_report(campaign)
+    read_rows(capsys)
+    (campaign / 'logs' / 'v3.json').write_text(json.dumps({'before': 'b', 'after': 'a', 'target': 't', 'hunks': []}))
+    run_report(campaign)
+    assert read_rows(capsys)[0]['rejected'] == 1
+
+def test_reads_tree_logs(tmp_path):
+    for tree, content in (('before', BEFORE), ('after', AFTER), ('target', BEFORE.replace('return 0;', 'return -0;'))):
+        (tmp_path / tree).mkdir()
+        (tmp_path / tree / 'f.c').write_text(content)
+    log = tmp_path / 'tree.json'
+    backport.run_tree([str(tmp_path / tree) for tree in ('before', 'after', 'target')] + ['-l', str(log), '-j', '1'])
+    assert report.read_log(str(log)) == [report.Merge(str(tmp_path / 'after' / 'f.c'),
+                                                      str(tmp_path / 'target' / 'f.c'), 2, [(3, 3, 'f')])]
+
+def test_reports_malformed_logs(campaign, capsys):
+    (campaign / 'logs' / 'broken.json').write_text('{"before": ')
+    with pytest.raises(SystemExit) as e:
+        run_report(campaign)
+    assert e.value.code == backport.ExitCodes.RUNTIME_ERROR.value
+    assert 'broken.json' in capsys.readouterr().err
+
+def test_extracts_branch():
+    assert report.get_branch('/src/stable-5.10/drivers/x.c', r'stable-[\d.]+') == 'stable-5.10'
+    assert report.get_branch('/src/v1/x.c', r'/(v\d)/') == 'v1'
+    assert report.get_branch('/src/v1/x.c') == '/src/v1'
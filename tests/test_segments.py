@@ -0,0 +1,68 @@
+from pathlib import Path
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute() / 'benchmarks'))
+from formats import PatchFormat
+import backport
+import formats
+import generate
+import native
+
+def test_segments_begin_with_hunks():
+    diff = b'1c1\n< a\n---\n> b\n3a4\n> c\n7d7\n< 8\n'
+    segments = formats.find_segments(diff, PatchFormat.NORMAL, 3)
+    assert segments == [(0, 16), (16, 24), (24, len(diff))]
+    reject = b'*** t\n--- t\n***************\n*** 3\n- ***************\n--- 3 -----\n+ b\n***************\n*** 9\n'
+    assert formats.find_segments(reject, PatchFormat.REJECT, 2) == [(0, 68), (68, len(reject))]
+
+def test_segments_are_never_empty():
+    diff = b'1c1\n< a\n---\n> b\n'
+    assert formats.find_segments(diff, PatchFormat.NORMAL, 8) == [(0, len(diff))]
+    assert formats.find_segments(b'', PatchFormat.UNIFIED, 4) == [(0, 0)]
+
+@pytest.fixture(scope='module')
+def hunks():
+    before, after, _ = generate.generate_triple(3000, 60, 3, seed=2)
+    # The last line lacks its line feed
+    after[-1] = after[-1].rstrip('\n') + 'é'
+    return before, after
+
+@pytest.mark.parametrize('context', [0, 3])
+def test_parallel_parsing_matches_the_serial_one(tmp_path, hunks, context):
+    patch = tmp_path / 'diff.patch'
+    with open(patch, 'w', newline='\n') as f:
+        f.writelines(backport.format_patch(native.diff(*hunks, context), context))
+    serial = list(backport.iter_patch(backport.System.iter_lines(str(patch)), context))
+    patch_format = PatchFormat.UNIFIED if context else PatchFormat.NORMAL
+    assert backport.parse_patch_file(str(patch), patch_format, jobs=4) == serial
+
+def test_parallel_parsing_of_rejects_matches_the_serial_one(tmp_path, hunks):
+    reject = tmp_path / 'reject'
+    reject.write_text(''.join(generate.format_reject(native.diff(*hunks))))
+    serial = formats.parse_reject(backport.System.iter_lines(str(reject)))
+    assert backport.parse_patch_file(str(reject), PatchFormat.REJECT, jobs=4) == serial
+
+def test_parallel_parsing_raises_format_errors(tmp_path):
+    patch = tmp_path / 'diff.patch'
+    patch.write_text('1c1\n< a\n---\n> b\n' * 10 + 'garbage\n')
+    with pytest.raises(formats.FormatError):
+        backport.parse_patch_file(str(patch), PatchFormat.NORMAL, jobs=2)
+
+@pytest.mark.parametrize('context', [0, 3])
+def test_large_patches_are_parsed_in_parallel(tmp_path, monkeypatch, context):
+    (tmp_path / 'before').write_text('a\nb\nc\nd\ne\nf\ng\nh\n')
+    (tmp_path / 'after').write_text('a\nb\nB1\nB2\nc\nd\ne\nf\nG\nh\n')
+    (tmp_path / 'target').write_text('x\ny\nz\na\nb\nc\nd\ne\nf\nQ\nh\n')
+    paths = [str(tmp_path / name) for name in ('before', 'after', 'target')]
+    target = (tmp_path / 'target').read_text()
+    serial = backport.merge(*paths, backport.Engine.EXTERNAL, context=context)
+    (tmp_path / 'target').write_text(target)
+    monkeypatch.setattr('backport.PARALLEL_PARSE_SIZE', 0)
+    monkeypatch.setattr('os.cpu_count', lambda: 2)
+    parsed = []
+    parse_patch_file = backport.parse_patch_file
+    monkeypatch.setattr('backport.parse_patch_file', lambda *args: parsed.append(args[1]) or parse_patch_file(*args))
+    hunks = backport.merge(*paths, backport.Engine.EXTERNAL, context=context)
+    assert parsed == ([PatchFormat.UNIFIED] * 2 if context else [PatchFormat.NORMAL, PatchFormat.REJECT])
+    assert hunks == serial
@@ -1,5 +1,6 @@
 from pathlib import Path
 from unittest.mock import Mock, MagicMock
+import json
 import pytest
 import sys
 
@@ -9,7 +10,7 @@ import backport
 
 def test_temp_directory_is_used_for_diff_and_patch(mock_tempdir, mock_system):
     mock_tempdir.return_value.__enter__.return_value = 'testdir'
-    backport.merge('before', 'after', 'target')
+    backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
     assert mock_system.diff.call_args.args[2] == 'testdir/diff.patch'
     assert mock_system.patch.call_args.args[1] == 'testdir/diff.patch'
     assert mock_system.patch.call_args.args[2] == 'testdir/reject'
@@ -17,7 +18,7 @@ def test_temp_directory_is_used_for_diff_and_patch(mock_tempdir, mock_system):
 def test_patch_is_applied_to_target(mock_system, mock_tempdir):
     mock_system.diff.return_value = Mock(returncode=1)
     mock_system.patch.return_value = Mock(returncode=0)
-    backport.merge('before', 'after', 'target')
+    backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
     assert mock_system.patch.call_args.args[0] == 'target'
 
 def test_diff_throws_on_trouble(mock_system):
@@ -25,12 +26,12 @@ def test_diff_throws_on_trouble(mock_system):
     mock_system.diff.return_value.returncode = 2
     mock_system.patch.return_value.returncode = 0
     with pytest.raises(RuntimeError):
-        backport.merge('before.c', 'after.c', 'tempdir')
+        backport.merge('before.c', 'after.c', 'tempdir', backport.Engine.EXTERNAL)
 
 def test_system_is_used_for_patch(mock_system, mock_tempdir):
     mock_tempdir.return_value.__enter__.return_value = 'tempdir'
     mock_system.patch.return_value.returncode = 0
-    backport.merge('before', 'after', 'target')
+    backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
     assert mock_system.patch.call_args.args == ('target', 'tempdir/diff.patch', 'tempdir/reject',)
 
 
@@ -38,7 +39,7 @@ def test_throws_if_patching_fails_for_other_reason(mock_system):
     # Exit code different from merge conflict
     mock_system.patch.return_value.returncode = 2 
     with pytest.raises(RuntimeError):
-        backport.merge('before', 'after', 'target')
+        backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
 
 def test_system_redirects_diff_output_to_patch_file(monkeypatch):
     run = Mock()
@@ -53,32 +54,36 @@ def test_system_invokes_patch(monkeypatch):
     assert run.call_args.args == ('patch -f -r reject target patch',)
 
 def test_patch_parses_diff_file_contents(mock_system, monkeypatch):
-    mock_system.read_lines.side_effect = [
-        ['diff line 1', 'diff line 2'],
-        ['skip', 'skip'],
+    mock_system.iter_lines.side_effect = [
+        iter(['diff line 1', 'diff line 2']),
+        iter(['skip', 'skip']),
     ]
-    parse_diff = Mock()
     parsed_hunks = [Hunk(ChangeType.ADDED, Chunk(begin=1), None)]
-    parse_diff.return_value = parsed_hunks
-    monkeypatch.setattr('formats.parse_diff', parse_diff)
-    hunks = backport.merge('before', 'after', 'target')
-    assert parse_diff.call_args.args[0] == ['diff line 1', 'diff line 2']
+    received = []
+    def iter_diff(lines):
+        received.extend(lines)
+        return iter(parsed_hunks)
+    monkeypatch.setattr('formats.iter_diff', iter_diff)
+    hunks = backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
+    assert received == ['diff line 1', 'diff line 2']
     assert list(hunks.values()) == parsed_hunks
 
 def test_reject_parses_the_reject_file(mock_system, mock_tempdir, monkeypatch):
     mock_tempdir.return_value.__enter__.return_value = 'testdir'
     mock_system.patch.return_value.returncode = 1 # There are conflicts
-    mock_system.read_lines = lambda fn: {
+    mock_system.iter_lines = lambda fn: iter({
             'testdir/diff.patch': [],
             'target': ['target line 1', 'target line 2'],
             'testdir/reject': ['reject line 1', 'reject line 2']
-    }.get(fn, [])
-    parse_reject = Mock()
+    }.get(fn, []))
     parsed_hunks = [Hunk(ChangeType.CHANGED, Chunk(2, 3, []), Chunk(2, 3, []))]
-    parse_reject.return_value = parsed_hunks
-    monkeypatch.setattr('formats.parse_reject', parse_reject)
-    hunks = backport.merge('before', 'after', 'target')
-    assert parse_reject.call_args.args[0] == ['reject line 1', 'reject line 2']
+    received = []
+    def iter_reject(lines):
+        received.extend(lines)
+        return iter(parsed_hunks)
+    monkeypatch.setattr('formats.iter_reject', iter_reject)
+    hunks = backport.merge('before', 'after', 'target', backport.Engine.EXTERNAL)
+    assert received == ['reject line 1', 'reject line 2']
     assert list(hunks.values()) == parsed_hunks
 
 def test_finds_conflicts():
@@ -87,4 +92,125 @@ def test_finds_conflicts():
         Chunk(1, 2, ['Hello', 'World']),
         Chunk(1, 2, ['Hello', 'World!'])
     )
-    assert backport.get_conflicts(hunk) == {2: ('World', 'World!')}
\ No newline at end of file
+    assert backport.get_conflicts(hunk) == {2: ('World', 'World!')}
+
+def test_conflicts_are_aligned():
+    hunk = Hunk(
+        ChangeType.CHANGED,
+        Chunk(10, 13, ['a\n', 'b\n', 'c\n', 'd\n']),
+        Chunk(10, 13, ['new\n', 'a\n', 'B\n', 'c\n'])
+    )
+    # The inserted line shifts the following ones without making them conflicts
+    assert backport.get_conflicts(hunk) == {11: ('b', 'B'), 13: ('d', None)}
+
+def test_conflicts_of_rewritten_hunks_are_paired_by_position():
+    source = [f'old {i}' for i in range(1000)]
+    destination = [f'new {i}' for i in range(999)]
+    destination[500] = source[500]
+    hunk = Hunk(ChangeType.CHANGED, Chunk(1, 1000, source), Chunk(1, 999, destination))
+    conflicts = backport.get_conflicts(hunk)
+    assert len(conflicts) == 999 and 501 not in conflicts
+    assert conflicts[1] == ('old 0', 'new 0') and conflicts[1000] == ('old 999', None)
+
+def test_conflicts_may_ignore_whitespace():
+    hunk = Hunk(ChangeType.CHANGED, Chunk(1, 2, ['if (x) {', '  y();']), Chunk(1, 2, ['if (x)  {', '\ty(1);']))
+    assert backport.get_conflicts(hunk) == {1: ('if (x) {', 'if (x)  {'), 2: ('  y();', '\ty(1);')}
+    assert backport.get_conflicts(hunk, ignore_whitespace=True) == {2: ('  y();', '\ty(1);')}
+
+def test_ignores_whitespace_in_conflicts_of_merge(tmp_path):
+    (tmp_path / 'before').write_text('a\nb\nc\n')
+    (tmp_path / 'after').write_text('a\n b\nC\n')
+    (tmp_path / 'target').write_text('x\nb\nd\n')
+    backport.run_merge([str(tmp_path / name) for name in ('before', 'after', 'target')] + ['-w', '-l', str(tmp_path / 'log.json')])
+    [hunk] = json.loads((tmp_path / 'log.json').read_text())['hunks']
+    assert hunk['conflicts'] == {'3': ['c', 'C']}
+
+def test_native_engine_writes_patched_target(mock_system):
+    mock_system.read_lines.side_effect = [['hello\n'], ['salut\n'], ['first\n', 'hello\n']]
+    hunks = backport.merge('before', 'after', 'target', backport.Engine.NATIVE)
+    assert not mock_system.diff.called
+    assert not mock_system.patch.called
+    path, lines = mock_system.write_lines.call_args.args
+    assert (path, list(lines)) == ('target', ['first\n', 'salut\n'])
+    assert hunks[1].conflicts is None
+
+def test_native_engine_records_conflicts_of_rejected_hunks(mock_system):
+    mock_system.read_lines.side_effect = [['hello\n'], ['salut\n'], ['bonjour\n'], ['hello\n']]
+    hunks = backport.merge('before', 'after', 'target', backport.Engine.NATIVE)
+    path, lines = mock_system.write_lines.call_args.args
+    assert (path, list(lines)) == ('target', ['bonjour\n'])
+    assert hunks[1].conflicts == {1: ('hello', 'salut')}
+
+def test_system_quotes_paths(monkeypatch):
+    run = Mock()
+    monkeypatch.setattr('subprocess.run', run)
+    backport.System.diff('my before', 'after', 'patch')
+    assert run.call_args.args == ("diff 'my before' after > patch",)
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / 'my before').write_text('a\nb\nc\n')
+    (tmp_path / 'my after').write_text('a\nB\nc\nd\n')
+    return lambda name: str(tmp_path / name)
+
+@pytest.mark.parametrize('engine', [backport.Engine.PIPE, backport.Engine.EXTERNAL])
+def test_external_engines_merge_paths_with_spaces(files, engine):
+    Path(files('my target')).write_text('x\na\nb\nc\n')
+    hunks = backport.merge(files('my before'), files('my after'), files('my target'), engine)
+    assert Path(files('my target')).read_text() == 'x\na\nB\nc\nd\n'
+    assert [hunk.conflicts for hunk in hunks.values()] == [None, None]
+
+def test_pipe_engine_parses_rejects(files):
+    Path(files('my target')).write_text('q\nq\nq\n')
+    hunks = backport.merge(files('my before'), files('my after'), files('my target'), backport.Engine.PIPE)
+    assert hunks[2].conflicts == {2: ('b', 'B')}
+    assert hunks[3].conflicts is None
+
+def test_pipe_engine_spawns_no_shell(files, monkeypatch):
+    spawn = backport.System.spawn
+    calls = []
+    monkeypatch.setattr('backport.System.spawn', lambda args, **kwargs: calls.append(args) or spawn(args, **kwargs))
+    Path(files('my target')).write_text('a\nb\nc\n')
+    backport.merge(files('my before'), files('my after'), files('my target'), backport.Engine.PIPE)
+    assert [args[0] for args in calls] == ['patch', 'diff']
+
+def test_pipe_engine_reports_decoded_error_of_diff(files):
+    Path(files('my target')).write_text('a\nb\nc\n')
+    with pytest.raises(RuntimeError) as error:
+        backport.merge(files('my before'), files('missing'), files('my target'), backport.Engine.PIPE)
+    assert "b'" not in error.value.args[0] and 'missing' in error.value.args[0]
+
+@pytest.mark.parametrize('engine', list(backport.Engine))
+def test_engines_merge_with_context(files, engine):
+    Path(files('my target')).write_text('q\nq\nq\na\nb\nc\n')
+    hunks = backport.merge(files('my before'), files('my after'), files('my target'), engine, context=1)
+    assert Path(files('my target')).read_text() == 'q\nq\nq\na\nB\nc\nd\n'
+    assert [hunk.conflicts for hunk in hunks.values()] == [None, None]
+
+@pytest.mark.parametrize('engine', [backport.Engine.PIPE, backport.Engine.EXTERNAL])
+def test_rejects_are_matched_to_shifted_hunks(tmp_path, engine):
+    (tmp_path / 'before').write_text('a\nb\nc\nd\ne\nf\ng\nh\n')
+    (tmp_path / 'after').write_text('a\nb\nB1\nB2\nc\nd\ne\nf\nG\nh\n')
+    (tmp_path / 'target').write_text('x\ny\nz\na\nb\nc\nd\ne\nf\nQ\nh\n')
+    # The patch utility numbers the reject 9, after the lines added by the first hunk
+    hunks = backport.merge(*(str(tmp_path / name) for name in ('before', 'after', 'target')), engine)
+    assert list(hunks) == [2, 7]
+    assert [hunk.conflicts for hunk in hunks.values()] == [None, {7: ('g', 'G')}]
+
+@pytest.mark.parametrize('argv', [
+    ['before', 'after', 'target'], ['batch', 'manifest.jsonl'], ['tree', 'before', 'after', 'target'], ['serve'],
+    ['git', 'repository', 'before', 'after'],
+])
+def test_commands_reject_negative_context(argv):
+    with pytest.raises(SystemExit) as e:
+        backport.main([*argv, '-U', '-1'])
+    assert e.value.code == backport.ExitCodes.BAD_ARGUMENT.value
+
+@pytest.mark.parametrize('argv', [
+    ['before', 'after', 'target', 'other'], ['batch', 'manifest.jsonl'], ['tree', 'before', 'after', 'target'], ['serve'],
+    ['git', 'repository', 'before', 'after'], ['report', 'index.db'],
+])
+def test_commands_reject_non_positive_jobs(argv):
+    with pytest.raises(SystemExit) as e:
+        backport.main([*argv, '-j', '0'])
+    assert e.value.code == backport.ExitCodes.BAD_ARGUMENT.value
@@ -0,0 +1,45 @@
+from pathlib import Path
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+import backport
+import timing
+
+def test_phase_is_noop_without_profile():
+    with timing.Phase('diff') as phase:
+        phase.count(hunks=1)
+    assert not timing.is_profiling()
+
+def test_accumulates_phases_and_counters():
+    with timing.profiling() as profile:
+        for hunks in (1, 2):
+            with timing.Phase('diff') as phase:
+                phase.count(hunks=hunks)
+    phases = profile.to_dict()
+    assert phases['diff']['calls'] == 2
+    assert phases['diff']['hunks'] == 3
+    assert phases['diff']['time'] >= 0
+
+def test_hooks_receive_timings():
+    received = []
+    timing.add_hook(received.append)
+    try:
+        with timing.profiling():
+            with timing.Phase('patch'):
+                pass
+    finally:
+        timing.remove_hook(received.append)
+    assert list(received[0]) == ['patch']
+
+def test_merges_timings():
+    timings = timing.merge_timings([{'diff': {'time': 1.0, 'calls': 1}}, {'diff': {'time': 2.0, 'calls': 1, 'hunks': 3}}])
+    assert timings == {'diff': {'time': 3.0, 'calls': 2, 'hunks': 3}}
+
+def test_merge_records_every_phase(triple):
+    paths = triple('merge', 'bonjour\n')
+    with timing.profiling() as profile:
+        backport.merge(paths['before'], paths['after'], paths['target'], backport.Engine.NATIVE)
+    phases = profile.to_dict()
+    assert list(phases) == ['read', 'diff', 'apply', 'relocate', 'write', 'conflicts']
+    assert phases['read']['lines'] == 3
+    assert phases['apply']['rejected'] == 1
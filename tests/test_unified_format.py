@@ -0,0 +1,84 @@
+from pathlib import Path
+import pytest
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+from formats import ChangeType
+import formats
+
+UNIFIED = [
+    '--- before\t2024-01-01 00:00:00\n',
+    '+++ after\t2024-01-01 00:00:00\n',
+    '@@ -1,7 +1,7 @@\n',
+    ' a\n',
+    '-b\n',
+    '+B\n',
+    ' c\n',
+    ' d\n',
+    '-e\n',
+    ' f\n',
+    '+g\n',
+    ' h\n',
+    '@@ -20,0 +21,2 @@\n',
+    '+x\n',
+    '+y\n',
+]
+
+def test_splits_hunks_into_blocks_with_normal_coordinates():
+    hunks = formats.parse_unified(UNIFIED)
+    assert [(h.type, h.source.begin, h.source.end, h.destination.begin, h.destination.end) for h in hunks] == [
+        (ChangeType.CHANGED, 2, 2, 2, 2),
+        (ChangeType.DELETED, 5, 5, 4, 4),
+        (ChangeType.ADDED, 6, 6, 6, 6),
+        (ChangeType.ADDED, 20, 20, 21, 22),
+    ]
+    assert hunks[0].source.body == ['b\n'] and hunks[0].destination.body == ['B\n']
+    assert hunks[3].source.body is None and hunks[3].destination.body == ['x\n', 'y\n']
+
+def test_keeps_context_around_blocks():
+    hunks = formats.parse_unified(UNIFIED)
+    assert [(h.leading, h.trailing) for h in hunks] == [
+        (['a\n'], ['c\n', 'd\n']),
+        (['c\n', 'd\n'], ['f\n']),
+        (['f\n'], ['h\n']),
+        ([], []),
+    ]
+
+def test_matches_normal_format():
+    normal = ['2c2\n', '< b\n', '---\n', '> B\n', '5d4\n', '< e\n', '6a6\n', '> g\n', '20a21,22\n', '> x\n', '> y\n']
+    assert [(h.type, h.source, h.destination) for h in formats.parse_unified(UNIFIED)] == \
+        [(h.type, h.source, h.destination) for h in formats.parse_diff(normal)]
+
+def test_formats_hunks_back():
+    assert list(formats.format_unified(formats.parse_unified(UNIFIED)))[2:] == UNIFIED[2:]
+
+def test_formats_distant_hunks_separately():
+    hunks = formats.parse_unified(UNIFIED)
+    hunks[0].leading = hunks[0].trailing = []
+    hunks[1].leading, hunks[1].trailing = ['d\n'], []
+    lines = list(formats.format_unified(hunks[:2]))
+    assert lines[2:] == ['@@ -2 +2 @@\n', '-b\n', '+B\n', '@@ -4,2 +4 @@\n', ' d\n', '-e\n']
+
+def test_handles_missing_newline_at_end_of_file():
+    lines = ['@@ -1,2 +1,2 @@\n', ' a\n', '-b\n', '\\ No newline at end of file\n', '+c\n', '\\ No newline at end of file\n']
+    [hunk] = formats.parse_unified(lines)
+    assert hunk.source.body == ['b'] and hunk.destination.body == ['c']
+    assert list(formats.format_unified([hunk]))[2:] == lines
+
+def test_throws_on_bad_header():
+    with pytest.raises(formats.FormatError):
+        formats.parse_unified(['@@ -1,a +1 @@\n'])
+
+def test_throws_on_truncated_hunk():
+    with pytest.raises(formats.FormatError):
+        formats.parse_unified(['@@ -1,3 +1,3 @@\n', ' a\n', '-b\n', '+B\n'])
+
+def test_iterates_hunks_lazily():
+    def lines():
+        yield '@@ -1,2 +1,2 @@\n'
+        yield '-a\n'
+        yield '+A\n'
+        yield ' b\n'
+        yield '@@ -5 +5 @@\n'
+        raise AssertionError('The second hunk must not be read before the first one is consumed')
+    hunk = next(formats.iter_unified(lines()))
+    assert hunk.destination.body == ['A\n'] and hunk.trailing == ['b\n']
@@ -0,0 +1,93 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+Timings = Dict[str, Dict[str, float]]
+
+class Profile:
+    """Accumulates the wall time, the number of calls and the counters (lines, hunks, etc.) of every
+    phase of the merges performed while the profile is active."""
+
+    def __init__(self):
+        self.phases: Timings = {}
+
+    def record(self, name: str, duration: float, counters: Dict[str, int]):
+        phase = self.phases.setdefault(name, {'time': 0.0, 'calls': 0})
+        phase['time'] += duration
+        phase['calls'] += 1
+        for counter, value in counters.items():
+            phase[counter] = phase.get(counter, 0) + value
+
+    def to_dict(self) -> Timings:
+        return {name: dict(phase) for name, phase in self.phases.items()}
+
+_current: ContextVar[Optional[Profile]] = ContextVar('profile', default=None)
+_hooks: List[Callable[[Timings], None]] = []
+
+def add_hook(hook: Callable[[Timings], None]):
+    """Registers a callable receiving the timings of every profiling session once it is over."""
+    _hooks.append(hook)
+
+def remove_hook(hook: Callable[[Timings], None]):
+    _hooks.remove(hook)
+
+def is_profiling() -> bool:
+    return _current.get() is not None
+
+def add_timings(timings: Timings):
+    """Adds the timings collected elsewhere, e.g. in a worker process, to the active profile."""
+    profile = _current.get()
+    if profile:
+        for name, values in timings.items():
+            phase = profile.phases.setdefault(name, {'time': 0.0, 'calls': 0})
+            for key, value in values.items():
+                phase[key] = phase.get(key, 0) + value
+
+@contextmanager
+def profiling() -> Iterator[Profile]:
+    profile = Profile()
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        for hook in _hooks:
+            hook(profile.to_dict())
+
+class Phase:
+    """Measures the enclosed block as the phase <name> of the active profile, if any."""
+    __slots__ = ('name', 'counters', '_profile', '_start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counters: Dict[str, int] = {}
+
+    def count(self, **counters: int):
+        self.counters.update(counters)
+
+    def __enter__(self) -> 'Phase':
+        self._profile = _current.get()
+        if self._profile:
+            self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profile:
+            self._profile.record(self.name, perf_counter() - self._start, self.counters)
+
+def merge_timings(timings: List[Timings]) -> Timings:
+    result: Timings = {}
+    for phases in timings:
+        for name, values in phases.items():
+            phase = result.setdefault(name, {})
+            for key, value in values.items():
+                phase[key] = phase.get(key, 0) + value
+    return result
+
+def format_timings(timings: Timings) -> str:
+    lines = [f'{"phase":<14}{"time, ms":>12}{"calls":>8}  counters']
+    for name, values in timings.items():
+        counters = ', '.join(f'{key}={value}' for key, value in values.items() if key not in ('time', 'calls'))
+        lines.append(f'{name:<14}{values["time"] * 1000:>12.3f}{values["calls"]:>8}  {counters}')
+    return '\n'.join(lines) + '\n'